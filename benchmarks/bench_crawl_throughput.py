@@ -0,0 +1,75 @@
+"""Benchmark: whole crawl throughput (download -> parse -> clean -> store) against the local mock server.
+
+Starts deal_scraper.mockserver in a background thread, runs bestbuy_spider against it with the
+project settings and a throwaway SQLite database, and prints pages/s and items/s.
+
+Run from the repo root:
+    python -m benchmarks.bench_crawl_throughput [--products 1000] [--latency-ms 50] [--throttle-rate 0.01]
+Project settings can be overridden with -s NAME=VALUE, e.g. -s CONCURRENT_REQUESTS=16 -s PARSE_PROCESS_WORKERS=4
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.project import get_project_settings
+from deal_scraper.mockserver import MockBestBuyServer
+from deal_scraper.spiders.bestbuy_spider import BestBuySpider
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--page-size-kb', type=int, default=300)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--latency-sigma', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--sold-out-ratio', type=float, default=0.1)
+    parser.add_argument('-s', dest='overrides', action='append', default=[], metavar='NAME=VALUE')
+    args = parser.parse_args()
+
+    server = MockBestBuyServer(
+        ('127.0.0.1', 0), catalog_size=args.products, page_size_kb=args.page_size_kb, latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma, error_rate=args.error_rate, throttle_rate=args.throttle_rate,
+        sold_out_ratio=args.sold_out_ratio,
+    )
+    server.start_in_thread()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        settings = get_project_settings()
+        settings.setdict({
+            'DATABASE_URL': f'sqlite:///{Path(tmp_dir) / "laptops.db"}',
+            'WATCHLIST_FILENAME': str(Path(tmp_dir) / 'watchlist.json'),
+            'UPC_MISMATCH_LOG': str(Path(tmp_dir) / 'mismatch_log.txt'),
+            'ALERT_DISCOUNT_THRESHOLD': 0,
+            'CHECKPOINT_FILE': None,
+            'CONDITIONAL_GET_ENABLED': False,
+            'LOG_LEVEL': 'WARNING',
+        }, priority='cmdline')
+        for override in args.overrides:
+            name, value = override.split('=', 1)
+            settings.set(name, value, priority='cmdline')
+
+        process = CrawlerProcess(settings)
+        crawler = process.create_crawler(BestBuySpider)
+        process.crawl(crawler, start_url=server.start_url)
+        started = time.perf_counter()
+        process.start()
+        elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    stats = crawler.stats.get_stats()
+    pages = stats.get('response_received_count', 0)
+    items = stats.get('item_scraped_count', 0)
+    print(
+        f'{args.products} products, {args.latency_ms:.0f} ms median latency, '
+        f'{args.error_rate:.1%} errors, {args.throttle_rate:.1%} throttled, {args.sold_out_ratio:.0%} sold out'
+    )
+    print(f'{pages} pages and {items} items in {elapsed:.1f}s: {pages / elapsed:.0f} pages/s, {items / elapsed:.0f} items/s')
+    print(f'retries: {stats.get("retry/count", 0)}, finish reason: {stats.get("finish_reason")}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Measures the memory held per 1k in-flight laptops at each stage of the item's life.
+
+Reports the Python heap (tracemalloc) and the growth of the process's peak RSS (ru_maxrss), which
+also counts interpreter and allocator overhead. Each stage's RSS is measured in a fresh process,
+since the peak only ever goes up.
+
+Run from the repo root:
+    python -m benchmarks.bench_item_memory
+"""
+import multiprocessing
+import resource
+import sys
+import tracemalloc
+from pathlib import Path
+
+FIXTURE = Path(__file__).resolve().parent.parent / 'tests' / 'fixtures' / 'bestbuy_product_page.html'
+URL = 'https://www.bestbuy.com/site/laptop/6588662.p?skuId=6588662'
+ITEMS = 1000
+STAGES = 4
+
+
+def make_stages():
+    # Imported here so the parent stays small until the RSS processes have been spawned: Linux
+    # carries a process's peak RSS over into the children it spawns
+    from deal_scraper.extractors import decode_attributes, find_specifications_json, parse_product_page
+    from deal_scraper.items import LaptopItem
+    from deal_scraper.pipelines import CleaningPipeline, CommitRecord
+
+    body = FIXTURE.read_bytes()
+    fields = parse_product_page(body, sku='6588662')
+    untrimmed_attributes = decode_attributes(find_specifications_json(body))
+
+    def raw_item(attributes):
+        # Copies so every item owns its own strings, like items parsed from separate pages
+        return LaptopItem(
+            price=str(fields['price']), full_price=str(fields['full_price']), sku=str(fields['sku']),
+            link=f'{URL} ', timestamp='2025-01-29T07:09:26',
+            attributes={f'{k} ': f'{v} ' for k, v in attributes.items()},
+        )
+
+    return [
+        ('raw item, all specs', lambda: raw_item(untrimmed_attributes)),
+        ('raw item, trimmed specs', lambda: raw_item(fields['attributes'])),
+        ('cleaned item', lambda: CleaningPipeline().process_item(raw_item(fields['attributes']), spider=None)),
+        ('CommitRecord', lambda: CommitRecord(sku=f"{fields['sku']} ", upc='198154520175 ')),
+    ]
+
+
+def measure_heap(make_item):
+    """Returns (held, peak) bytes of Python heap for ITEMS objects built by make_item."""
+    tracemalloc.start()
+    items = [make_item() for _ in range(ITEMS)]
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return held, peak
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def measure_rss(stage_index, results):
+    """Runs in a fresh process: puts how far building ITEMS objects of one stage raised the peak RSS."""
+    _, make_item = make_stages()[stage_index]
+    make_item()
+    before = peak_rss_bytes()
+    items = [make_item() for _ in range(ITEMS)]
+    results.put(peak_rss_bytes() - before)
+    del items
+
+
+def main():
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    rss_growths = []
+    for stage_index in range(STAGES):
+        process = context.Process(target=measure_rss, args=(stage_index, results))
+        process.start()
+        rss_growths.append(results.get())
+        process.join()
+
+    print(f'memory per {ITEMS} items')
+    for (name, make_item), rss_growth in zip(make_stages(), rss_growths):
+        held, peak = measure_heap(make_item)
+        print(
+            f'{name:>24}: heap held {held / 1024:8.1f} KiB, heap peak {peak / 1024:8.1f} KiB, '
+            f'peak RSS +{rss_growth / 1024:8.1f} KiB'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""Micro-benchmark: selector based product page parsing vs the raw bytes extractor.
+
+Run from the repo root:
+    python -m benchmarks.bench_product_extraction
+"""
+import timeit
+from pathlib import Path
+from scrapy.http import HtmlResponse
+from deal_scraper.extractors import extract_product_page
+
+FIXTURE = Path(__file__).resolve().parent.parent / 'tests' / 'fixtures' / 'bestbuy_product_page.html'
+URL = 'https://www.bestbuy.com/site/laptop/6588662.p?skuId=6588662'
+RUNS = 20
+
+
+def selector_extraction(body):
+    # Fresh response each run so the selector isn't cached between runs
+    response = HtmlResponse(url=URL, body=body, encoding='utf-8')
+    button_state = response.css('button.add-to-cart-button::attr(data-button-state)').get()
+    specifications_json = None
+    for script in response.css('script::text').getall():
+        if 'shop-specifications-' in script:
+            specifications_json = script
+            break
+    price = response.css('div.priceView-hero-price span[aria-hidden="true"]::text').get(default='0')
+    full_price = response.css('div[data-testid="regular-price"] span[aria-hidden="true"]::text').get(price)
+    return button_state, specifications_json, price, full_price
+
+
+def bytes_extraction(body):
+    response = HtmlResponse(url=URL, body=body, encoding='utf-8')
+    return extract_product_page(response.body, sku='6588662', encoding=response.encoding)
+
+
+def main():
+    body = FIXTURE.read_bytes()
+    print(f'fixture: {len(body) / 1024:.0f} KiB, {RUNS} runs each')
+    for name, func in (('selectors', selector_extraction), ('bytes extractor', bytes_extraction)):
+        per_page = min(timeit.repeat(lambda: func(body), number=RUNS, repeat=3)) / RUNS
+        print(f'{name:>16}: {per_page * 1000:8.2f} ms/page')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""Micro-benchmark: stdlib json vs the typed msgspec decoder for the shop-specifications payload.
+
+Run from the repo root (needs msgspec installed for the fast path):
+    python -m benchmarks.bench_spec_decoding
+"""
+import timeit
+from pathlib import Path
+from deal_scraper import extractors
+from deal_scraper.extractors import decode_attributes, find_specifications_json
+
+FIXTURE = Path(__file__).resolve().parent.parent / 'tests' / 'fixtures' / 'bestbuy_product_page.html'
+RUNS = 500
+
+
+def main():
+    specifications_json = find_specifications_json(FIXTURE.read_bytes())
+    print(f'spec payload: {len(specifications_json) / 1024:.1f} KiB, {RUNS} runs each')
+
+    fast_decoder = extractors._spec_decoder
+    decoders = [('stdlib json', None)]
+    if fast_decoder is not None:
+        decoders.append(('msgspec typed', fast_decoder))
+    else:
+        print('msgspec is not installed, only timing the stdlib path')
+
+    for name, decoder in decoders:
+        extractors._spec_decoder = decoder
+        per_page = min(timeit.repeat(lambda: decode_attributes(specifications_json), number=RUNS, repeat=3)) / RUNS
+        print(f'{name:>14}: {per_page * 1e6:8.1f} us/page')
+    extractors._spec_decoder = fast_decoder
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Benchmark: bytes on the wire and connections opened per content encoding, against a local server.
+
+Serves the product page fixture from a keep-alive HTTP/1.1 server, compressed with whichever
+encoding the run asks for, crawls it with the project's TransferStats extension and prints
+wire vs. decoded bytes, pages/s and how many TCP connections the crawl opened.
+
+Run from the repo root:
+    python -m benchmarks.bench_transfer_encoding [--pages 300]
+
+With --http2 the fixture is served over TLS (with a throwaway self-signed certificate) by a
+Twisted server that speaks both HTTP/1.1 and HTTP/2, and every encoding is crawled once with
+Scrapy's HTTP/1.1 handler and once with H2DownloadHandler, so the connections column shows
+what multiplexing saves in connection (and TLS handshake) setup. The server needs
+pip install "twisted[http2]". --base-url benchmarks an external server instead:
+    python -m benchmarks.bench_transfer_encoding --http2 [--base-url https://localhost:8443]
+"""
+import argparse
+import gzip
+import ipaddress
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import brotli
+import scrapy
+from backports import zstd
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from OpenSSL import crypto
+from scrapy.crawler import CrawlerRunner
+from scrapy.utils.reactor import install_reactor
+from twisted.web import resource, server
+
+FIXTURE = Path(__file__).resolve().parent.parent / 'tests' / 'fixtures' / 'bestbuy_product_page.html'
+ENCODINGS = {
+    'identity': lambda body: body,
+    'gzip': gzip.compress,
+    'deflate': zlib.compress,
+    'br': brotli.compress,
+    'zstd': zstd.compress,
+}
+
+
+# Download handler for https urls per protocol, the HTTP/1.1 one being Scrapy's default
+DOWNLOAD_HANDLERS = {
+    'HTTP/1.1': {},
+    'h2': {'https': 'scrapy.core.downloader.handlers.http2.H2DownloadHandler'},
+}
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # encoding -> compressed fixture, and the count of accepted connections (TLS server's too), set by serve()
+    bodies = {}
+    connections = 0
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+    def do_GET(self):
+        encoding = self.path.rsplit('enc=', 1)[-1]
+        body = self.bodies[encoding]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FixtureResource(resource.Resource):
+    """The fixture for the TLS server, which picks HTTP/1.1 or HTTP/2 by ALPN."""
+    isLeaf = True
+
+    def render_GET(self, request):
+        encoding = request.args[b'enc'][0].decode()
+        request.setHeader('Content-Type', 'text/html; charset=utf-8')
+        if encoding != 'identity':
+            request.setHeader('Content-Encoding', encoding)
+        return FixtureHandler.bodies[encoding]
+
+
+class FixtureSite(server.Site):
+    def buildProtocol(self, addr):
+        FixtureHandler.connections += 1
+        return super().buildProtocol(addr)
+
+    def log(self, request):
+        pass
+
+
+class FixtureSpider(scrapy.Spider):
+    name = 'bench_transfer_encoding'
+
+    def __init__(self, base_url, encoding, pages, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.base_url = base_url
+        self.encoding = encoding
+        self.pages = pages
+
+    async def start(self):
+        for page in range(self.pages):
+            yield scrapy.Request(f'{self.base_url}/site/laptop/{page}.p?enc={self.encoding}', headers={'Accept-Encoding': self.encoding})
+
+    def parse(self, response):
+        pass
+
+
+def serve():
+    body = FIXTURE.read_bytes()
+    FixtureHandler.bodies = {name: compress(body) for name, compress in ENCODINGS.items()}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+def self_signed_certificate():
+    """Returns a pyOpenSSL key and a certificate for 127.0.0.1 signed with it."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, '127.0.0.1')])
+    now = datetime.now(timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address('127.0.0.1'))]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    return crypto.PKey.from_cryptography_key(key), crypto.X509.from_cryptography(certificate)
+
+
+def serve_tls(reactor):
+    """Serves the fixture over TLS on the crawl's reactor, offering h2 and http/1.1 by ALPN."""
+    from twisted.internet import ssl
+    from twisted.web.http import H2_ENABLED
+    if not H2_ENABLED:
+        raise SystemExit('--http2 needs an HTTP/2 capable Twisted: pip install "twisted[http2]"')
+    body = FIXTURE.read_bytes()
+    FixtureHandler.bodies = {name: compress(body) for name, compress in ENCODINGS.items()}
+    key, certificate = self_signed_certificate()
+    options = ssl.CertificateOptions(privateKey=key, certificate=certificate, acceptableProtocols=[b'h2', b'http/1.1'])
+    port = reactor.listenSSL(0, FixtureSite(FixtureResource()), options, interface='127.0.0.1')
+    return port, f'https://127.0.0.1:{port.getHost().port}'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=300)
+    parser.add_argument('--base-url', help='benchmark an external server instead of the local one')
+    parser.add_argument('--http2', action='store_true', help='serve over TLS and compare HTTP/1.1 with HTTP/2 downloads')
+    args = parser.parse_args()
+
+    install_reactor('twisted.internet.asyncioreactor.AsyncioSelectorReactor')
+    from twisted.internet import defer, reactor
+
+    server, base_url = None, args.base_url
+    if not base_url:
+        server, base_url = serve_tls(reactor) if args.http2 else serve()
+    protocols = ['HTTP/1.1', 'h2'] if args.http2 else ['HTTP/1.1']
+    runners = {
+        protocol: CrawlerRunner({
+            'LOG_LEVEL': 'WARNING',
+            'CONCURRENT_REQUESTS': 16,
+            'CONCURRENT_REQUESTS_PER_DOMAIN': 16,
+            'EXTENSIONS': {'deal_scraper.extensions.TransferStats': 510},
+            'TRANSFER_STATS_ENABLED': True,
+            'DOWNLOAD_HANDLERS': DOWNLOAD_HANDLERS[protocol],
+        })
+        for protocol in protocols
+    }
+
+    @defer.inlineCallbacks
+    def run():
+        print(f'{args.pages} pages of {FIXTURE.stat().st_size / 1024:.0f} KiB each from {base_url}')
+        print(f'{"protocol":>9} {"encoding":>9} {"wire KiB":>10} {"decoded KiB":>12} {"ratio":>6} {"pages/s":>8} {"connections":>12}')
+        for encoding in ENCODINGS:
+            for protocol, runner in runners.items():
+                FixtureHandler.connections = 0
+                crawler = runner.create_crawler(FixtureSpider)
+                started = time.perf_counter()
+                yield runner.crawl(crawler, base_url=base_url, encoding=encoding, pages=args.pages)
+                elapsed = time.perf_counter() - started
+                stats = crawler.stats.get_stats()
+                wire_bytes = stats.get('transfer/wire_bytes', 0)
+                decoded_bytes = stats.get('transfer/decoded_bytes', 0)
+                # What the responses actually came over, as reported by the download handler
+                negotiated = ','.join(key.removeprefix('transfer/protocol/') for key in stats if key.startswith('transfer/protocol/'))
+                connections = FixtureHandler.connections if server else '-'
+                print(
+                    f'{negotiated or protocol:>9} {encoding:>9} {wire_bytes / 1024:10.0f} {decoded_bytes / 1024:12.0f} '
+                    f'{decoded_bytes / max(wire_bytes, 1):6.1f} {args.pages / elapsed:8.0f} {connections:>12}'
+                )
+        reactor.stop()
+
+    reactor.callWhenRunning(run)
+    reactor.run()
+    if isinstance(server, ThreadingHTTPServer):
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
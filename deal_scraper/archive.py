@@ -0,0 +1,155 @@
+"""Compressed archive of every response a crawl fetched, for replaying the crawl offline.
+
+ArchiveCacheStorage plugs into Scrapy's HttpCacheMiddleware (HTTPCACHE_STORAGE). Response bodies
+are stored zstd compressed under ARCHIVE_DIR/blobs, named by the sha256 of the body, so a page
+that didn't change between crawls is stored once. A SQLite index maps (crawl id, url) to the
+status, headers and body hash.
+
+The cache runs below RedirectMiddleware, so redirects are archived and replayed like any other
+response. Bodies are stored decoded, whatever Content-Encoding they were sent with, and
+HttpCompressionMiddleware has nothing left to do on replay.
+
+ARCHIVE_MODE=record archives every response of the crawl under ARCHIVE_CRAWL_ID (a timestamp by
+default) and still fetches everything from the network. ARCHIVE_MODE=replay answers every request
+from the archived crawl ARCHIVE_CRAWL_ID (the latest one by default) and ignores anything that
+isn't in it, so the spider and pipelines run with no network at full CPU speed.
+"""
+from datetime import datetime, timezone
+from deal_scraper.middlewares import STREAM_DECODERS
+from pathlib import Path
+from scrapy.http.headers import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+
+archive_logger = logging.getLogger('deal_scraper.archive.ArchiveCacheStorage')
+
+# Index writes are committed in batches of this many responses (and when the spider closes)
+COMMIT_EVERY = 100
+
+
+def decode_body(response):
+    """Returns the response's body and headers with its Content-Encoding undone. Bodies that can't
+    be decoded are returned as they are, and HttpCompressionMiddleware gets them on replay."""
+    encodings = [
+        encoding.strip().lower()
+        for value in response.headers.getlist('Content-Encoding')
+        for encoding in value.split(b',')
+        if encoding.strip()
+    ]
+    if not encodings:
+        return response.body, response.headers
+    body = response.body
+    try:
+        # Encodings are listed in the order they were applied
+        for encoding in reversed(encodings):
+            body = STREAM_DECODERS[encoding]()(body)
+    except Exception:
+        return response.body, response.headers
+    headers = response.headers.copy()
+    headers.pop('Content-Encoding', None)
+    headers.pop('Content-Length', None)
+    return body, headers
+
+
+class ArchiveCacheStorage:
+    """HTTPCACHE_STORAGE backend that records responses into, or replays them from, the archive."""
+    def __init__(self, settings):
+        self.mode = settings.get('ARCHIVE_MODE') or 'record'
+        if self.mode not in ('record', 'replay'):
+            raise ValueError(f'ARCHIVE_MODE must be "record" or "replay", not {self.mode!r}')
+        if zstd is None:
+            raise ImportError('ARCHIVE_MODE needs zstd: pip install backports.zstd (built in from Python 3.14)')
+        self.archive_dir = Path(data_path(settings.get('ARCHIVE_DIR', 'archive'), createdir=True))
+        self.crawl_id = settings.get('ARCHIVE_CRAWL_ID')
+        self.zstd_level = settings.getint('ARCHIVE_ZSTD_LEVEL', 10)
+        self.db = None
+        self.stats = None
+        self.uncommitted = 0
+
+    def open_spider(self, spider):
+        self.stats = spider.crawler.stats
+        self.db = sqlite3.connect(self.archive_dir / 'index.db')
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'crawl_id TEXT NOT NULL, url TEXT NOT NULL, status INTEGER NOT NULL, response_url TEXT NOT NULL, '
+            'headers BLOB NOT NULL, body_sha256 TEXT NOT NULL, stored_at REAL NOT NULL, '
+            'PRIMARY KEY (crawl_id, url))'
+        )
+        self.db.commit()
+
+        if self.mode == 'record':
+            self.crawl_id = self.crawl_id or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        elif not self.crawl_id:
+            row = self.db.execute('SELECT crawl_id FROM responses ORDER BY stored_at DESC LIMIT 1').fetchone()
+            if row is None:
+                raise ValueError(f'ARCHIVE_MODE=replay: no archived crawls in {self.archive_dir}')
+            self.crawl_id = row[0]
+        archive_logger.info(f'{self.mode}ing crawl {self.crawl_id} in {self.archive_dir}')
+
+    def close_spider(self, spider):
+        self.db.commit()
+        self.db.close()
+
+    def blob_path(self, body_sha256):
+        return self.archive_dir / 'blobs' / body_sha256[:2] / f'{body_sha256}.zst'
+
+    def retrieve_response(self, spider, request):
+        """Returns the archived response in replay mode (None if the crawl didn't fetch the url).
+        Recording always goes to the network."""
+        if self.mode != 'replay':
+            return None
+        row = self.db.execute(
+            'SELECT status, response_url, headers, body_sha256 FROM responses WHERE crawl_id = ? AND url = ?',
+            (self.crawl_id, request.url),
+        ).fetchone()
+        if row is None:
+            return None
+        status, response_url, raw_headers, body_sha256 = row
+        body = zstd.decompress(self.blob_path(body_sha256).read_bytes())
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        respcls = responsetypes.from_args(headers=headers, url=response_url, body=body)
+        return respcls(url=response_url, status=status, headers=headers, body=body, request=request)
+
+    def store_response(self, spider, request, response):
+        if self.mode != 'record':
+            return
+        body, headers = decode_body(response)
+        body_sha256 = hashlib.sha256(body).hexdigest()
+        path = self.blob_path(body_sha256)
+        if path.exists():
+            self.stats.inc_value('archive/duplicate_bodies')
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            compressed = zstd.compress(body, level=self.zstd_level)
+            # Write to a temp file first so a crash mid-write can't leave a corrupt blob behind
+            tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+            tmp_path.write_bytes(compressed)
+            os.replace(tmp_path, path)
+            self.stats.inc_value('archive/stored_bodies')
+            self.stats.inc_value('archive/stored_bytes', len(compressed))
+
+        self.db.execute(
+            'INSERT OR REPLACE INTO responses (crawl_id, url, status, response_url, headers, body_sha256, stored_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self.crawl_id, request.url, response.status, response.url, headers_dict_to_raw(headers), body_sha256, time.time()),
+        )
+        self.stats.inc_value('archive/responses')
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY:
+            self.db.commit()
+            self.uncommitted = 0
@@ -0,0 +1,95 @@
+"""Crawl progress saved alongside every committed batch, so a crawl that dies can pick up where it left off.
+
+The checkpoint is only written by SQLAlchemyPipeline right after a batch commits, so the file and
+the committed rows always agree: anything listed as committed is in the database, and anything
+scheduled but not committed yet is still in the pending frontier and gets fetched again on resume.
+"""
+import json
+import logging
+import os
+
+checkpoint_logger = logging.getLogger('deal_scraper.checkpoint.CrawlCheckpoint')
+
+
+class CrawlCheckpoint:
+    """Pending listing pages, pending product pages (keyed by SKU) and SKUs committed this crawl."""
+    def __init__(self, path, listing_pending=None, listing_done=None, product_pending=None, committed=None):
+        self.path = path
+        # listing url -> request meta it was scheduled with
+        self.listing_pending = listing_pending or {}
+        self.listing_done = set(listing_done or [])
+        # SKU (or url when there's no SKU) -> product url
+        self.product_pending = product_pending or {}
+        self.committed = set(committed or [])
+
+    @classmethod
+    def load(cls, path):
+        """Loads the checkpoint left by an unfinished crawl, or starts an empty one."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return cls(path)
+
+        checkpoint = cls(path, **state)
+        checkpoint_logger.info(
+            f'resuming from {path}: {len(checkpoint.listing_pending)} listing pages and '
+            f'{len(checkpoint.product_pending)} product pages pending, {len(checkpoint.committed)} skus committed'
+        )
+        return checkpoint
+
+    @property
+    def resuming(self):
+        return bool(self.listing_done or self.committed)
+
+    def add_listing(self, url, meta):
+        if url not in self.listing_done:
+            self.listing_pending[url] = meta
+
+    def is_listing_done(self, url):
+        return url in self.listing_done
+
+    def finish_listing(self, url):
+        self.listing_pending.pop(url, None)
+        self.listing_done.add(url)
+
+    def add_product(self, key, url):
+        if key not in self.committed:
+            self.product_pending[key] = url
+
+    def is_committed(self, key):
+        return key in self.committed
+
+    def commit(self, keys):
+        """Marks keys as committed and saves. Only call once their rows are committed."""
+        self.finish_products(keys)
+        self.save()
+
+    def finish_products(self, keys):
+        """Marks keys as done without saving. For product pages with nothing to commit (sold out, dropped
+        items), which go to disk with the next save."""
+        for key in keys:
+            if key is None:
+                continue
+            self.product_pending.pop(key, None)
+            self.committed.add(key)
+
+    def save(self):
+        state = {
+            'listing_pending': self.listing_pending,
+            'listing_done': sorted(self.listing_done),
+            'product_pending': self.product_pending,
+            'committed': sorted(self.committed),
+        }
+        # Write to a temp file first so a crash mid-write can't corrupt the checkpoint
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """Removes the checkpoint once the crawl has finished."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
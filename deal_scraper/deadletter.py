@@ -0,0 +1,97 @@
+"""Failed product pages, kept in the dead_letters table so they can be retried without a full crawl.
+
+Each failure (download error, HTTP error, unparseable page) is recorded against the page url
+with its reason and attempt count. `-a mode=deadletter` fetches only the pages whose back-off
+has passed; the delay doubles with every failed attempt, from DEAD_LETTER_BASE_DELAY_MINUTES up
+to DEAD_LETTER_MAX_DELAY_HOURS. Pages are resolved once their item commits.
+"""
+from deal_scraper.models import Base, DeadLetterTable, create_db_engine
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import sessionmaker
+import logging
+
+deadletter_logger = logging.getLogger('deal_scraper.deadletter.DeadLetterStore')
+
+# Keeps IN (...) lists well under the bound parameter limits
+CHUNK_SIZE = 500
+
+
+class DeadLetterStore:
+    """Records, schedules and resolves failed product pages."""
+    def __init__(self, db_url, base_delay, max_delay, max_attempts):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.engine = create_db_engine(db_url)
+        Base.metadata.create_all(self.engine, tables=[DeadLetterTable.__table__])
+        self.Session = sessionmaker(bind=self.engine)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Returns a store unless DEAD_LETTER_ENABLED is off or there's no DATABASE_URL."""
+        db_url = settings.get('DATABASE_URL')
+        if not db_url or not settings.getbool('DEAD_LETTER_ENABLED', True):
+            return None
+        return cls(
+            db_url,
+            base_delay=timedelta(minutes=settings.getfloat('DEAD_LETTER_BASE_DELAY_MINUTES', 30)),
+            max_delay=timedelta(hours=settings.getfloat('DEAD_LETTER_MAX_DELAY_HOURS', 24)),
+            max_attempts=settings.getint('DEAD_LETTER_MAX_ATTEMPTS', 5),
+        )
+
+    def backoff(self, attempts):
+        return min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+
+    def record(self, url, sku, reason):
+        """Records a failed attempt at url, reopening it if it had been resolved before."""
+        now = datetime.now(timezone.utc)
+        with self.Session() as session, session.begin():
+            letter = session.scalars(select(DeadLetterTable).where(DeadLetterTable.url == url)).first()
+            if letter is None:
+                letter = DeadLetterTable(url=url, attempts=0, first_failed_at=now)
+                session.add(letter)
+            elif letter.resolved_at is not None:
+                letter.attempts = 0
+                letter.first_failed_at = now
+                letter.resolved_at = None
+            letter.sku = sku or letter.sku
+            letter.reason = reason
+            letter.attempts += 1
+            letter.last_failed_at = now
+            letter.next_attempt_at = now + self.backoff(letter.attempts)
+            attempts = letter.attempts
+        deadletter_logger.warning(f'{url} failed ({reason}), attempt {attempts}')
+
+    def resolve(self, keys):
+        """Marks the pages with these urls or skus as scraped."""
+        keys = [key for key in keys if key]
+        now = datetime.now(timezone.utc)
+        with self.Session() as session, session.begin():
+            for start in range(0, len(keys), CHUNK_SIZE):
+                chunk = keys[start:start + CHUNK_SIZE]
+                session.execute(
+                    update(DeadLetterTable)
+                    .where(DeadLetterTable.resolved_at.is_(None), or_(DeadLetterTable.url.in_(chunk), DeadLetterTable.sku.in_(chunk)))
+                    .values(resolved_at=now)
+                    .execution_options(synchronize_session=False)
+                )
+
+    def due(self):
+        """Returns [(url, sku)] of the unresolved pages whose back-off has passed, oldest failure first.
+        Pages that failed DEAD_LETTER_MAX_ATTEMPTS times are left for someone to look at."""
+        now = datetime.now(timezone.utc)
+        with self.Session() as session:
+            rows = session.execute(
+                select(DeadLetterTable.url, DeadLetterTable.sku)
+                .where(
+                    DeadLetterTable.resolved_at.is_(None),
+                    DeadLetterTable.next_attempt_at <= now,
+                    DeadLetterTable.attempts < self.max_attempts,
+                )
+                .order_by(DeadLetterTable.first_failed_at)
+            ).all()
+        return [(url, sku) for url, sku in rows]
+
+    def close(self):
+        self.engine.dispose()
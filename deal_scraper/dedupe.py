@@ -0,0 +1,36 @@
+"""Per-crawl record of the SKUs already scheduled, so a laptop is only fetched and stored once per run."""
+import hashlib
+import math
+
+
+class BloomFilter:
+    """Fixed-size set membership for very large catalogs, with a small false positive rate.
+
+    A false positive means a SKU is skipped for this crawl, never that one is fetched twice.
+    """
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: k bit positions from the two halves of one digest
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+def make_seen_skus(settings):
+    """A plain set, or a BloomFilter when SKU_DEDUPE_BLOOM_CAPACITY is set."""
+    capacity = settings.getint('SKU_DEDUPE_BLOOM_CAPACITY', 0)
+    if capacity > 0:
+        return BloomFilter(capacity, settings.getfloat('SKU_DEDUPE_BLOOM_ERROR_RATE', 0.001))
+    return set()
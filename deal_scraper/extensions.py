@@ -0,0 +1,183 @@
+"""Crawl-wide extensions for the deal_scraper project."""
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+import logging
+import math
+
+adaptive_logger = logging.getLogger('deal_scraper.extensions.AdaptiveConcurrency')
+
+# Responses that mean the site wants us to slow down
+THROTTLED_STATUSES = {403, 429, 503}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class SlotWindow:
+    """What one download slot saw since its last concurrency decision."""
+    def __init__(self):
+        self.latencies = []
+        self.requests = 0
+        self.errors = 0
+
+
+class AdaptiveConcurrency:
+    """Adjusts each download slot's concurrency (AIMD) from response latency and error rate.
+
+    Every ADAPTIVE_CONCURRENCY_WINDOW finished requests on a slot:
+      - error rate (403/429/503 and downloads that failed or timed out) above the threshold:
+        multiply concurrency by ADAPTIVE_CONCURRENCY_DECREASE
+      - median latency within ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE of the best window seen:
+        add ADAPTIVE_CONCURRENCY_INCREASE
+      - otherwise latency is climbing, so hold
+    """
+    def __init__(self, crawler, window, min_concurrency, max_concurrency, increase, decrease,
+                 latency_tolerance, error_threshold):
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.window = window
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.error_threshold = error_threshold
+        # slot key -> SlotWindow, target concurrency and best median latency seen
+        self.windows = {}
+        self.targets = {}
+        self.baselines = {}
+        # Requests that got a response, so request_left_downloader can spot failed downloads
+        self.responded = set()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ADAPTIVE_CONCURRENCY_ENABLED'):
+            raise NotConfigured
+        extension = cls(
+            crawler,
+            window=settings.getint('ADAPTIVE_CONCURRENCY_WINDOW', 20),
+            min_concurrency=settings.getint('ADAPTIVE_CONCURRENCY_MIN', 2),
+            max_concurrency=settings.getint('ADAPTIVE_CONCURRENCY_MAX', settings.getint('CONCURRENT_REQUESTS')),
+            increase=settings.getint('ADAPTIVE_CONCURRENCY_INCREASE', 2),
+            decrease=settings.getfloat('ADAPTIVE_CONCURRENCY_DECREASE', 0.5),
+            latency_tolerance=settings.getfloat('ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE', 0.25),
+            error_threshold=settings.getfloat('ADAPTIVE_CONCURRENCY_ERROR_THRESHOLD', 0.05),
+        )
+        crawler.signals.connect(extension.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(extension.request_left_downloader, signal=signals.request_left_downloader)
+        return extension
+
+    def get_slot(self, request):
+        key = request.meta.get('download_slot')
+        if key is None:
+            return None, None
+        return key, self.crawler.engine.downloader.slots.get(key)
+
+    def response_downloaded(self, response, request, spider):
+        self.responded.add(request)
+        key, slot = self.get_slot(request)
+        if slot is None:
+            return
+        window = self.windows.setdefault(key, SlotWindow())
+        latency = request.meta.get('download_latency')
+        if latency is not None:
+            window.latencies.append(latency)
+        if response.status in THROTTLED_STATUSES:
+            window.errors += 1
+            self.stats.inc_value(f'adaptive_concurrency/throttled/{response.status}')
+
+    def request_left_downloader(self, request, spider):
+        responded = request in self.responded
+        self.responded.discard(request)
+        key, slot = self.get_slot(request)
+        if slot is None:
+            return
+        window = self.windows.setdefault(key, SlotWindow())
+        window.requests += 1
+        if not responded:
+            # Timeouts, dropped connections and other download errors
+            window.errors += 1
+            self.stats.inc_value('adaptive_concurrency/download_errors')
+
+        # Slots idle for a minute get garbage collected and recreated at the default concurrency
+        target = self.targets.setdefault(key, slot.concurrency)
+        slot.concurrency = target
+
+        if window.requests >= self.window:
+            self.windows[key] = SlotWindow()
+            slot.concurrency = self.targets[key] = self.decide(key, target, window)
+
+    def decide(self, key, concurrency, window):
+        """Returns the slot's concurrency for the next window and records the decision in stats."""
+        error_rate = window.errors / window.requests
+        median_latency = percentile(window.latencies, 0.5) if window.latencies else None
+
+        if error_rate > self.error_threshold:
+            decision = 'decreased'
+            new_concurrency = max(self.min_concurrency, math.floor(concurrency * self.decrease))
+        elif median_latency is None:
+            decision = 'held'
+            new_concurrency = concurrency
+        else:
+            baseline = self.baselines[key] = min(self.baselines.get(key, median_latency), median_latency)
+            if median_latency <= baseline * (1 + self.latency_tolerance):
+                decision = 'increased'
+                new_concurrency = min(self.max_concurrency, concurrency + self.increase)
+            else:
+                decision = 'held'
+                new_concurrency = concurrency
+
+        self.stats.inc_value(f'adaptive_concurrency/{decision}')
+        self.stats.set_value(f'adaptive_concurrency/{key}/concurrency', new_concurrency)
+        self.stats.max_value(f'adaptive_concurrency/{key}/max_concurrency', new_concurrency)
+        self.stats.set_value(f'adaptive_concurrency/{key}/error_rate', round(error_rate, 4))
+        if window.latencies:
+            self.stats.set_value(f'adaptive_concurrency/{key}/latency_p50_ms', round(median_latency * 1000))
+            self.stats.set_value(f'adaptive_concurrency/{key}/latency_p90_ms', round(percentile(window.latencies, 0.9) * 1000))
+        adaptive_logger.debug(
+            f'{key}: concurrency {concurrency} -> {new_concurrency} ({decision}, error rate {error_rate:.1%}, '
+            f'median latency {median_latency})'
+        )
+        return new_concurrency
+
+
+class TransferStats:
+    """Records how many body bytes came over the wire vs. what they decoded to, per protocol and content encoding.
+
+    Wire bytes are counted on response_downloaded, before HttpCompressionMiddleware decodes the body,
+    and decoded bytes on response_received, once it's gone through the downloader middlewares.
+    Headers aren't counted, so HTTP/2 header compression doesn't show up here.
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('TRANSFER_STATS_ENABLED', True):
+            raise NotConfigured
+        extension = cls(crawler.stats)
+        crawler.signals.connect(extension.response_downloaded, signal=signals.response_downloaded)
+        crawler.signals.connect(extension.response_received, signal=signals.response_received)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def response_downloaded(self, response, request, spider):
+        wire_bytes = len(response.body)
+        encoding = response.headers.get('Content-Encoding', b'identity').decode('latin-1').lower()
+        self.stats.inc_value('transfer/wire_bytes', wire_bytes)
+        self.stats.inc_value(f'transfer/content_encoding/{encoding}')
+        self.stats.inc_value(f'transfer/content_encoding/{encoding}/wire_bytes', wire_bytes)
+        # None for handlers that don't report it (file://, data:, cached responses)
+        self.stats.inc_value(f'transfer/protocol/{response.protocol or "unknown"}')
+
+    def response_received(self, response, request, spider):
+        self.stats.inc_value('transfer/decoded_bytes', len(response.body))
+
+    def spider_closed(self, spider):
+        wire_bytes = self.stats.get_value('transfer/wire_bytes', 0)
+        decoded_bytes = self.stats.get_value('transfer/decoded_bytes', 0)
+        if wire_bytes:
+            self.stats.set_value('transfer/compression_ratio', round(decoded_bytes / wire_bytes, 2))
@@ -0,0 +1,389 @@
+"""Pulls the data parse_product needs straight out of the raw product page bytes.
+
+BestBuy product pages are a couple of MB of html with hundreds of <script> tags. Building a
+selector over the whole page just to read one button, two prices and one json script is
+most of the parse cost, so these helpers search response.body for the few tags that matter
+and only decode those slices.
+"""
+from typing import Any
+import html
+import json
+import re
+
+from deal_scraper.items import FIELD_NAMES
+from deal_scraper.pipelines import CleaningPipeline
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+SPEC_SCRIPT_MARKER = b'id="shop-specifications-'
+VARIATIONS_SCRIPT_MARKER = b'id="shop-product-variations-'
+HERO_PRICE_MARKER = b'priceView-hero-price'
+REGULAR_PRICE_MARKER = b'data-testid="regular-price"'
+ADD_TO_CART_MARKER = b'add-to-cart-button'
+BREADCRUMB_MARKER = b'c-breadcrumbs'
+
+ARIA_HIDDEN_SPAN_PATTERN = re.compile(rb'<span[^>]*aria-hidden="true"[^>]*>([^<]*)')
+BUTTON_STATE_PATTERN = re.compile(rb'data-button-state="([^"]*)"')
+BUTTON_SKU_PATTERN = re.compile(rb'data-sku-id="([^"]*)"')
+BREADCRUMB_CATEGORY_PATTERN = re.compile(rb'[?&]id=((?:abcat|pcmcat)\d+)')
+
+
+# displayName -> whether CleaningPipeline maps it onto a LaptopItem field, cached across pages
+_kept_spec_names = {}
+
+
+class SpecificationsNotFound(Exception):
+    """The product page has no shop-specifications json block."""
+
+
+class NotInCategory(Exception):
+    """The product page's breadcrumb doesn't go through the category it was required to be in."""
+
+
+if msgspec is not None:
+    # Typed schema for just the displayName/value pairs. Everything else in the (large)
+    # shop-specifications document is skipped by the decoder without building Python objects.
+    class _Spec(msgspec.Struct):
+        displayName: Any = "Unknown"
+        value: Any = "N/A"
+
+    class _SpecCategory(msgspec.Struct):
+        specifications: list[_Spec] = []
+
+    class _Specifications(msgspec.Struct):
+        categories: list[_SpecCategory] = []
+
+    class _SpecPayload(msgspec.Struct):
+        specifications: _Specifications = msgspec.field(default_factory=_Specifications)
+
+    _spec_decoder = msgspec.json.Decoder(_SpecPayload)
+else:
+    _spec_decoder = None
+
+
+def find_tag(body, marker, tag_name, start=0):
+    """Finds the first <tag_name ...> opening tag containing marker, looking from offset start on.
+
+    Returns (tag_start, tag_end, next_start). When there's no complete tag tag_start and tag_end are
+    None, and next_start is where the search can pick up again once more of the body has arrived.
+    """
+    opening = b'<' + tag_name
+    pos = body.find(marker, start)
+    while pos != -1:
+        tag_start = body.rfind(b'<', 0, pos)
+        # The marker has to sit inside the opening tag itself, not in text or a script body
+        if tag_start != -1 and body.rfind(b'>', tag_start, pos) == -1 and body.startswith(opening, tag_start):
+            tag_end = body.find(b'>', pos)
+            if tag_end == -1:
+                return None, None, pos
+            return tag_start, tag_end + 1, tag_end + 1
+        pos = body.find(marker, pos + len(marker))
+    # A marker split across the end of body is found once the rest of it arrives
+    return None, None, max(start, len(body) - len(marker) + 1)
+
+
+def iter_tags(body, marker, tag_name):
+    """Yields (start, end) offsets of each <tag_name ...> opening tag that contains marker."""
+    start = 0
+    while True:
+        tag_start, tag_end, start = find_tag(body, marker, tag_name, start)
+        if tag_start is None:
+            return
+        yield tag_start, tag_end
+
+
+def find_script_text(body, marker, encoding='utf-8'):
+    """Returns the text of the first <script> whose opening tag contains marker, or None."""
+    for _, tag_end in iter_tags(body, marker, b'script'):
+        script_end = body.find(b'</script>', tag_end)
+        if script_end == -1:
+            return None
+        return body[tag_end:script_end].decode(encoding)
+    return None
+
+
+def find_specifications_json(body, encoding='utf-8'):
+    """Returns the text of the <script id="shop-specifications-..."> json block, or None."""
+    return find_script_text(body, SPEC_SCRIPT_MARKER, encoding)
+
+
+def find_price_text(body, marker, encoding='utf-8'):
+    """Returns the first aria-hidden span text directly inside the first <div> carrying marker."""
+    for _, tag_end in iter_tags(body, marker, b'div'):
+        div_end = body.find(b'</div>', tag_end)
+        match = ARIA_HIDDEN_SPAN_PATTERN.search(body, tag_end, div_end if div_end != -1 else len(body))
+        if match:
+            return html.unescape(match.group(1).decode(encoding))
+    return None
+
+
+class ButtonScan:
+    """Finds the add-to-cart button for sku, falling back to the first button on the page (or just the
+    first button when there's no sku). Scanning a longer copy of the same body only searches what's new."""
+    def __init__(self, sku=None):
+        self.sku = sku
+        self.search_from = 0
+        self.first = (None, None)
+        self.match = None
+
+    def scan(self, body):
+        """Returns (state, offset past the opening tag) of the button, or (None, None) if there's none yet."""
+        while self.match is None:
+            tag_start, tag_end, self.search_from = find_tag(body, ADD_TO_CART_MARKER, b'button', self.search_from)
+            if tag_start is None:
+                break
+            state = BUTTON_STATE_PATTERN.search(body, tag_start, tag_end)
+            if not state:
+                continue
+            button = state.group(1).decode('ascii'), tag_end
+            button_sku = BUTTON_SKU_PATTERN.search(body, tag_start, tag_end) if self.sku is not None else None
+            if self.sku is None or (button_sku and button_sku.group(1).decode('ascii') == self.sku):
+                self.match = button
+            elif self.first[0] is None:
+                self.first = button
+        return self.match or self.first
+
+
+def find_button(body, sku=None):
+    """Returns (state, offset past the opening tag) of the add-to-cart button for sku, falling back
+    to the first button on the page. (None, None) if there's no button."""
+    return ButtonScan(sku).scan(body)
+
+
+def find_button_state(body, sku=None):
+    """Returns the add-to-cart button state for sku, falling back to the first button on the page."""
+    return find_button(body, sku)[0]
+
+
+class ElementScan:
+    """Finds the end of the first <tag_name> carrying marker. Scanning a longer copy of the same body
+    only searches what's new."""
+    def __init__(self, marker, tag_name):
+        self.marker = marker
+        self.tag_name = tag_name
+        self.closing = b'</' + tag_name + b'>'
+        self.search_from = 0
+        self.tag_end = None
+        self.end = None
+
+    def scan(self, body):
+        """Returns the offset past the element's closing tag, or None if it isn't all in body yet."""
+        if self.end is not None:
+            return self.end
+        if self.tag_end is None:
+            _, self.tag_end, self.search_from = find_tag(body, self.marker, self.tag_name, self.search_from)
+            if self.tag_end is None:
+                return None
+        element_end = body.find(self.closing, self.search_from)
+        if element_end == -1:
+            self.search_from = max(self.search_from, len(body) - len(self.closing) + 1)
+            return None
+        self.end = element_end + len(self.closing)
+        return self.end
+
+
+def find_element_end(body, marker, tag_name):
+    """Returns the offset past the closing tag of the first <tag_name> carrying marker, or None."""
+    return ElementScan(marker, tag_name).scan(body)
+
+
+class FragmentsScan:
+    """find_fragments_end for the body of a page that's still downloading: call scan with the body
+    received so far after every chunk, and only the bytes added since the previous scan get searched.
+
+    Once all the fragments are in, the cut is final. If the first price divs turn out to have no
+    price the page can't be cut at all, and scan keeps returning None.
+    """
+    def __init__(self, sku=None, encoding='utf-8'):
+        self.encoding = encoding
+        self.button = ButtonScan(sku)
+        self.elements = [
+            ElementScan(HERO_PRICE_MARKER, b'div'),
+            ElementScan(REGULAR_PRICE_MARKER, b'div'),
+            ElementScan(SPEC_SCRIPT_MARKER, b'script'),
+        ]
+        self.end = None
+        self.uncuttable = False
+
+    def scan(self, body):
+        if self.end is not None or self.uncuttable:
+            return self.end
+        button_state, button_end = self.button.scan(body)
+        if button_state is None:
+            return None
+        if button_state == 'SOLD_OUT':
+            self.end = button_end
+            return self.end
+
+        ends = [button_end]
+        for element in self.elements:
+            element_end = element.scan(body)
+            if element_end is None:
+                return None
+            ends.append(element_end)
+        fragments_end = max(ends)
+
+        # The prices have to come from the first price div, like they would on the whole page
+        prefix = body[:fragments_end]
+        if find_price_text(prefix, HERO_PRICE_MARKER, self.encoding) is None or find_price_text(prefix, REGULAR_PRICE_MARKER, self.encoding) is None:
+            self.uncuttable = True
+            return None
+        self.end = fragments_end
+        return self.end
+
+
+def find_fragments_end(body, sku=None, encoding='utf-8'):
+    """Returns the offset just past the last fragment parse_product_page reads, or None if body
+    (the start of a page that's still downloading) doesn't hold all of them yet.
+
+    parse_product_page gives the same result for body[:offset] as for the whole page, except for
+    sibling variants whose script comes later; those just get their own product pages fetched.
+    A sold out button is enough on its own, since nothing else is read from sold out pages.
+    """
+    return FragmentsScan(sku, encoding).scan(body)
+
+
+def find_breadcrumb_categories(body):
+    """Returns the category ids the page's breadcrumb links to, top level first ([] if it has none).
+    The breadcrumb comes before the price blocks, so it's there on early-aborted pages too."""
+    tag_start, tag_end, _ = find_tag(body, BREADCRUMB_MARKER, b'nav')
+    if tag_start is None:
+        return []
+    nav_end = body.find(b'</nav>', tag_end)
+    if nav_end == -1:
+        return []
+    return [category.decode('ascii') for category in BREADCRUMB_CATEGORY_PATTERN.findall(body, tag_end, nav_end)]
+
+
+def extract_product_page(body, sku=None, encoding='utf-8'):
+    """Finds everything parse_product needs in one pass over the raw page bytes."""
+    return {
+        'button_state': find_button_state(body, sku),
+        'price': find_price_text(body, HERO_PRICE_MARKER, encoding),
+        'full_price': find_price_text(body, REGULAR_PRICE_MARKER, encoding),
+        'specifications_json': find_specifications_json(body, encoding),
+    }
+
+
+def decode_attributes(specifications_json):
+    """Returns {displayName: value} for every spec in the shop-specifications json.
+
+    Uses the typed msgspec decoder when msgspec is installed, and the stdlib json module
+    otherwise (or when the document doesn't fit the schema, so errors match the stdlib path).
+    """
+    if _spec_decoder is not None:
+        try:
+            payload = _spec_decoder.decode(specifications_json)
+        except msgspec.DecodeError:
+            pass
+        else:
+            return {
+                spec.displayName: spec.value
+                for spec_category in payload.specifications.categories
+                for spec in spec_category.specifications
+            }
+
+    data = json.loads(specifications_json)
+    specifications = data.get("specifications", {}).get("categories", [])
+
+    # Unpack the spec data and structure in key-value pairs
+    attributes = {}
+    for spec_category in specifications:
+        for spec in spec_category.get("specifications", []):
+            spec_name = spec.get("displayName", "Unknown")
+            spec_value = spec.get("value", "N/A")
+            attributes[spec_name] = spec_value
+    return attributes
+
+
+def trim_attributes(attributes):
+    """Drops the specs CleaningPipeline would ignore, so in-flight items only carry what gets stored."""
+    trimmed = {}
+    for spec_name, spec_value in attributes.items():
+        keep = _kept_spec_names.get(spec_name)
+        if keep is None:
+            keep = _kept_spec_names[spec_name] = CleaningPipeline.standardize_key(spec_name) in FIELD_NAMES
+        if keep:
+            trimmed[spec_name] = spec_value
+    return trimmed
+
+
+def parse_variants(body, sku, attributes, encoding='utf-8'):
+    """Returns (variants, sold_out_skus) for the sibling SKUs (colors, RAM/storage configs) on a product page.
+
+    The <script id="shop-product-variations-..."> block lists each sibling's sku, url, button state,
+    prices and the specs that differ from this page. Each in-stock sibling becomes a dict of
+    LaptopItem fields with this page's specs overlaid by its own. Siblings whose deltas don't
+    include their own UPC can't be stored from here, so they're left for their own product page.
+    A missing or malformed block just means no variants.
+    """
+    variations_json = find_script_text(body, VARIATIONS_SCRIPT_MARKER, encoding)
+    if not variations_json:
+        return [], []
+    try:
+        variations = json.loads(variations_json).get('app', {}).get('variations', [])
+    except (json.JSONDecodeError, AttributeError):
+        return [], []
+
+    variants = []
+    sold_out_skus = []
+    for variation in variations:
+        variant_sku = str(variation.get('skuId') or '')
+        if not variant_sku or variant_sku == sku:
+            continue
+        if variation.get('buttonState') == 'SOLD_OUT':
+            sold_out_skus.append(variant_sku)
+            continue
+
+        deltas = trim_attributes({
+            spec.get('displayName', 'Unknown'): spec.get('value', 'N/A')
+            for spec in variation.get('specifications', [])
+        })
+        price = variation.get('price', {})
+        if 'UPC' not in deltas or not price.get('currentPrice') or not variation.get('url'):
+            continue
+        variants.append({
+            'price': price['currentPrice'],
+            'full_price': price.get('regularPrice') or price['currentPrice'],
+            'sku': variant_sku,
+            'link': variation['url'],
+            'attributes': {**attributes, **deltas},
+        })
+    return variants, sold_out_skus
+
+
+def parse_product_page(body, sku=None, encoding='utf-8', category=None):
+    """Returns the LaptopItem fields scraped from a product page, or None if it's sold out.
+
+    Sibling variants found on the page come back under 'variants' (see parse_variants) and
+    'sold_out_variants'. Raises NotInCategory if a category id is given and the page's breadcrumb
+    doesn't include it, SpecificationsNotFound if the spec script is missing and
+    json.JSONDecodeError if it can't be decoded. Only takes and returns plain data so it can
+    run in a worker process.
+    """
+    if category and category not in find_breadcrumb_categories(body):
+        raise NotInCategory(category)
+
+    page = extract_product_page(body, sku, encoding)
+
+    # If item is sold out, skip
+    if page['button_state'] == 'SOLD_OUT':
+        return None
+
+    if not page['specifications_json']:
+        raise SpecificationsNotFound()
+
+    attributes = trim_attributes(decode_attributes(page['specifications_json']))
+    variants, sold_out_variants = parse_variants(body, sku, attributes, encoding)
+    price = page['price'] or '0'
+    return {
+        'price': price,
+        'full_price': page['full_price'] or price,
+        'sku': sku,
+        'attributes': attributes,
+        'variants': variants,
+        'sold_out_variants': sold_out_variants,
+    }
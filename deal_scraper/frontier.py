@@ -0,0 +1,211 @@
+"""Crawl frontier shared through the database, so several crawler processes (or hosts) can split one crawl.
+
+Every listing page and product page a worker discovers is pushed into the crawl_frontier table
+instead of its own scheduler. Workers claim batches of pending rows under a lease: on Postgres the
+claim uses SELECT ... FOR UPDATE SKIP LOCKED so workers never wait on each other, and the
+follow-up UPDATE only takes rows that are still claimable, which keeps it correct on SQLite too.
+When a worker dies its leases expire and the rows go back to the pool, up to
+FRONTIER_MAX_ATTEMPTS times.
+
+SQLite only allows one writer and SQLAlchemyPipeline keeps a write transaction open for each
+batch, so local SQLite runs should keep the frontier in its own file (FRONTIER_DATABASE_URL).
+"""
+from deal_scraper.models import Base, FrontierTable, create_db_engine
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+import json
+import logging
+import os
+import socket
+import uuid
+
+frontier_logger = logging.getLogger('deal_scraper.frontier.SharedFrontier')
+
+# Keeps IN (...) lists well under the bound parameter limits
+CHUNK_SIZE = 500
+# Rows per multi-row INSERT, 8 columns each
+INSERT_CHUNK_SIZE = 100
+
+
+class SharedFrontier:
+    """One worker's handle on the shared frontier of crawl crawl_id."""
+    def __init__(self, db_url, crawl_id, worker_id, lease_seconds=600, claim_size=64, max_attempts=3, stats=None):
+        self.crawl_id = crawl_id
+        self.worker_id = worker_id
+        self.lease = timedelta(seconds=lease_seconds)
+        self.claim_size = claim_size
+        self.max_attempts = max_attempts
+        self.stats = stats
+        self.engine = create_db_engine(db_url)
+        Base.metadata.create_all(self.engine, tables=[FrontierTable.__table__])
+        self.Session = sessionmaker(bind=self.engine)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """Returns a frontier if FRONTIER_CRAWL_ID is set, otherwise None (single process crawl)."""
+        settings = crawler.settings
+        crawl_id = settings.get('FRONTIER_CRAWL_ID')
+        if not crawl_id:
+            return None
+        worker_id = settings.get('FRONTIER_WORKER_ID') or f'{socket.gethostname()}-{os.getpid()}'
+        frontier_logger.info(f'worker {worker_id} joining crawl {crawl_id}')
+        return cls(
+            settings.get('FRONTIER_DATABASE_URL') or settings.get('DATABASE_URL'),
+            crawl_id,
+            worker_id,
+            lease_seconds=settings.getint('FRONTIER_LEASE_SECONDS', 600),
+            claim_size=settings.getint('FRONTIER_CLAIM_SIZE', 64),
+            max_attempts=settings.getint('FRONTIER_MAX_ATTEMPTS', 3),
+            stats=crawler.stats,
+        )
+
+    def inc_stat(self, key, count=1):
+        if self.stats and count:
+            self.stats.inc_value(f'frontier/{key}', count)
+
+    def push(self, url, kind, meta=None, sku=None, priority=0):
+        """Adds a page to the frontier. Pages already in this crawl's frontier are left as they are."""
+        self.push_many([{'url': url, 'kind': kind, 'meta': meta, 'sku': sku, 'priority': priority}])
+
+    def push_many(self, pages):
+        """Adds pages (dicts of url, kind and optionally meta, sku and priority) to the frontier in one
+        transaction. Pages already in this crawl's frontier are left as they are."""
+        rows = [
+            {
+                'crawl_id': self.crawl_id,
+                'url': page['url'],
+                'kind': page['kind'],
+                'sku': page.get('sku'),
+                'meta': json.dumps(page.get('meta') or {}),
+                'priority': page.get('priority', 0),
+                'status': 'pending',
+                'attempts': 0,
+            }
+            for page in pages
+        ]
+        if not rows:
+            return
+        dialect = self.engine.dialect.name
+        added = 0
+        with self.Session() as session, session.begin():
+            if dialect in ('postgresql', 'sqlite'):
+                if dialect == 'postgresql':
+                    from sqlalchemy.dialects.postgresql import insert
+                else:
+                    from sqlalchemy.dialects.sqlite import insert
+                # One multi-row INSERT per chunk, a row per column per page has to fit the bound parameter limit
+                for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+                    result = session.execute(
+                        insert(FrontierTable).values(rows[start:start + INSERT_CHUNK_SIZE]).on_conflict_do_nothing()
+                    )
+                    added += result.rowcount
+            else:
+                for values in rows:
+                    try:
+                        with session.begin_nested():
+                            session.add(FrontierTable(**values))
+                        added += 1
+                    except IntegrityError:
+                        pass
+        self.inc_stat('pushed', added)
+
+    def claimable(self, now):
+        """Rows that are pending, or whose lease ran out before the page was finished."""
+        expired = and_(
+            FrontierTable.status == 'leased',
+            FrontierTable.lease_expires_at < now,
+            FrontierTable.attempts < self.max_attempts,
+        )
+        return and_(FrontierTable.crawl_id == self.crawl_id, or_(FrontierTable.status == 'pending', expired))
+
+    def claim(self, limit=None):
+        """Leases up to limit rows to this worker. Returns them as plain dicts, highest priority first."""
+        now = datetime.now(timezone.utc)
+        claimable = self.claimable(now)
+        token = uuid.uuid4().hex
+        with self.Session() as session, session.begin():
+            ids = session.scalars(
+                select(FrontierTable.id)
+                .where(claimable)
+                .order_by(FrontierTable.priority.desc(), FrontierTable.id)
+                .limit(limit or self.claim_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if not ids:
+                return []
+            # Re-checks claimability so a row another worker took in the meantime isn't taken twice
+            session.execute(
+                update(FrontierTable)
+                .where(FrontierTable.id.in_(ids), claimable)
+                .values(
+                    status='leased',
+                    worker_id=self.worker_id,
+                    lease_token=token,
+                    lease_expires_at=now + self.lease,
+                    attempts=FrontierTable.attempts + 1,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            rows = session.scalars(
+                select(FrontierTable).where(FrontierTable.lease_token == token).order_by(FrontierTable.priority.desc(), FrontierTable.id)
+            ).all()
+            claimed = [
+                {'url': row.url, 'kind': row.kind, 'sku': row.sku, 'meta': json.loads(row.meta or '{}'),
+                 'priority': row.priority, 'attempts': row.attempts}
+                for row in rows
+            ]
+        self.inc_stat('claimed', len(claimed))
+        self.inc_stat('reclaimed', sum(1 for row in claimed if row['attempts'] > 1))
+        return claimed
+
+    def complete(self, keys):
+        """Marks this crawl's rows done by url, or by sku for product pages."""
+        keys = [key for key in keys if key]
+        completed = 0
+        with self.Session() as session, session.begin():
+            for start in range(0, len(keys), CHUNK_SIZE):
+                chunk = keys[start:start + CHUNK_SIZE]
+                result = session.execute(
+                    update(FrontierTable)
+                    .where(
+                        FrontierTable.crawl_id == self.crawl_id,
+                        FrontierTable.status != 'done',
+                        or_(FrontierTable.url.in_(chunk), and_(FrontierTable.kind == 'product', FrontierTable.sku.in_(chunk))),
+                    )
+                    .values(status='done', worker_id=self.worker_id, lease_expires_at=None)
+                    .execution_options(synchronize_session=False)
+                )
+                completed += result.rowcount
+        self.inc_stat('completed', completed)
+
+    def has_outstanding_work(self):
+        """Whether anything is left that this worker should stay open for: pending or expired rows,
+        or rows other workers are still on (they may push more pages). This worker's own leases
+        don't count, they're finished here and get completed when their batch commits."""
+        now = datetime.now(timezone.utc)
+        others_working = and_(
+            FrontierTable.crawl_id == self.crawl_id,
+            FrontierTable.status == 'leased',
+            FrontierTable.worker_id != self.worker_id,
+            FrontierTable.lease_expires_at >= now,
+        )
+        with self.Session() as session:
+            return session.scalar(
+                select(func.count()).select_from(FrontierTable).where(or_(self.claimable(now), others_working))
+            ) > 0
+
+    def summary(self):
+        """Returns {(status, worker_id): row count} for this crawl."""
+        with self.Session() as session:
+            rows = session.execute(
+                select(FrontierTable.status, FrontierTable.worker_id, func.count())
+                .where(FrontierTable.crawl_id == self.crawl_id)
+                .group_by(FrontierTable.status, FrontierTable.worker_id)
+            ).all()
+        return {(status, worker_id): count for status, worker_id, count in rows}
+
+    def close(self):
+        frontier_logger.info(f'crawl {self.crawl_id} frontier: {self.summary()}')
+        self.engine.dispose()
@@ -9,6 +9,7 @@ import scrapy
 class LaptopItem(scrapy.Item):
     product_name = scrapy.Field()
     upc = scrapy.Field()
+    sku = scrapy.Field()
     link = scrapy.Field()
     timestamp = scrapy.Field()
     attributes = scrapy.Field()
@@ -75,7 +76,25 @@ class LaptopItem(scrapy.Item):
     system_memory_ram_gb = scrapy.Field()
     type_of_memory_ram = scrapy.Field() 
     system_memory_ram_speed_mhz = scrapy.Field()
-    
+
+
+class CleanedLaptopItem(LaptopItem):
+    """LaptopItem that was already run through CleaningPipeline in a parse worker (PARSE_CLEAN_IN_WORKERS)."""
+
+
+class PriceItem(scrapy.Item):
+    """Price-only update for a laptop that is already in the database, e.g. read off a listing tile."""
+    sku = scrapy.Field()
+    upc = scrapy.Field()
+    link = scrapy.Field()
+    timestamp = scrapy.Field()
+
+    # Price data
+    price = scrapy.Field()
+    full_price = scrapy.Field()
+    dollars_off = scrapy.Field()
+    discount_percentage = scrapy.Field()
+
 #####################################################    
 # Field name constants
 #####################################################
@@ -4,9 +4,32 @@
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
 from scrapy import signals
+from scrapy.exceptions import NotConfigured, StopDownload
+from deal_scraper.extractors import SPEC_SCRIPT_MARKER, FragmentsScan
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
+from weakref import WeakKeyDictionary
+import hashlib
+import json
+import logging
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:
+        zstd = None
+
+conditional_get_logger = logging.getLogger('deal_scraper.middlewares.ConditionalGetMiddleware')
 
 
 class DealScraperSpiderMiddleware:
@@ -101,3 +124,223 @@ class DealScraperDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class ConditionalGetMiddleware:
+    """Skips re-parsing product pages that haven't changed since the last crawl.
+
+    Keeps the ETag/Last-Modified headers, a hash of the body and the last scraped price for
+    each product url in a json file. Product requests are sent as conditional requests, and
+    when the server answers 304 or the body hash matches, the cached entry is passed to
+    parse_product as the unchanged_page callback kwarg so it can emit the price without parsing.
+    """
+
+    def __init__(self, store_path, stats):
+        self.store_path = store_path
+        self.stats = stats
+        self.store = {}
+        # Headers and hashes of changed pages, only saved once an item is scraped from them
+        self.pending = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("CONDITIONAL_GET_ENABLED"):
+            raise NotConfigured
+        s = cls(crawler.settings.get("CONDITIONAL_GET_STORE", "conditional_get.json"), crawler.stats)
+        crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(s.item_scraped, signal=signals.item_scraped)
+        return s
+
+    @staticmethod
+    def is_product_request(request):
+        return getattr(request.callback, "__name__", None) == "parse_product"
+
+    def process_request(self, request, spider):
+        if not self.is_product_request(request):
+            return None
+
+        # Only ask for a 304 when there's a stored price to fall back on
+        entry = self.store.get(request.url)
+        if not entry or entry.get("price") is None:
+            return None
+        if entry.get("etag"):
+            request.headers.setdefault("If-None-Match", entry["etag"])
+        if entry.get("last_modified"):
+            request.headers.setdefault("If-Modified-Since", entry["last_modified"])
+        if 304 not in request.meta.get("handle_httpstatus_list", []):
+            request.meta["handle_httpstatus_list"] = request.meta.get("handle_httpstatus_list", []) + [304]
+        return None
+
+    def process_response(self, request, response, spider):
+        if not self.is_product_request(request) or response.status not in (200, 304):
+            return response
+
+        entry = self.store.get(request.url)
+        fingerprint = hashlib.sha1(response.body).hexdigest()
+        if response.status == 304:
+            unchanged = True
+        else:
+            unchanged = entry is not None and entry.get("fingerprint") == fingerprint
+
+        if unchanged and entry and entry.get("price") is not None:
+            self.stats.inc_value("conditional_get/unchanged")
+            self.stats.inc_value(f"conditional_get/unchanged/{response.status}")
+            request.cb_kwargs["unchanged_page"] = dict(entry)
+        else:
+            self.stats.inc_value("conditional_get/changed")
+            self.pending[request.url] = {
+                "etag": self._header(response, "ETag"),
+                "last_modified": self._header(response, "Last-Modified"),
+                "fingerprint": fingerprint,
+            }
+        return response
+
+    def item_scraped(self, item, response, spider):
+        """Records the cleaned price scraped from a product page against its url."""
+        if response is None or response.request is None:
+            return
+        key = response.request.url
+        if key not in self.pending and key not in self.store:
+            return
+
+        adapter = ItemAdapter(item)
+        if adapter.get("link") != response.url:
+            return
+        entry = {**self.store.get(key, {}), **self.pending.pop(key, {})}
+        for field in ("sku", "upc", "price", "full_price"):
+            entry[field] = adapter.get(field)
+        self.store[key] = entry
+
+    @staticmethod
+    def _header(response, name):
+        value = response.headers.get(name)
+        return value.decode("latin-1") if value else None
+
+    def spider_opened(self, spider):
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as f:
+                self.store = json.load(f)
+        except FileNotFoundError:
+            self.store = {}
+        conditional_get_logger.info(f"loaded {len(self.store)} cached product pages from {self.store_path}")
+
+    def spider_closed(self, spider):
+        # Write to a temp file first so a crash mid-write can't corrupt the store
+        tmp_path = f"{self.store_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.store, f)
+        os.replace(tmp_path, self.store_path)
+
+
+# Content-Encoding -> factory for a function that decodes the body a chunk at a time
+STREAM_DECODERS = {
+    b"identity": lambda: bytes,
+    b"gzip": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS).decompress,
+    b"x-gzip": lambda: zlib.decompressobj(16 + zlib.MAX_WBITS).decompress,
+    b"deflate": lambda: zlib.decompressobj().decompress,
+}
+if brotli is not None:
+    STREAM_DECODERS[b"br"] = lambda: brotli.Decompressor().process
+if zstd is not None:
+    STREAM_DECODERS[b"zstd"] = lambda: zstd.ZstdDecompressor().decompress
+
+
+class PageStream:
+    """The decoded start of a product page that's still downloading."""
+    def __init__(self, decode, sku, expected_size):
+        self.decode = decode
+        # Picks up where the previous chunk's scan stopped, so multi-MB pages aren't rescanned from the start
+        self.fragments = FragmentsScan(sku)
+        # Content-Length of the (encoded) body, -1 if the server didn't send one
+        self.expected_size = expected_size
+        self.body = bytearray()
+        self.spec_seen = False
+        # Where the page gets cut once all the fragments parse_product reads have arrived
+        self.cut = None
+
+
+class EarlyAbortMiddleware:
+    """Stops downloading a product page as soon as everything parse_product reads from it has arrived.
+
+    Product pages are a couple of MB, but the add-to-cart button, the price blocks and the
+    shop-specifications script all sit in the first few hundred KB. The body is decoded as it
+    streams in, and once FragmentsScan finds all of them the download is stopped and the
+    response is cut right after the last one (with its Content-Encoding dropped, since it's already
+    decoded). Pages missing any of them, or sent with an encoding that can't be streamed, download in full.
+    So do pages whose spec script hasn't started within max_scan_size decoded bytes, rather than being buffered here too.
+    """
+
+    def __init__(self, stats, max_scan_size=1024 * 1024):
+        self.stats = stats
+        self.max_scan_size = max_scan_size
+        self.streams = WeakKeyDictionary()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("EARLY_ABORT_ENABLED"):
+            raise NotConfigured
+        s = cls(crawler.stats, crawler.settings.getint("EARLY_ABORT_MAX_SCAN_KB", 1024) * 1024)
+        crawler.signals.connect(s.headers_received, signal=signals.headers_received)
+        crawler.signals.connect(s.bytes_received, signal=signals.bytes_received)
+        return s
+
+    def headers_received(self, headers, body_length, request, spider):
+        if not ConditionalGetMiddleware.is_product_request(request) or request.method == "HEAD":
+            return
+        encodings = headers.getlist("Content-Encoding") or [b"identity"]
+        decoder = STREAM_DECODERS.get(encodings[0].strip().lower()) if len(encodings) == 1 else None
+        if decoder is None:
+            self.stats.inc_value("early_abort/unsupported_encoding")
+            return
+        self.streams[request] = PageStream(decoder(), spider.extract_sku(request.url), body_length)
+
+    def bytes_received(self, data, request, spider):
+        stream = self.streams.get(request)
+        if stream is None or stream.cut is not None:
+            return
+        try:
+            decoded = stream.decode(data)
+        except Exception:
+            # Leave it to HttpCompressionMiddleware to decode (or report) the whole body
+            del self.streams[request]
+            self.stats.inc_value("early_abort/decode_errors")
+            return
+
+        # Nothing to check until the spec script, which comes after the button and prices, starts arriving
+        if not stream.spec_seen:
+            scan_from = max(0, len(stream.body) - len(SPEC_SCRIPT_MARKER))
+            stream.body += decoded
+            stream.spec_seen = stream.body.find(SPEC_SCRIPT_MARKER, scan_from) != -1
+            if not stream.spec_seen:
+                if len(stream.body) > self.max_scan_size:
+                    # Not a page that can be cut, stop holding its decoded copy
+                    del self.streams[request]
+                    self.stats.inc_value("early_abort/full_downloads")
+                return
+        else:
+            stream.body += decoded
+
+        stream.cut = stream.fragments.scan(stream.body)
+        if stream.cut is not None:
+            raise StopDownload(fail=False)
+        if stream.fragments.uncuttable:
+            # The page will download in full, so stop decoding it here and leave that to HttpCompressionMiddleware
+            del self.streams[request]
+            self.stats.inc_value("early_abort/full_downloads")
+
+    def process_response(self, request, response, spider):
+        stream = self.streams.pop(request, None)
+        if stream is None:
+            return response
+        if stream.cut is None or "download_stopped" not in response.flags:
+            self.stats.inc_value("early_abort/full_downloads")
+            return response
+
+        self.stats.inc_value("early_abort/stopped")
+        if stream.expected_size > 0:
+            self.stats.inc_value("early_abort/wire_bytes_skipped", max(0, stream.expected_size - len(response.body)))
+        headers = response.headers.copy()
+        headers.pop("Content-Encoding", None)
+        headers.pop("Content-Length", None)
+        return response.replace(body=bytes(stream.body[:stream.cut]), headers=headers, flags=response.flags + ["early_abort"])
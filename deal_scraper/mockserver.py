@@ -0,0 +1,293 @@
+"""Local stand-in for bestbuy.com, for end-to-end crawl and throughput tests without the live site.
+
+Serves a synthetic laptop catalog shaped like the real pages the spider reads:
+  - listing pages (/site/laptop-computers/all-laptops/pcmcat138500050001.c?cp=<page>) with
+    li.sku-item tiles, a.image-link product links, the result count and a.sku-list-page-next
+  - product pages (/site/<slug>/<sku>.p?skuId=<sku>) with the add-to-cart button, the price
+    blocks and the shop-specifications script, padded out to a realistic page size
+  - the JSON price endpoint (/api/3.0/priceBlocks?skus=<sku>,<sku>,...)
+Latency is drawn from a lognormal distribution, and a share of requests can be answered with
+500s or 429s. Everything is seeded, so the same options always give the same catalog.
+
+Run it with:
+    python -m deal_scraper.mockserver --products 2000 --latency-ms 80 --throttle-rate 0.01
+and point the spider at it:
+    scrapy crawl bestbuy_spider -a start_url=http://127.0.0.1:8766/site/laptop-computers/all-laptops/pcmcat138500050001.c
+"""
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import html
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+mockserver_logger = logging.getLogger('deal_scraper.mockserver')
+
+LISTING_PATH = '/site/laptop-computers/all-laptops/pcmcat138500050001.c'
+PRICE_ENDPOINT_PATH = '/api/3.0/priceBlocks'
+PRODUCT_PATH_PATTERN = re.compile(r'^/site/[^/]+/(\d+)\.p$')
+FIRST_SKU = 7000001
+
+BRANDS = ['Lenovo', 'HP', 'Dell', 'ASUS', 'Acer', 'Microsoft', 'Samsung', 'MSI']
+PROCESSORS = ['Intel Core i5', 'Intel Core i7', 'Intel Core Ultra 7', 'AMD Ryzen 5', 'AMD Ryzen 7', 'Snapdragon X Elite']
+SCREEN_SIZES = ['13.3', '14', '15.6', '16', '17.3']
+RAM_SIZES = ['8', '16', '32', '64']
+STORAGE_SIZES = ['256', '512', '1000', '2000']
+COLORS = ['Silver', 'Black', 'Blue', 'Gray']
+
+
+@dataclass
+class MockProduct:
+    sku: str
+    upc: str
+    name: str
+    slug: str
+    price: float
+    regular_price: float
+    sold_out: bool
+    specs: dict
+
+    @property
+    def path(self):
+        return f'/site/{self.slug}/{self.sku}.p'
+
+    @property
+    def button_state(self):
+        return 'SOLD_OUT' if self.sold_out else 'ADD_TO_CART'
+
+
+def make_catalog(size, sold_out_ratio=0.1, discount_ratio=0.3, seed=0):
+    """Returns size synthetic laptops, the same ones for the same arguments."""
+    rng = random.Random(seed)
+    catalog = []
+    for i in range(size):
+        sku = str(FIRST_SKU + i)
+        brand = rng.choice(BRANDS)
+        processor = rng.choice(PROCESSORS)
+        screen_size = rng.choice(SCREEN_SIZES)
+        ram = rng.choice(RAM_SIZES)
+        storage = rng.choice(STORAGE_SIZES)
+        name = f'{brand} {screen_size}" Laptop - {processor} - {ram}GB Memory - {storage}GB SSD'
+        regular_price = round(rng.uniform(299, 2499), 0) - 0.01
+        price = round(regular_price * rng.uniform(0.6, 0.95), 0) - 0.01 if rng.random() < discount_ratio else regular_price
+        specs = {
+            'Product Name': name,
+            'Brand': brand,
+            'UPC': f'{880000000000 + i:012d}',
+            'Color': rng.choice(COLORS),
+            'Year of Release': str(rng.choice([2023, 2024, 2025])),
+            'Operating System': 'Windows 11 Home',
+            'Screen Size': f'{screen_size} inches',
+            'Screen Resolution': rng.choice(['1920 x 1080 (Full HD)', '2560 x 1600', '2880 x 1800']),
+            'Touch Screen': rng.choice(['true', 'false']),
+            'Processor Model': processor,
+            'System Memory (RAM)': f'{ram} gigabytes',
+            'Storage Type': 'SSD',
+            'Total Storage Capacity': f'{storage} gigabytes',
+            'Graphics': rng.choice(['Intel Iris Xe', 'AMD Radeon', 'NVIDIA GeForce RTX 4060']),
+            'Battery Life (up to)': f'{rng.randint(6, 20)} hours',
+            'Product Weight': f'{rng.uniform(2.5, 6.5):.1f} pounds',
+            'Backlit Keyboard': rng.choice(['true', 'false']),
+        }
+        catalog.append(MockProduct(
+            sku=sku,
+            upc=specs['UPC'],
+            name=name,
+            slug=re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-'),
+            price=price,
+            regular_price=regular_price,
+            sold_out=rng.random() < sold_out_ratio,
+            specs=specs,
+        ))
+    return catalog
+
+
+def price_block_html(product):
+    return (
+        f'<div class="priceView-hero-price priceView-customer-price"><span aria-hidden="true">${product.price:,.2f}</span></div>'
+        f'<div data-testid="regular-price"><span aria-hidden="true">Comp. Value: ${product.regular_price:,.2f}</span></div>'
+    )
+
+
+def button_html(product):
+    return (
+        f'<button class="c-button c-button-primary add-to-cart-button" type="button" '
+        f'data-sku-id="{product.sku}" data-button-state="{product.button_state}">Add to Cart</button>'
+    )
+
+
+def render_listing_page(catalog, page, page_size):
+    """A search results page: tiles for one page of the catalog, the result count and a next link."""
+    products = catalog[(page - 1) * page_size:page * page_size]
+    tiles = ''.join(
+        f'<li class="sku-item" data-sku-id="{product.sku}">'
+        f'<a class="image-link" href="{product.path}?skuId={product.sku}"><img alt="{html.escape(product.name)}"></a>'
+        f'<h4 class="sku-title">{html.escape(product.name)}</h4>'
+        f'{price_block_html(product)}{button_html(product)}'
+        f'</li>'
+        for product in products
+    )
+    next_link = ''
+    if page * page_size < len(catalog):
+        next_link = f'<a class="sku-list-page-next" href="{LISTING_PATH}?cp={page + 1}">Next</a>'
+    return (
+        f'<html><head><title>All Laptops - Best Buy</title></head><body>'
+        f'<span class="item-count">{len(catalog):,} items</span>'
+        f'<ol class="sku-item-list">{tiles}</ol>{next_link}'
+        f'</body></html>'
+    )
+
+
+def render_product_page(product, page_size_kb):
+    """A product page with the button, prices and spec script up front and filler after them,
+    like the real pages' trailing scripts and markup."""
+    specifications = {'specifications': {'categories': [
+        {'displayName': 'Key Specs', 'specifications': [
+            {'displayName': name, 'value': value} for name, value in product.specs.items()
+        ]},
+    ]}}
+    head = (
+        f'<html><head><title>{html.escape(product.name)} - Best Buy</title></head><body>'
+        f'<h1>{html.escape(product.name)}</h1>'
+        f'{price_block_html(product)}{button_html(product)}'
+        f'<script type="application/json" id="shop-specifications-{product.sku}">{json.dumps(specifications)}</script>'
+    )
+    filler_row = '<div class="recommendation"><a href="/site/other/1.p">Customers also viewed</a></div>'
+    filler_count = max(0, (page_size_kb * 1024 - len(head)) // len(filler_row))
+    return head + filler_row * filler_count + '</body></html>'
+
+
+def render_price_blocks(catalog_by_sku, skus):
+    return json.dumps([
+        {'sku': {
+            'skuId': product.sku,
+            'buttonState': {'buttonState': product.button_state},
+            'price': {'currentPrice': product.price, 'regularPrice': product.regular_price},
+        }}
+        for product in (catalog_by_sku.get(sku) for sku in skus) if product
+    ])
+
+
+class MockBestBuyServer(ThreadingHTTPServer):
+    """Threaded HTTP server over a synthetic catalog. Each request sleeps for its sampled latency on its own thread."""
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 8766), catalog_size=1000, page_size=24, page_size_kb=300,
+                 latency_ms=50, latency_sigma=0.5, error_rate=0.0, throttle_rate=0.0, sold_out_ratio=0.1, seed=0):
+        super().__init__(address, MockBestBuyHandler)
+        self.catalog = make_catalog(catalog_size, sold_out_ratio=sold_out_ratio, seed=seed)
+        self.catalog_by_sku = {product.sku: product for product in self.catalog}
+        self.page_size = page_size
+        self.page_size_kb = page_size_kb
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.requests_served = 0
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def start_url(self):
+        return f'{self.base_url}{LISTING_PATH}'
+
+    def sample(self):
+        """Returns (latency in seconds, status to fail with or None) for the next request."""
+        with self.rng_lock:
+            self.requests_served += 1
+            latency = self.rng.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000 if self.latency_ms else 0
+            roll = self.rng.random()
+        if roll < self.throttle_rate:
+            return latency, 429
+        if roll < self.throttle_rate + self.error_rate:
+            return latency, 500
+        return latency, None
+
+    def start_in_thread(self):
+        """Serves from a background thread (e.g. in tests and benchmarks). Call shutdown() to stop."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class MockBestBuyHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        latency, failure_status = self.server.sample()
+        if latency:
+            time.sleep(latency)
+        if failure_status:
+            headers = {'Retry-After': '1'} if failure_status == 429 else {}
+            return self.respond(failure_status, 'text/plain', 'Too Many Requests' if failure_status == 429 else 'Internal Server Error', headers)
+
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == LISTING_PATH:
+            page = int(query.get('cp', ['1'])[0])
+            return self.respond(200, 'text/html', render_listing_page(self.server.catalog, page, self.server.page_size))
+        if url.path == PRICE_ENDPOINT_PATH:
+            skus = query.get('skus', [''])[0].split(',')
+            return self.respond(200, 'application/json', render_price_blocks(self.server.catalog_by_sku, skus))
+
+        match = PRODUCT_PATH_PATTERN.match(url.path)
+        product = self.server.catalog_by_sku.get(match.group(1)) if match else None
+        if product is None:
+            return self.respond(404, 'text/plain', 'Not Found')
+        return self.respond(200, 'text/html', render_product_page(product, self.server.page_size_kb))
+
+    def respond(self, status, content_type, text, headers=None):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        mockserver_logger.debug(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic BestBuy laptop catalog.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--products', type=int, default=1000, help='catalog size')
+    parser.add_argument('--page-size', type=int, default=24, help='tiles per listing page')
+    parser.add_argument('--page-size-kb', type=int, default=300, help='size of each product page')
+    parser.add_argument('--latency-ms', type=float, default=50, help='median response latency')
+    parser.add_argument('--latency-sigma', type=float, default=0.5, help='spread of the lognormal latency distribution')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with a 429')
+    parser.add_argument('--sold-out-ratio', type=float, default=0.1, help='share of products that are sold out')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = MockBestBuyServer(
+        (args.host, args.port), catalog_size=args.products, page_size=args.page_size, page_size_kb=args.page_size_kb,
+        latency_ms=args.latency_ms, latency_sigma=args.latency_sigma, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, sold_out_ratio=args.sold_out_ratio, seed=args.seed,
+    )
+    print(f'serving {args.products} laptops, start url: {server.start_url}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
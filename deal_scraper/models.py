@@ -1,5 +1,5 @@
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, Float, String, Boolean, DateTime, ForeignKey, Text, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from datetime import datetime
@@ -11,6 +11,7 @@ class LaptopTable(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     upc = Column(String, unique=True, nullable=False)
+    sku = Column(String, index=True)
 
     product_name = Column(String)
     
@@ -72,6 +73,8 @@ class LaptopTable(Base):
     type_of_memory_ram = Column(String)
     system_memory_ram_speed_mhz = Column(Float)
 
+    # When the specs were last scraped from the product page
+    specs_fetched_at = Column(DateTime(timezone=True))
 
     # Relationsip to price history rows
     price_history = relationship("PriceHistoryTable", back_populates="laptop")
@@ -92,4 +95,49 @@ class PriceHistoryTable(Base):
     dollars_off = Column(Float)
     discount_percentage = Column(Float)
     link = Column(String)
-    timestamp = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    timestamp = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class DeadLetterTable(Base):
+    """Product pages that failed to download or parse, kept for a targeted recrawl (see deal_scraper.deadletter)."""
+    __tablename__ = 'dead_letters'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    url = Column(String, unique=True, nullable=False)
+    sku = Column(String, index=True)
+
+    reason = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    first_failed_at = Column(DateTime(timezone=True))
+    last_failed_at = Column(DateTime(timezone=True))
+    next_attempt_at = Column(DateTime(timezone=True), index=True)
+    # Set once the page has been scraped and committed successfully
+    resolved_at = Column(DateTime(timezone=True))
+
+
+class FrontierTable(Base):
+    """Work queue shared by the crawler processes of one distributed crawl (see deal_scraper.frontier)."""
+    __tablename__ = 'crawl_frontier'
+    __table_args__ = (UniqueConstraint('crawl_id', 'url'),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    crawl_id = Column(String, nullable=False, index=True)
+
+    url = Column(String, nullable=False)
+    # 'listing' (listing pages and sitemaps) or 'product'
+    kind = Column(String, nullable=False)
+    sku = Column(String, index=True)
+    meta = Column(Text)
+    priority = Column(Integer, default=0)
+
+    # 'pending', 'leased' or 'done'
+    status = Column(String, nullable=False, default='pending', index=True)
+    worker_id = Column(String)
+    lease_token = Column(String, index=True)
+    lease_expires_at = Column(DateTime(timezone=True))
+    attempts = Column(Integer, nullable=False, default=0)
+
+
+def create_db_engine(db_url):
+    """Creates an engine for db_url, converting Heroku style postgres:// urls first."""
+    if db_url.startswith("postgres://"):
+        db_url = db_url.replace("postgres://", "postgresql://", 1)
+    return create_engine(db_url)
@@ -0,0 +1,66 @@
+"""Runs product page parsing, and optionally cleaning, in a pool of worker processes.
+
+The reactor thread is a single core, so with enough pages in flight parse CPU becomes the
+bottleneck. ParsePool ships raw response bodies to a ProcessPoolExecutor and hands back the
+plain field dicts that parse_product would have built in-process.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from deal_scraper.extractors import parse_product_page
+from deal_scraper.items import LaptopItem
+from deal_scraper.pipelines import CleaningPipeline
+import asyncio
+import logging
+import multiprocessing
+
+parse_pool_logger = logging.getLogger('deal_scraper.parse_pool.ParsePool')
+
+
+def clean_fields(fields):
+    return dict(CleaningPipeline().process_item(LaptopItem(**fields), spider=None))
+
+
+def parse_in_worker(body, sku, encoding, clean, category=None):
+    """Worker entry point: parse the page and, if asked, run it (and its variants) through CleaningPipeline."""
+    fields = parse_product_page(body, sku, encoding, category)
+    if fields is None or not clean:
+        return fields
+    variants = [clean_fields(variant) for variant in fields.pop('variants')]
+    sold_out_variants = fields.pop('sold_out_variants')
+    cleaned = clean_fields(fields)
+    cleaned['variants'] = variants
+    cleaned['sold_out_variants'] = sold_out_variants
+    return cleaned
+
+
+class ParsePool:
+    """Bounded front end to a ProcessPoolExecutor for parse_product."""
+    def __init__(self, workers, queue_depth, clean_in_workers):
+        self.workers = workers
+        self.clean_in_workers = clean_in_workers
+        # The pool starts once the reactor and its threads are running, and forking a threaded process can leave
+        # the workers stuck on locks (logging, the db pool) held by other threads. Workers start from a clean
+        # forkserver instead (spawn on Windows), which is why the worker entry points live at module level
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+        # Caps how many bodies are queued for (or held by) the workers at once
+        self.queue_slots = asyncio.Semaphore(queue_depth)
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Returns a pool if PARSE_PROCESS_WORKERS is set, otherwise None (parse in-process)."""
+        workers = settings.getint('PARSE_PROCESS_WORKERS', 0)
+        if workers <= 0:
+            return None
+        queue_depth = settings.getint('PARSE_QUEUE_DEPTH', workers * 4)
+        clean_in_workers = settings.getbool('PARSE_CLEAN_IN_WORKERS', False)
+        parse_pool_logger.info(f'parsing product pages in {workers} worker processes (queue depth {queue_depth})')
+        return cls(workers, queue_depth, clean_in_workers)
+
+    async def parse(self, body, sku, encoding, category=None):
+        """Same result and exceptions as parse_product_page, computed in a worker process."""
+        async with self.queue_slots:
+            future = self.executor.submit(parse_in_worker, body, sku, encoding, self.clean_in_workers, category)
+            return await asyncio.wrap_future(future)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
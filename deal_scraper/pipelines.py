@@ -6,9 +6,9 @@
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
-from deal_scraper.items import LaptopItem
+from deal_scraper.items import CleanedLaptopItem, LaptopItem, PriceItem
 import re
-from datetime import datetime
+from datetime import datetime, timezone
 import logging
 from deal_scraper.items import FIELD_NAMES, PRICE_RECORD_KEYS, NUMERIC_KEYS, BOOL_KEYS
 
@@ -22,7 +22,17 @@ sqlalchemy_logger = logging.getLogger('deal_scraper.pipelines.SQLAlchemyPipeline
 class CleaningPipeline:
     """Cleans and standardizes scraped data before piping it into the database."""
     def process_item(self, item, spider):
+        # Cleaned in a parse worker already, don't spend reactor time doing it again
+        if isinstance(item, CleanedLaptopItem):
+            return item
+
         adapter = ItemAdapter(item)
+
+        # Price-only updates have no specs to clean
+        if isinstance(item, PriceItem):
+            self._clean_price_fields(adapter)
+            self._calculate_price_stats(adapter)
+            return adapter.item
         
         self._extract_specs(adapter)      
         self._set_defaults_if_none(adapter)
@@ -49,8 +59,9 @@ class CleaningPipeline:
                     else:
                         adapter[standardized_key] = value  
 
-        # Remove original 'attributes' field
-        del adapter['attributes'] 
+        # Remove original 'attributes' field (already gone if the item was cleaned in a parse worker)
+        if 'attributes' in adapter:
+            del adapter['attributes'] 
     
     def _set_defaults_if_none(self, adapter):
         adapter['number_of_ethernet_ports'] = adapter.get('number_of_ethernet_ports', 0)
@@ -61,8 +72,14 @@ class CleaningPipeline:
         for key in NUMERIC_KEYS:
             adapter[key] = self.extract_numeric(adapter.get(key))
 
+    def _clean_price_fields(self, adapter):
+        for key in ('price', 'full_price'):
+            adapter[key] = self.extract_numeric(adapter.get(key))
+
     def _clean_boolean_fields(self, adapter):
         for key in BOOL_KEYS:
+            if isinstance(adapter.get(key), bool):  # Already cleaned
+                continue
             if adapter.get(key) and adapter.get(key).lower() == 'true':
                 adapter[key] = True
             else:
@@ -111,6 +128,8 @@ class CleaningPipeline:
         """Extracts the numeric value from a string."""
         if not value:  # Check if the value is None or an empty string
             return None
+        if isinstance(value, (int, float)):  # Already cleaned
+            return float(value)
         # Use regex to extract the numeric part
         match = re.search(r'\d+(\.\d+)?', re.sub(',', '', value))
         return float(match.group()) if match else None
@@ -118,15 +137,24 @@ class CleaningPipeline:
 
 
 
-from deal_scraper.models import LaptopTable, PriceHistoryTable, Base
-from sqlalchemy import create_engine
+from deal_scraper.models import LaptopTable, PriceHistoryTable, Base, create_db_engine
+from dataclasses import dataclass
 from sqlalchemy.orm import sessionmaker
 import smtplib
 from email.message import EmailMessage
 import ast
+from scrapy import signals
 from scrapy.exceptions import DropItem
 import json
 
+@dataclass(slots=True)
+class CommitRecord:
+    """The part of an item SQLAlchemyPipeline keeps until its batch is committed."""
+    sku: str | None = None
+    upc: str | None = None
+    link: str | None = None
+
+
 class SQLAlchemyPipeline: 
     """Saves cleaned LaptopItem data into a PostgreSQL db via SQLAlchemy"""
     def __init__(self, db_url, mismatch_log, email_config, batch_size, upc_watchlist, alert_discount_threshold):
@@ -137,7 +165,10 @@ class SQLAlchemyPipeline:
         self.batch_size = batch_size
         self.upc_watchlist = upc_watchlist
         self.alert_discount_threshold = alert_discount_threshold
-        self.items_to_commit = []
+        # Only compact records are held until commit, the session already holds the rows themselves
+        self.pending_commits = []
+        # Shared frontier, checkpoint and dead letter keys of dropped items, they have nothing to commit but their pages are finished
+        self.dropped_keys = []
 
     @classmethod
     def from_crawler(cls, crawler):
@@ -157,15 +188,15 @@ class SQLAlchemyPipeline:
         watchlist_filename = crawler.settings.get("WATCHLIST_FILENAME")
         upc_watchlist = cls.load_upc_watchlist(filename=watchlist_filename)
         
-        return cls(db_url, mismatch_log, email_config, batch_size, upc_watchlist, alert_discount_threshold)
+        pipeline = cls(db_url, mismatch_log, email_config, batch_size, upc_watchlist, alert_discount_threshold)
+        crawler.signals.connect(pipeline.spider_idle, signal=signals.spider_idle)
+        return pipeline
     
     def open_spider(self, spider):
         """Called wen spider starts.
         Create engine, sessionmaker, and create tables if they don't exist. """
         # Create an engine and a session
-        if self.db_url.startswith("postgres://"):
-            self.db_url = self.db_url.replace("postgres://", "postgresql://", 1)
-        self.engine = create_engine(self.db_url)
+        self.engine = create_db_engine(self.db_url)
         Base.metadata.create_all(self.engine) #tells sqlalchemy to create the products table
         self.Session = sessionmaker(bind=self.engine)
         self.session = self.Session()
@@ -174,7 +205,21 @@ class SQLAlchemyPipeline:
     def process_item(self, item, spider):
         """Convert each Scrapy Item to a SQLAlchemy model and add it to the session."""
         adapter = ItemAdapter(item)
+        try:
+            self._add_item(item, adapter, spider)
+        except DropItem:
+            if any(getattr(spider, name, None) for name in ('frontier', 'checkpoint', 'dead_letters')):
+                self.dropped_keys.append(adapter.get('sku') or adapter.get('link'))
+                if len(self.dropped_keys) >= self.batch_size:
+                    self.complete_dropped(spider)
+            raise
+
+        # Email alert for watchlist    
+        self.check_and_alert(item)
+        return item
 
+    def _add_item(self, item, adapter, spider):
+        """Adds the item's rows to the session, committing when the batch is full. Raises DropItem for items that aren't stored."""
         # Ensure the price is numeric and make sure it's not zero
         price = adapter.get('price')
         try:
@@ -183,9 +228,38 @@ class SQLAlchemyPipeline:
             price = 0.0
         if price == 0:
             raise DropItem(f"Item dropped: price is zero for UPC {adapter.get('upc')}")
-        
-        
-        
+
+        # Frequent watchlist polls only record (and alert on) prices that moved
+        if getattr(spider, 'only_price_changes', False) and self.price_unchanged(adapter):
+            raise DropItem(f"Item dropped: price unchanged for SKU {adapter.get('sku')}", log_level='DEBUG')
+
+        if isinstance(item, PriceItem):
+            self._store_price_only(adapter)
+        else:
+            self._store_laptop(adapter)
+
+        # Batch commit
+        self.pending_commits.append(CommitRecord(sku=adapter.get('sku'), upc=adapter.get('upc'), link=adapter.get('link')))
+        if len(self.pending_commits) >= self.batch_size:
+            self.commit_batch(spider)
+
+    def _store_price_only(self, adapter):
+        """Adds a price record for a laptop that is already stored, found by SKU (or UPC if there's no SKU)."""
+        sku = adapter.get('sku')
+        if sku:
+            laptop_obj = self.session.query(LaptopTable).filter_by(sku=sku).first()
+        else:
+            laptop_obj = self.session.query(LaptopTable).filter_by(upc=adapter.get('upc')).first()
+        if not laptop_obj:
+            raise DropItem(f"Item dropped: no laptop stored for SKU {sku} / UPC {adapter.get('upc')}")
+
+        # Carry the upc over so watchlist alerts still work
+        adapter['upc'] = laptop_obj.upc
+        price_record = self.create_new_price_entry(laptop_obj, adapter)
+        self.session.add(price_record)
+
+    def _store_laptop(self, adapter):
+        """Adds the laptop if it's new (checking specs if not) along with a price record."""
         # 1) Check if a laptop with the same UPC already exists
         upc = adapter.get('upc')
         laptop_obj = self.session.query(LaptopTable).filter_by(upc=upc).first()
@@ -193,6 +267,7 @@ class SQLAlchemyPipeline:
         # 2) If not found, create a new LaptopTable and PriceHistory entry
         if not laptop_obj:
             laptop_obj = self.create_new_product_entry(adapter)
+            laptop_obj.specs_fetched_at = datetime.now(timezone.utc)
             price_record = self.create_new_price_entry(laptop_obj, adapter)
 
             self.session.add(laptop_obj)
@@ -218,24 +293,41 @@ class SQLAlchemyPipeline:
                         f.write(f"  - {line}\n")
                     f.write("\n")
 
+            # Specs were just re-checked against the product page. Backfill the sku on rows stored before it was scraped
+            laptop_obj.specs_fetched_at = datetime.now(timezone.utc)
+            laptop_obj.sku = laptop_obj.sku or adapter.get('sku')
 
             # 4) Create only a PriceHistory entry because product info already exists in database
             price_record = self.create_new_price_entry(laptop_obj, adapter)
             self.session.add(price_record)
-
-        # Batch commit
-        self.items_to_commit.append(item)
-        if len(self.items_to_commit) >= self.batch_size:
-            self.commit_batch(spider)
-   
-        # Email alert for watchlist    
-        self.check_and_alert(item)
-        return item
     
+    def price_unchanged(self, adapter):
+        """Whether the item's price and full price match the latest price row stored for the laptop."""
+        sku = adapter.get('sku')
+        if sku:
+            laptop_obj = self.session.query(LaptopTable).filter_by(sku=sku).first()
+        else:
+            laptop_obj = self.session.query(LaptopTable).filter_by(upc=adapter.get('upc')).first()
+        if not laptop_obj:
+            return False
+
+        latest = (
+            self.session.query(PriceHistoryTable)
+            .filter_by(laptop_id=laptop_obj.id)
+            .order_by(PriceHistoryTable.timestamp.desc(), PriceHistoryTable.id.desc())
+            .first()
+        )
+        if not latest:
+            return False
+        return latest.price == float(adapter.get('price')) and latest.full_price == float(adapter.get('full_price') or 0)
+
     def create_new_price_entry(self, laptop_obj, adapter):
         data_for_price_history = {}
         for field in PRICE_RECORD_KEYS:
             data_for_price_history[field] = adapter.get(field)
+        # Items carry an ISO string, which Postgres casts but SQLite (used for local runs) rejects
+        if isinstance(data_for_price_history.get('timestamp'), str):
+            data_for_price_history['timestamp'] = datetime.fromisoformat(data_for_price_history['timestamp'])
 
         price_record = PriceHistoryTable(
             laptop = laptop_obj, 
@@ -254,20 +346,61 @@ class SQLAlchemyPipeline:
         )
         return laptop_obj
 
+    def complete_dropped(self, spider):
+        """Marks the pages of dropped items done, so the shared frontier doesn't lease them again until they run
+        out of attempts, a resumed crawl doesn't fetch them again and a 'deadletter' crawl stops retrying them."""
+        dropped, self.dropped_keys = self.dropped_keys, []
+        if not dropped:
+            return
+        frontier = getattr(spider, 'frontier', None)
+        if frontier:
+            frontier.complete(dropped)
+        checkpoint = getattr(spider, 'checkpoint', None)
+        if checkpoint:
+            checkpoint.commit(dropped)
+        dead_letters = getattr(spider, 'dead_letters', None)
+        if dead_letters:
+            dead_letters.resolve(dropped)
+
     def commit_batch(self, spider):
         """Commit the current batch of items to the database."""
+        self.complete_dropped(spider)
+        committed, self.pending_commits = self.pending_commits, []
         try: 
             self.session.commit()
-            sqlalchemy_logger.info(f'batch of length {len(self.items_to_commit)}committed successfully')
-            self.items_to_commit = []
         except Exception as e:
+            # The batch's rows are gone, so none of its keys may be reported as stored. Their pages are
+            # still pending in the checkpoint and the shared frontier, so they get fetched again.
             self.session.rollback()
-            sqlalchemy_logger.error(f'batch failed to commit: {e}')
+            sqlalchemy_logger.error(f'batch of length {len(committed)} failed to commit: {e}')
+            return
+        sqlalchemy_logger.info(f'batch of length {len(committed)} committed successfully')
+
+        # Record the committed SKUs so a resumed crawl doesn't fetch or insert them again
+        checkpoint = getattr(spider, 'checkpoint', None)
+        if checkpoint:
+            checkpoint.commit(record.sku or record.link for record in committed)
+        # Same for the shared frontier of a distributed crawl
+        frontier = getattr(spider, 'frontier', None)
+        if frontier:
+            frontier.complete([record.sku or record.link for record in committed])
+        # And failed pages waiting in the dead letter store are resolved now they've been scraped
+        dead_letters = getattr(spider, 'dead_letters', None)
+        if dead_letters:
+            dead_letters.resolve([key for record in committed for key in (record.sku, record.link)])
         
+    def spider_idle(self, spider):
+        """Commits a partial batch when the crawl runs out of work, so shared frontier pages waiting on it
+        are completed instead of holding up the other workers."""
+        self.complete_dropped(spider)
+        if self.pending_commits:
+            self.commit_batch(spider)
+
     def close_spider(self, spider):
         """Called when spider closes.
         Clean up the sesion/enginge. """
-        if self.items_to_commit:
+        self.complete_dropped(spider)
+        if self.pending_commits:
             self.commit_batch(spider)
         self.session.close()
 
@@ -0,0 +1,41 @@
+"""Works out how often each product should be recrawled from how often its price has moved.
+
+A product whose price changed n times over a span of observations is recrawled every
+span / (2 * n), about twice per expected change, clamped between RECRAWL_MIN_HOURS and
+RECRAWL_MAX_HOURS. Products whose price never moved get the maximum interval.
+"""
+from datetime import timedelta, timezone
+
+
+def as_utc(timestamp):
+    """SQLite hands back naive datetimes, they're stored as UTC."""
+    if timestamp.tzinfo is None:
+        return timestamp.replace(tzinfo=timezone.utc)
+    return timestamp
+
+
+def recrawl_interval(observations, min_interval, max_interval):
+    """Returns the recrawl interval for a product from its [(timestamp, price)] history, oldest first."""
+    changes = sum(1 for (_, previous), (_, price) in zip(observations, observations[1:]) if price != previous)
+    if not changes:
+        return max_interval
+    span = as_utc(observations[-1][0]) - as_utc(observations[0][0])
+    return min(max(span / (2 * changes), min_interval), max_interval)
+
+
+def due_products(history, now, min_interval, max_interval):
+    """Returns [(sku, link, interval)] for the products whose next crawl is due, most overdue first.
+
+    history maps sku -> [(timestamp, price, link)] oldest first. Products with no history are due now.
+    """
+    due = []
+    for sku, rows in history.items():
+        if not rows:
+            due.append((timedelta.max, sku, None, min_interval))
+            continue
+        interval = recrawl_interval([(timestamp, price) for timestamp, price, _ in rows], min_interval, max_interval)
+        overdue = now - (as_utc(rows[-1][0]) + interval)
+        if overdue >= timedelta(0):
+            due.append((overdue, sku, rows[-1][2], interval))
+    due.sort(key=lambda entry: entry[0], reverse=True)
+    return [(sku, link, interval) for _, sku, link, interval in due]
@@ -8,6 +8,8 @@ load_dotenv(dotenv_path=BASE_DIR / '.env')
 
 WATCHLIST_FILENAME = os.getenv('WATCHLIST_FILENAME')
 ALERT_DISCOUNT_THRESHOLD = os.getenv('ALERT_DISCOUNT_THRESHOLD')
+# Scheduler priority for watchlist product pages, so they're fetched before the rest of the crawl
+WATCHLIST_PRIORITY = int(os.getenv('WATCHLIST_PRIORITY', 100))
 
 SPIDER_MODULES = ["deal_scraper.spiders"]
 NEWSPIDER_MODULE = "deal_scraper.spiders"
@@ -17,6 +19,13 @@ ROBOTSTXT_OBEY = False
 # Configure maximum concurrent requests performed by Scrapy (default: 16)
 CONCURRENT_REQUESTS = 64
 
+# Parse product pages in this many worker processes instead of on the reactor thread (0 parses in-process)
+PARSE_PROCESS_WORKERS = int(os.getenv("PARSE_PROCESS_WORKERS", 0))
+# Maximum number of response bodies queued for the parse workers at once
+PARSE_QUEUE_DEPTH = int(os.getenv("PARSE_QUEUE_DEPTH", 32))
+# Also run CleaningPipeline in the workers
+PARSE_CLEAN_IN_WORKERS = os.getenv("PARSE_CLEAN_IN_WORKERS", False)
+
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
 # See also autothrottle settings and docs
@@ -45,15 +54,50 @@ CONCURRENT_REQUESTS = 64
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
-#    "deal_scraper.middlewares.DealScraperDownloaderMiddleware": 543,
-#}
+DOWNLOADER_MIDDLEWARES = {
+    "deal_scraper.middlewares.ConditionalGetMiddleware": 543,
+    # Above HttpCompressionMiddleware (590) so it sees the truncated body before it gets decoded, and above
+    # HttpCacheMiddleware (900) so the response archive stores the cut page
+    "deal_scraper.middlewares.EarlyAbortMiddleware": 950,
+}
+
+# Stop downloading product pages once the add-to-cart button, the prices and the spec script have arrived
+EARLY_ABORT_ENABLED = os.getenv("EARLY_ABORT_ENABLED", False)
+# Pages whose spec script hasn't started within this many decoded KB download in full without being buffered.
+# It starts about 500 KB into real product pages
+EARLY_ABORT_MAX_SCAN_KB = int(os.getenv("EARLY_ABORT_MAX_SCAN_KB", 1024))
+
+# Send conditional requests for product pages and skip parsing pages that haven't changed since the last crawl
+CONDITIONAL_GET_ENABLED = os.getenv("CONDITIONAL_GET_ENABLED", False)
+CONDITIONAL_GET_STORE = os.getenv("CONDITIONAL_GET_STORE", "conditional_get.json")
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-#EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-#}
+EXTENSIONS = {
+    "deal_scraper.extensions.AdaptiveConcurrency": 500,
+    "deal_scraper.extensions.TransferStats": 510,
+}
+
+# Fetch https pages over HTTP/2, multiplexing requests to bestbuy.com over one connection per slot
+# instead of a pool of HTTP/1.1 connections (needs the h2 package: pip install "scrapy[http2]").
+# Scrapy's HTTP/2 handler doesn't support proxies or DOWNLOAD_MAXSIZE on https, so it's opt-in
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", False)
+# Responses are requested with Accept-Encoding: gzip, deflate (plus br and zstd when brotli and zstd are installed) and decoded by Scrapy's
+# HttpCompressionMiddleware. TRANSFER_STATS_ENABLED reports bytes on the wire vs. decoded bytes under transfer/
+TRANSFER_STATS_ENABLED = os.getenv("TRANSFER_STATS_ENABLED", True)
+
+# Tune per-domain concurrency from latency and 403/429/503/timeout rates instead of a fixed value
+ADAPTIVE_CONCURRENCY_ENABLED = os.getenv("ADAPTIVE_CONCURRENCY_ENABLED", False)
+# Finished requests per slot between adjustments
+ADAPTIVE_CONCURRENCY_WINDOW = int(os.getenv("ADAPTIVE_CONCURRENCY_WINDOW", 20))
+ADAPTIVE_CONCURRENCY_MIN = int(os.getenv("ADAPTIVE_CONCURRENCY_MIN", 2))
+ADAPTIVE_CONCURRENCY_MAX = int(os.getenv("ADAPTIVE_CONCURRENCY_MAX", CONCURRENT_REQUESTS))
+# Added when latency is flat, multiplied in when the error rate is above the threshold
+ADAPTIVE_CONCURRENCY_INCREASE = int(os.getenv("ADAPTIVE_CONCURRENCY_INCREASE", 2))
+ADAPTIVE_CONCURRENCY_DECREASE = float(os.getenv("ADAPTIVE_CONCURRENCY_DECREASE", 0.5))
+ADAPTIVE_CONCURRENCY_ERROR_THRESHOLD = float(os.getenv("ADAPTIVE_CONCURRENCY_ERROR_THRESHOLD", 0.05))
+# How far the median latency can rise above the best window before ramp-up stops
+ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE = float(os.getenv("ADAPTIVE_CONCURRENCY_LATENCY_TOLERANCE", 0.25))
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -75,6 +119,66 @@ ITEM_PIPELINES = {
 
 BATCH_SIZE = 100
 
+# Save crawl progress here after every committed batch so a killed crawl can resume (unset disables)
+CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE")
+
+# Product sitemaps (or sitemap indexes) read by `-a mode=sitemap`, comma separated
+SITEMAP_URLS = os.getenv("SITEMAP_URLS", "https://sitemaps.bestbuy.com/sitemaps_pdp.xml")
+# Child sitemaps of an index are only followed if their url matches this regex
+SITEMAP_FOLLOW = os.getenv("SITEMAP_FOLLOW", "pdp")
+# Product urls from the sitemaps that are fetched. Slugs don't reliably say what a product is (MacBooks and many
+# Chromebooks have no "laptop" in theirs, laptop bags and stands do), so every product page is fetched by default
+SITEMAP_PRODUCT_PATTERN = os.getenv("SITEMAP_PRODUCT_PATTERN", r"/site/[^/]+/\d+\.p")
+# and only stored if its breadcrumb goes through this category (Computers & Tablets > Laptops). Empty stores every page
+SITEMAP_CATEGORY_ID = os.getenv("SITEMAP_CATEGORY_ID", "abcat0502000")
+
+# Wall-clock budget for a crawl. When set the crawl closes cleanly after this many minutes, and requests
+# are ordered by value: listing pages, watchlist products, products with volatile prices, new SKUs, the rest
+CRAWL_BUDGET_MINUTES = float(os.getenv("CRAWL_BUDGET_MINUTES", 0))
+LISTING_PRIORITY = int(os.getenv("LISTING_PRIORITY", 200))
+VOLATILE_PRIORITY = int(os.getenv("VOLATILE_PRIORITY", 50))
+NEW_SKU_PRIORITY = int(os.getenv("NEW_SKU_PRIORITY", 25))
+# A product is volatile if its price changed this many times within the window
+VOLATILITY_WINDOW_DAYS = float(os.getenv("VOLATILITY_WINDOW_DAYS", 30))
+VOLATILE_MIN_PRICE_CHANGES = int(os.getenv("VOLATILE_MIN_PRICE_CHANGES", 2))
+
+# `-a mode=due` recrawls each product at an interval based on how often its price changed over the
+# last RECRAWL_HISTORY_DAYS, between RECRAWL_MIN_HOURS (frequent discounts) and RECRAWL_MAX_HOURS (static prices)
+RECRAWL_MIN_HOURS = float(os.getenv("RECRAWL_MIN_HOURS", 1))
+RECRAWL_MAX_HOURS = float(os.getenv("RECRAWL_MAX_HOURS", 168))
+RECRAWL_HISTORY_DAYS = float(os.getenv("RECRAWL_HISTORY_DAYS", 30))
+
+# Split one crawl across several crawler processes or hosts: every worker started with the same
+# FRONTIER_CRAWL_ID pulls pages from a shared table (unset runs a single process crawl)
+FRONTIER_CRAWL_ID = os.getenv("FRONTIER_CRAWL_ID")
+# Defaults to DATABASE_URL. With SQLite, point this at a separate file
+FRONTIER_DATABASE_URL = os.getenv("FRONTIER_DATABASE_URL")
+FRONTIER_WORKER_ID = os.getenv("FRONTIER_WORKER_ID")
+# Pages claimed at a time, how long a claim lasts before other workers can take it over, and how many times a page is tried
+FRONTIER_CLAIM_SIZE = int(os.getenv("FRONTIER_CLAIM_SIZE", 64))
+FRONTIER_LEASE_SECONDS = int(os.getenv("FRONTIER_LEASE_SECONDS", 600))
+FRONTIER_MAX_ATTEMPTS = int(os.getenv("FRONTIER_MAX_ATTEMPTS", 3))
+
+# `-a mode=price_endpoint` refreshes the prices of every known SKU from a JSON price endpoint instead of their
+# product pages. {skus} is replaced by a comma separated batch of PRICE_ENDPOINT_BATCH_SIZE SKUs
+PRICE_ENDPOINT_URL = os.getenv("PRICE_ENDPOINT_URL", "https://www.bestbuy.com/api/3.0/priceBlocks?skus={skus}")
+PRICE_ENDPOINT_BATCH_SIZE = int(os.getenv("PRICE_ENDPOINT_BATCH_SIZE", 50))
+
+# Product pages that fail to download or parse are kept in the dead_letters table, and `-a mode=deadletter`
+# retries them with a back-off that doubles from DEAD_LETTER_BASE_DELAY_MINUTES up to DEAD_LETTER_MAX_DELAY_HOURS.
+# Pages that failed DEAD_LETTER_MAX_ATTEMPTS times are no longer retried
+DEAD_LETTER_ENABLED = os.getenv("DEAD_LETTER_ENABLED", True)
+DEAD_LETTER_BASE_DELAY_MINUTES = float(os.getenv("DEAD_LETTER_BASE_DELAY_MINUTES", 30))
+DEAD_LETTER_MAX_DELAY_HOURS = float(os.getenv("DEAD_LETTER_MAX_DELAY_HOURS", 24))
+DEAD_LETTER_MAX_ATTEMPTS = int(os.getenv("DEAD_LETTER_MAX_ATTEMPTS", 5))
+
+# Dedupe product links with a Bloom filter sized for this many SKUs instead of an exact set (0 uses a set)
+SKU_DEDUPE_BLOOM_CAPACITY = int(os.getenv("SKU_DEDUPE_BLOOM_CAPACITY", 0))
+SKU_DEDUPE_BLOOM_ERROR_RATE = float(os.getenv("SKU_DEDUPE_BLOOM_ERROR_RATE", 0.001))
+
+# Skip product pages for SKUs whose specs were scraped within this many days (0 scrapes every product page)
+SPEC_TTL_DAYS = float(os.getenv("SPEC_TTL_DAYS", 0))
+
 
 LOG_ENABLED = True
 
@@ -85,7 +189,7 @@ LOG_LEVEL = 'INFO'  # Options: CRITICAL, ERROR, WARNING, INFO, DEBUG
 LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
 # Direct logs to a file instead of the console
-LOG_FILE = os.getenv()
+LOG_FILE = os.getenv('LOG_FILE')
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -100,13 +204,21 @@ LOG_FILE = os.getenv()
 # Enable showing throttling stats for every response received:
 #AUTOTHROTTLE_DEBUG = True
 
-# Enable and configure HTTP caching (disabled by default)
+# Archive every response of a crawl (zstd compressed, identical bodies stored once), indexed by crawl id and url.
+# ARCHIVE_MODE=record archives the crawl under ARCHIVE_CRAWL_ID (a timestamp by default), ARCHIVE_MODE=replay
+# reruns the spider and pipelines against an archived crawl (the latest by default) with no network. See deal_scraper.archive
+ARCHIVE_MODE = os.getenv("ARCHIVE_MODE")
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_CRAWL_ID = os.getenv("ARCHIVE_CRAWL_ID")
+ARCHIVE_ZSTD_LEVEL = int(os.getenv("ARCHIVE_ZSTD_LEVEL", 10))
+
+# The archive is a storage backend for Scrapy's HTTP cache, which BestBuySpider turns on when ARCHIVE_MODE is set
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_STORAGE = "deal_scraper.archive.ArchiveCacheStorage"
+HTTPCACHE_POLICY = "scrapy.extensions.httpcache.DummyPolicy"
+HTTPCACHE_EXPIRATION_SECS = 0
+# Throttled and failed responses get retried, and 304s have no page to replay
+HTTPCACHE_IGNORE_HTTP_CODES = [304, 403, 429, 500, 502, 503, 504]
 
 # Set settings whose default value is deprecated to a future-proof value
 TWISTED_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
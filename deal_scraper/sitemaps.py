@@ -0,0 +1,34 @@
+"""Streams <loc> urls out of XML sitemaps (plain or gzipped) without building the whole document.
+
+BestBuy's product sitemaps are tens of MB uncompressed. iterparse hands back one <url> or
+<sitemap> entry at a time and each one is cleared once read, so memory stays flat no matter
+how big the file is, and gzipped bodies are decompressed as they're parsed.
+"""
+from lxml import etree
+import gzip
+import io
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def open_sitemap(body):
+    """Returns a file-like object over the sitemap xml, decompressing gzipped bodies on the fly."""
+    stream = io.BytesIO(body)
+    if body[:2] == GZIP_MAGIC:
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+
+def iter_sitemap(body):
+    """Yields ('sitemap', url) for each entry of a sitemap index and ('url', url) for each page of a urlset."""
+    for _, element in etree.iterparse(open_sitemap(body), events=('end',), resolve_entities=False, no_network=True):
+        kind = etree.QName(element).localname
+        if kind not in ('url', 'sitemap'):
+            continue
+        loc = element.findtext('{*}loc')
+        if loc:
+            yield kind, loc.strip()
+        # Free the entry and the ones before it, iterparse keeps them attached to the root otherwise
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
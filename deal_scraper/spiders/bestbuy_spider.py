@@ -1,8 +1,27 @@
 import scrapy
-from deal_scraper.items import LaptopItem
-from datetime import datetime
+from scrapy import signals
+from scrapy.exceptions import DontCloseSpider, IgnoreRequest
+from scrapy.spidermiddlewares.httperror import HttpError
+from deal_scraper.items import CleanedLaptopItem, LaptopItem, PriceItem
+from deal_scraper.extractors import parse_product_page, NotInCategory, SpecificationsNotFound
+from deal_scraper.parse_pool import ParsePool
+from deal_scraper.checkpoint import CrawlCheckpoint
+from deal_scraper.frontier import SharedFrontier
+from deal_scraper.deadletter import DeadLetterStore
+from deal_scraper.dedupe import make_seen_skus
+from deal_scraper.sitemaps import iter_sitemap
+from deal_scraper.recrawl import due_products
+from deal_scraper.models import LaptopTable, PriceHistoryTable, create_db_engine
+from deal_scraper.pipelines import SQLAlchemyPipeline
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+from datetime import datetime, timedelta, timezone
+from w3lib.url import add_or_replace_parameter
+from urllib.parse import urlsplit, urlunsplit
 import json
 import logging
+import math
+import re
 
 spider_logger = logging.getLogger('deal_scraper.spiders.bestbuy_spider.BestBuySpider')
 
@@ -12,58 +31,828 @@ class BestBuySpider(scrapy.Spider):
     allowed_domains = ["bestbuy.com"]
     start_urls = ["https://www.bestbuy.com/site/laptop-computers/all-laptops/pcmcat138500050001.c?id=pcmcat138500050001"]
 
+    def __init__(self, mode='full', start_url=None, allowed_domains=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Point the crawl somewhere else, e.g. the local mock server (see deal_scraper.mockserver).
+        # The allowed domains (comma separated) default to the start url's host.
+        if start_url:
+            self.start_urls = [start_url]
+            self.allowed_domains = [urlsplit(start_url).hostname]
+        if allowed_domains:
+            self.allowed_domains = [domain.strip() for domain in allowed_domains.split(',') if domain.strip()]
+        # 'full' scrapes every product page, 'prices' takes prices off the listing tiles for SKUs already in the db,
+        # 'watchlist' only polls the stored product pages of watchlist UPCs, 'sitemap' finds products
+        # through the product sitemaps instead of the listing pages, 'due' only recrawls the products
+        # whose volatility based recrawl interval has passed, 'deadletter' only retries the product
+        # pages that failed in earlier crawls, 'price_endpoint' refreshes the prices of every known SKU
+        # from the JSON price endpoint, many SKUs per request
+        self.mode = mode
+        # Tells SQLAlchemyPipeline to only store a price row (and alert) when the price moved
+        self.only_price_changes = mode == 'watchlist'
+        # SKU -> when its specs were last scraped, for every SKU already in the db
+        self.spec_freshness = {}
+        self.spec_ttl = None
+        self.parse_pool = None
+        self.checkpoint = None
+        # Shared work queue when several crawler processes split one crawl
+        self.frontier = None
+        # Pages found by the current callback, pushed to the shared frontier in one insert when it's done
+        self.frontier_pushes = []
+        # Failed product pages, kept for a 'deadletter' recrawl
+        self.dead_letters = None
+        # SKUs already scheduled (or priced from a tile) this crawl
+        self.seen_skus = set()
+        # SKUs of watchlist UPCs, fetched ahead of the rest of the crawl
+        self.watchlist_skus = set()
+        self.watchlist_priority = 0
+        self.sitemap_follow = None
+        self.sitemap_product_pattern = None
+        # Product pages whose breadcrumb doesn't go through this category aren't stored (sitemap mode)
+        self.required_category = None
+        # With a crawl budget, requests are ordered by how much a fresh price is worth
+        self.rank_by_value = False
+        self.listing_priority = 0
+        self.known_skus = set()
+        self.volatile_skus = set()
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        # A crawl budget is enforced by the CloseSpider extension, which closes the crawl cleanly
+        # (pipelines flush, the checkpoint is kept for the next run)
+        budget_minutes = settings.getfloat('CRAWL_BUDGET_MINUTES', 0)
+        if budget_minutes > 0:
+            settings.set('CLOSESPIDER_TIMEOUT', budget_minutes * 60, priority='spider')
+        # Scrapy only negotiates HTTP/2 over TLS, so plain http urls keep the HTTP/1.1 handler
+        if settings.getbool('HTTP2_ENABLED'):
+            download_handlers = settings.getdict('DOWNLOAD_HANDLERS')
+            download_handlers['https'] = 'scrapy.core.downloader.handlers.http2.H2DownloadHandler'
+            settings.set('DOWNLOAD_HANDLERS', download_handlers, priority='spider')
+        # The response archive (see deal_scraper.archive) runs through the HTTP cache. Replays never fall through to the network
+        archive_mode = settings.get('ARCHIVE_MODE')
+        if archive_mode:
+            settings.set('HTTPCACHE_ENABLED', True, priority='spider')
+            settings.set('HTTPCACHE_IGNORE_MISSING', archive_mode == 'replay', priority='spider')
+        # Pages missing from a replayed archive aren't failures of the live site, keep them out of the dead letter store
+        if archive_mode == 'replay':
+            settings.set('DEAD_LETTER_ENABLED', False, priority='spider')
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.spider_idle, signal=signals.spider_idle)
+        return spider
+
+    async def start(self):
+        async for request in self.initial_requests():
+            yield request
+        self.flush_frontier_pushes()
+
+    async def initial_requests(self):
+        self.parse_pool = ParsePool.from_settings(self.settings)
+        self.seen_skus = make_seen_skus(self.settings)
+        self.frontier = SharedFrontier.from_crawler(self.crawler)
+        self.dead_letters = DeadLetterStore.from_settings(self.settings)
+
+        checkpoint_file = self.settings.get('CHECKPOINT_FILE')
+        # Watchlist, due, dead letter and price endpoint polls are short and must not leave a partial checkpoint for the next full crawl
+        # to resume. Distributed crawls keep their progress in the shared frontier instead.
+        if checkpoint_file and self.mode not in ('watchlist', 'due', 'deadletter', 'price_endpoint') and not self.frontier:
+            self.checkpoint = CrawlCheckpoint.load(checkpoint_file)
+
+        spec_ttl_days = self.settings.getfloat('SPEC_TTL_DAYS', 0)
+        if spec_ttl_days > 0:
+            self.spec_ttl = timedelta(days=spec_ttl_days)
+
+        if self.uses_listing_prices:
+            self.spec_freshness = self.load_spec_freshness(self.settings.get('DATABASE_URL'))
+            spider_logger.info(f'loaded spec freshness for {len(self.spec_freshness)} known skus')
+
+        if self.settings.getfloat('CRAWL_BUDGET_MINUTES', 0) > 0:
+            self.load_value_ranking()
+
+        # Due, dead letter and price endpoint runs fetch only their own pages, so the watchlist isn't prefetched there
+        watchlist_filename = self.settings.get('WATCHLIST_FILENAME')
+        prefetch_watchlist = watchlist_filename and self.mode in ('full', 'prices', 'sitemap', 'watchlist')
+        upc_watchlist = SQLAlchemyPipeline.load_upc_watchlist(watchlist_filename) if prefetch_watchlist else []
+        if upc_watchlist:
+            self.watchlist_priority = self.settings.getint('WATCHLIST_PRIORITY', 100)
+            watchlist_links = self.load_watchlist_links(self.settings.get('DATABASE_URL'), upc_watchlist)
+            self.watchlist_skus = set(watchlist_links)
+            spider_logger.info(f'{len(watchlist_links)} of {len(upc_watchlist)} watchlist upcs have a known sku, fetching them first')
+            # Go straight to the stored product pages instead of waiting for them to come up in the listing
+            for sku, link in watchlist_links.items():
+                request = self.product_request(link, sku)
+                if request:
+                    yield request
+
+        if self.mode == 'watchlist':
+            if not self.watchlist_skus:
+                spider_logger.warning('watchlist mode: no watchlist upcs with a known sku, nothing to fetch')
+            return
+
+        if self.mode == 'due':
+            for request in self.due_requests():
+                yield request
+            return
+
+        if self.mode == 'deadletter':
+            for request in self.dead_letter_requests():
+                yield request
+            return
+
+        if self.mode == 'price_endpoint':
+            for request in self.price_endpoint_requests():
+                yield request
+            return
+
+        # Set up before resuming, the pending pages of a resumed sitemap crawl need it too
+        if self.mode == 'sitemap':
+            self.sitemap_follow = re.compile(self.settings.get('SITEMAP_FOLLOW', 'pdp'))
+            self.sitemap_product_pattern = re.compile(self.settings.get('SITEMAP_PRODUCT_PATTERN', r'/site/[^/]+/\d+\.p'))
+            self.required_category = self.settings.get('SITEMAP_CATEGORY_ID', 'abcat0502000') or None
+
+        if self.checkpoint and self.checkpoint.resuming:
+            for request in self.resume_requests():
+                yield request
+            return
+
+        if self.mode == 'sitemap':
+            for url in self.settings.getlist('SITEMAP_URLS'):
+                request = self.listing_request(url, meta={'sitemap': True})
+                if request:
+                    yield request
+            return
+
+        async for request in super().start():
+            request.priority = self.listing_priority
+            if self.frontier:
+                self.frontier_pushes.append({'url': request.url, 'kind': 'listing'})
+                continue
+            if self.checkpoint:
+                self.checkpoint.add_listing(request.url, {})
+            yield request
+
+    def spider_idle(self):
+        """In a distributed crawl, pulls the next batch of pages from the shared frontier whenever
+        the scheduler runs dry, and keeps the spider open while other workers may still add pages."""
+        if not self.frontier:
+            return
+        try:
+            requests = self.frontier_requests()
+            outstanding = bool(requests) or self.frontier.has_outstanding_work()
+        except SQLAlchemyError as e:
+            # Usually another worker holding the (SQLite) write lock, try again on the next idle tick
+            spider_logger.warning(f'could not claim from the shared frontier: {e}')
+            raise DontCloseSpider
+        for request in requests:
+            self.crawler.engine.crawl(request)
+        if outstanding:
+            raise DontCloseSpider
+
+    def frontier_requests(self):
+        """Claims a batch of pages from the shared frontier and builds their requests."""
+        requests = []
+        for entry in self.frontier.claim():
+            meta = dict(entry['meta'], frontier_url=entry['url'])
+            if entry['kind'] == 'product':
+                # Stops this worker's listing pages from pushing it again
+                if entry['sku']:
+                    self.seen_skus.add(entry['sku'])
+                callback, errback = self.parse_product, self.product_failed
+            else:
+                callback, errback = self.listing_callback(meta), self.listing_failed
+            # Reclaimed pages may have been requested by this worker before, so skip the dupe filter
+            requests.append(scrapy.Request(
+                entry['url'], callback=callback, errback=errback, meta=meta, priority=entry['priority'], dont_filter=True
+            ))
+        return requests
+
+    def flush_frontier_pushes(self):
+        """Pushes the pages collected by listing_request and product_request to the shared frontier."""
+        if self.frontier_pushes:
+            pushes, self.frontier_pushes = self.frontier_pushes, []
+            self.frontier.push_many(pushes)
+
+    def finish_frontier_page(self, response):
+        """Marks a page that produced no items (listing pages, sold out products) done in the shared frontier,
+        after pushing the pages it links to. Product pages with items are marked done by SQLAlchemyPipeline
+        once their batch commits."""
+        self.flush_frontier_pushes()
+        self.complete_frontier_request(getattr(response, 'request', None))
+
+    def complete_frontier_request(self, request):
+        """Marks the shared frontier row a request was claimed from done."""
+        if self.frontier and request is not None and 'frontier_url' in request.meta:
+            self.frontier.complete([request.meta['frontier_url']])
+
+    def due_requests(self):
+        """Requests the stored product pages of the products that are due for a recrawl."""
+        min_interval = timedelta(hours=self.settings.getfloat('RECRAWL_MIN_HOURS', 1))
+        max_interval = timedelta(hours=self.settings.getfloat('RECRAWL_MAX_HOURS', 168))
+        now = datetime.now(timezone.utc)
+        since = now - timedelta(days=self.settings.getfloat('RECRAWL_HISTORY_DAYS', 30))
+        history = self.load_price_history(self.settings.get('DATABASE_URL'), since)
+
+        due = due_products(history, now, min_interval, max_interval)
+        spider_logger.info(f'{len(due)} of {len(history)} known skus are due for a recrawl')
+        self.inc_stat('bestbuy/recrawl_due', len(due))
+        for sku, link, _ in due:
+            request = self.product_request(link or f'https://www.bestbuy.com/site/{sku}.p?skuId={sku}', sku)
+            if request:
+                yield request
+
+    def dead_letter_requests(self):
+        """Requests the failed product pages whose back-off has passed."""
+        if not self.dead_letters:
+            spider_logger.warning('deadletter mode: dead letters are disabled (DEAD_LETTER_ENABLED or DATABASE_URL), nothing to fetch')
+            return
+        due = self.dead_letters.due()
+        spider_logger.info(f'retrying {len(due)} failed product pages')
+        self.inc_stat('bestbuy/dead_letters_due', len(due))
+        for url, sku in due:
+            request = self.product_request(url, sku)
+            if request:
+                yield request
+
+    def price_endpoint_requests(self):
+        """Requests the prices of every SKU in the db from PRICE_ENDPOINT_URL, PRICE_ENDPOINT_BATCH_SIZE SKUs at a time."""
+        url_template = self.settings.get('PRICE_ENDPOINT_URL', 'https://www.bestbuy.com/api/3.0/priceBlocks?skus={skus}')
+        batch_size = self.settings.getint('PRICE_ENDPOINT_BATCH_SIZE', 50)
+        links = self.load_product_links(self.settings.get('DATABASE_URL'))
+        skus = sorted(sku for sku in links if not self.is_duplicate(sku))
+        spider_logger.info(f'refreshing {len(skus)} known skus from the price endpoint, {batch_size} per request')
+        for start in range(0, len(skus), batch_size):
+            batch = skus[start:start + batch_size]
+            yield scrapy.Request(
+                url_template.format(skus=','.join(batch)),
+                callback=self.parse_price_endpoint,
+                headers={'Accept': 'application/json'},
+                # The endpoint may live on another host than the product pages (allowed_domains)
+                meta={'allow_offsite': True},
+                cb_kwargs={'links': {sku: links[sku] for sku in batch}},
+            )
+
+    def parse_price_endpoint(self, response, links):
+        """Yields a PriceItem for each in-stock SKU in a price endpoint response.
+
+        The endpoint answers with a list of price blocks:
+            [{"sku": {"skuId": "6588662", "buttonState": {"buttonState": "ADD_TO_CART"},
+                      "price": {"currentPrice": 329.99, "regularPrice": 579.99}}}, ...]
+        SKUs that are sold out, missing from the response or have no price are skipped.
+        """
+        try:
+            blocks = json.loads(response.text)
+        except json.JSONDecodeError:
+            spider_logger.error(f'Failed to decode JSON from the price endpoint: {response.url}')
+            self.inc_stat('bestbuy/price_endpoint_errors')
+            return
+
+        priced = set()
+        for block in blocks if isinstance(blocks, list) else []:
+            sku_block = block.get('sku') or {}
+            sku = str(sku_block.get('skuId') or '')
+            if sku not in links:
+                continue
+            if (sku_block.get('buttonState') or {}).get('buttonState') == 'SOLD_OUT':
+                priced.add(sku)
+                self.inc_stat('bestbuy/sold_out_skipped')
+                continue
+            price = (sku_block.get('price') or {}).get('currentPrice')
+            if not price:
+                continue
+            priced.add(sku)
+            item = PriceItem()
+            item['sku'] = sku
+            item['price'] = price
+            item['full_price'] = sku_block['price'].get('regularPrice') or price
+            item['link'] = links[sku]
+            item['timestamp'] = datetime.now().isoformat()
+            yield item
+
+        self.inc_stat('bestbuy/price_endpoint_skus', len(priced))
+        missing = len(links) - len(priced)
+        if missing:
+            spider_logger.warning(f'{missing} of {len(links)} skus had no price in {response.url}')
+            self.inc_stat('bestbuy/price_endpoint_missing', missing)
+
+    def record_failure(self, url, sku, reason):
+        """Keeps a failed product page in the dead letter store so a 'deadletter' crawl can retry it."""
+        self.inc_stat('bestbuy/dead_letters_recorded')
+        if not self.dead_letters:
+            return
+        try:
+            self.dead_letters.record(url, sku, reason)
+        except SQLAlchemyError as e:
+            spider_logger.error(f'could not record failed page {url}: {e}')
+
+    def resolve_failure(self, url, sku):
+        """Resolves the page's dead letter, if it had one, now that it parsed without failing."""
+        if not self.dead_letters:
+            return
+        try:
+            self.dead_letters.resolve([sku, url])
+        except SQLAlchemyError as e:
+            spider_logger.error(f'could not resolve failed page {url}: {e}')
+
+    def product_failed(self, failure):
+        """Errback for product pages: download errors (after retries) and HTTP error statuses go to the dead letter store.
+        The page's shared frontier row is marked done either way, the dead letter store owns its retries."""
+        request = failure.request
+        self.complete_frontier_request(request)
+        if failure.check(HttpError):
+            reason = f'HTTP {failure.value.response.status}'
+        elif failure.check(IgnoreRequest):
+            # Dropped on purpose (e.g. a page a replayed archive doesn't have), the page itself didn't fail
+            spider_logger.debug(f'product page {request.url} ignored: {failure.getErrorMessage()}')
+            return
+        else:
+            reason = f'{failure.type.__name__}: {failure.getErrorMessage()}'
+        spider_logger.error(f'product page {request.url} failed: {reason}')
+        self.record_failure(request.url, self.extract_sku(request.url), reason)
+
+    def listing_failed(self, failure):
+        """Errback for listing pages claimed from the shared frontier: marks their row done so the other workers
+        don't stay open waiting on a page that already failed (after retries)."""
+        request = failure.request
+        self.complete_frontier_request(request)
+        if failure.check(IgnoreRequest):
+            spider_logger.debug(f'listing page {request.url} ignored: {failure.getErrorMessage()}')
+        else:
+            spider_logger.error(f'listing page {request.url} failed: {failure.type.__name__}: {failure.getErrorMessage()}')
+
+    def resume_requests(self):
+        """Re-schedules the frontier of the unfinished crawl recorded in the checkpoint."""
+        for url, meta in list(self.checkpoint.listing_pending.items()):
+            yield scrapy.Request(url, callback=self.listing_callback(meta), meta=dict(meta), dont_filter=True)
+        for key, url in list(self.checkpoint.product_pending.items()):
+            yield scrapy.Request(url, callback=self.parse_product, errback=self.product_failed, priority=self.product_priority(key))
+
+    @property
+    def uses_listing_prices(self):
+        """Whether known SKUs get their price from the listing tile instead of the product page."""
+        return self.mode == 'prices' or self.spec_ttl is not None
+
+    def needs_specs(self, sku):
+        """Whether the product page has to be scraped: the SKU is new or its specs are older than the TTL."""
+        if sku not in self.spec_freshness:
+            return True
+        if self.spec_ttl is None:
+            return False
+
+        fetched_at = self.spec_freshness[sku]
+        if fetched_at is None:
+            return True
+        if fetched_at.tzinfo is None:
+            fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+        return datetime.now(timezone.utc) - fetched_at > self.spec_ttl
+
     def parse(self, response):
+        yield from self.parse_listing(response)
+
+        # Only mark the page done once everything on it has been scheduled
+        if self.checkpoint:
+            self.checkpoint.finish_listing(response.request.url)
+        self.finish_frontier_page(response)
+
+    def parse_sitemap(self, response):
+        """Follows the child sitemaps of a sitemap index and schedules the product pages of a urlset.
+        parse_product then drops the ones that aren't laptops (see SITEMAP_CATEGORY_ID)."""
+        product_count = 0
+        for kind, url in iter_sitemap(response.body):
+            if kind == 'sitemap':
+                if self.sitemap_follow.search(url):
+                    request = self.listing_request(url, meta={'sitemap': True})
+                    if request:
+                        yield request
+            elif self.sitemap_product_pattern.search(url):
+                product_count += 1
+                request = self.product_request(url)
+                if request:
+                    yield request
+        spider_logger.info(f'{product_count} product pages in sitemap {response.url}')
+
+        if self.checkpoint:
+            self.checkpoint.finish_listing(response.request.url)
+        self.finish_frontier_page(response)
+
+    def parse_listing(self, response):
         # Find the individual product pages and callback with parse_product()
         product_page_links = response.css('a.image-link::attr(href)').getall()
         spider_logger.info(f'product page links: {product_page_links}')
-        yield from response.follow_all(product_page_links, self.parse_product)
+        sold_out_skus = self.get_sold_out_skus(response)
+        if self.uses_listing_prices:
+            yield from self.parse_listing_prices(response, sold_out_skus)
+        else:
+            for link in product_page_links:
+                url = response.urljoin(link)
+                if self.extract_sku(url) in sold_out_skus:
+                    self.skip_sold_out(self.extract_sku(url))
+                    continue
+                request = self.product_request(url)
+                if request:
+                    yield request
+
+        # Pages scheduled by the fan-out below are already covered, no need to chain from them. The last one
+        # still follows its next link, in case extra (e.g. sponsored) tiles on page 1 made the page count come out short
+        if response.meta.get('fanned_out'):
+            if not response.meta.get('last_fanned_out'):
+                return
 
+        # On the first listing page, schedule every remaining page at once instead of walking the next-links
+        elif not response.meta.get('paginated'):
+            page_count = self.get_page_count(response)
+            if page_count and page_count > 1:
+                spider_logger.info(f'fanning out to {page_count} listing pages')
+                for page_number in range(2, page_count + 1):
+                    page_url = add_or_replace_parameter(response.url, 'cp', str(page_number))
+                    meta = {'fanned_out': True, 'last_fanned_out': True} if page_number == page_count else {'fanned_out': True}
+                    request = self.listing_request(page_url, meta=meta)
+                    if request:
+                        yield request
+                return
 
         # Find the next search pages 
         pagination_links = response.css('a.sku-list-page-next::attr(href)').getall()
         spider_logger.info(f'pagination links: {pagination_links}')
-        yield from response.follow_all(pagination_links, self.parse)
-
-
-    def parse_product(self, response):
-        # If item is sold out, skip 
-        product_stock = response.css('button.add-to-cart-button::attr(data-button-state)').get()
-        if product_stock == 'SOLD_OUT':
-            return
-        
-        # Locate <script> tags and find the one that contains spec data
-        scripts = response.css('script::text').getall()
-        specifications_json = None
-        for script in scripts:
-            if "shop-specifications-" in script:
-                specifications_json = script
-                break
-
-        if specifications_json:
-            try:
-                data = json.loads(specifications_json)
-                specifications = data.get("specifications", {}).get("categories", [])
-
-                item = LaptopItem()
-                item['price'] = response.css('div.priceView-hero-price span[aria-hidden="true"]::text').get(default='0')
-                item['full_price'] =  response.css('div[data-testid="regular-price"] span[aria-hidden="true"]::text').get(item['price'])
-                item['link'] = response.url
-                item['timestamp'] = datetime.now().isoformat()
+        for link in pagination_links:
+            request = self.listing_request(response.urljoin(link), meta={'paginated': True})
+            if request:
+                yield request
+
+    def listing_request(self, url, meta):
+        """Builds the request for a listing page (or sitemap), or returns None if it was parsed earlier in a resumed crawl
+        or was handed to the shared frontier."""
+        if self.frontier:
+            self.frontier_pushes.append({'url': url, 'kind': 'listing', 'meta': meta, 'priority': self.listing_priority})
+            return None
+        if self.checkpoint:
+            if self.checkpoint.is_listing_done(url):
+                return None
+            self.checkpoint.add_listing(url, meta)
+        return scrapy.Request(url, callback=self.listing_callback(meta), meta=meta, priority=self.listing_priority)
+
+    def listing_callback(self, meta):
+        return self.parse_sitemap if meta.get('sitemap') else self.parse
+
+    def product_request(self, url, sku=None):
+        """Builds the request for a product page, or returns None if the SKU was already scheduled this crawl
+        or committed earlier in a resumed crawl."""
+        url = self.canonical_product_url(url)
+        sku = sku or self.extract_sku(url)
+        if self.is_duplicate(sku):
+            return None
+        if self.frontier:
+            self.frontier_pushes.append({'url': url, 'kind': 'product', 'sku': sku, 'priority': self.product_priority(sku)})
+            return None
+        if self.checkpoint:
+            key = sku or url
+            if self.checkpoint.is_committed(key):
+                return None
+            self.checkpoint.add_product(key, url)
+        return scrapy.Request(url, callback=self.parse_product, errback=self.product_failed, priority=self.product_priority(sku))
 
-                # Unpack the spec data and structure in key-value pairs
-                attributes = {}
-                for spec_category in specifications:
-                    for spec in spec_category.get("specifications", []):
-                        spec_name = spec.get("displayName", "Unknown")
-                        spec_value = spec.get("value", "N/A")
-                        attributes[spec_name] = spec_value
+    def load_value_ranking(self):
+        """Loads what product_priority ranks by when the crawl has a time budget, and puts listing
+        pages first so every product is discovered before the budget is spent on product pages."""
+        db_url = self.settings.get('DATABASE_URL')
+        self.rank_by_value = True
+        self.listing_priority = self.settings.getint('LISTING_PRIORITY', 200)
+        self.known_skus = set(self.spec_freshness or self.load_spec_freshness(db_url))
+        since = datetime.now(timezone.utc) - timedelta(days=self.settings.getfloat('VOLATILITY_WINDOW_DAYS', 30))
+        self.volatile_skus = self.load_volatile_skus(db_url, since, self.settings.getint('VOLATILE_MIN_PRICE_CHANGES', 2))
+        spider_logger.info(
+            f'crawl budget of {self.settings.getfloat("CRAWL_BUDGET_MINUTES")} minutes: ranking {len(self.volatile_skus)} '
+            f'volatile skus and new skus ahead of the other {len(self.known_skus)} known skus'
+        )
 
-                item['attributes'] = attributes
+    def product_priority(self, sku):
+        """Watchlist products jump the queue so their alerts go out early in the crawl. With a crawl budget,
+        products whose price moves often come next, then SKUs that aren't in the db yet, then the rest."""
+        if sku in self.watchlist_skus:
+            self.inc_stat('bestbuy/watchlist_requests')
+            return self.watchlist_priority
+        if not self.rank_by_value:
+            return 0
+        if sku in self.volatile_skus:
+            self.inc_stat('bestbuy/volatile_requests')
+            return self.settings.getint('VOLATILE_PRIORITY', 50)
+        if sku not in self.known_skus:
+            self.inc_stat('bestbuy/new_sku_requests')
+            return self.settings.getint('NEW_SKU_PRIORITY', 25)
+        return 0
+
+    @staticmethod
+    def get_page_count(response):
+        """Works out the number of listing pages from the result count and the tiles on this page.
+        Returns None if either is missing."""
+        item_count_text = response.css('span.item-count::text').get()
+        tiles_per_page = len(response.css('li.sku-item'))
+        if not item_count_text or not tiles_per_page:
+            return None
+
+        # e.g. "523 items" or "1-24 of 1,523 items"
+        match = re.search(r'([\d,]+)\s+items', item_count_text)
+        if not match:
+            return None
+        return math.ceil(int(match.group(1).replace(',', '')) / tiles_per_page)
+
+    def get_sold_out_skus(self, response):
+        """Returns the SKUs whose listing tile already shows a sold out add-to-cart button."""
+        sold_out_skus = set()
+        for tile in response.css('li.sku-item'):
+            button = tile.css('button.add-to-cart-button[data-button-state="SOLD_OUT"]')
+            if not button:
+                continue
+            sku = (
+                tile.attrib.get('data-sku-id')
+                or button.attrib.get('data-sku-id')
+                or self.extract_sku(tile.css('a.image-link::attr(href)').get(''))
+            )
+            if sku:
+                sold_out_skus.add(sku)
+        return sold_out_skus
+
+    def skip_sold_out(self, sku):
+        """Sold out products would be dropped by parse_product anyway, so their pages aren't fetched.
+        They're counted in the crawl stats and marked as seen so no other listing schedules them."""
+        if not self.is_duplicate(sku):
+            self.inc_stat('bestbuy/sold_out_skipped')
+
+    def parse_listing_prices(self, response, sold_out_skus=()):
+        """Yields a PriceItem straight from the listing tile for SKUs with fresh specs.
+        New or stale SKUs still go to parse_product so their specs get stored."""
+        for tile in response.css('li.sku-item'):
+            link = tile.css('a.image-link::attr(href)').get()
+            if not link:
+                continue
+            sku = tile.attrib.get('data-sku-id') or self.extract_sku(link)
+            if sku in sold_out_skus:
+                self.skip_sold_out(sku)
+                continue
+
+            if not self.needs_specs(sku):
+                if self.is_duplicate(sku):
+                    continue
+                if self.checkpoint:
+                    if self.checkpoint.is_committed(sku):
+                        continue
+                    # Tracked like a product page so it gets fetched on resume if its row never commits
+                    self.checkpoint.add_product(sku, response.urljoin(link))
+                item = PriceItem()
+                item['sku'] = sku
+                item['price'] = tile.css('div.priceView-hero-price span[aria-hidden="true"]::text').get(default='0')
+                item['full_price'] = tile.css('div[data-testid="regular-price"] span[aria-hidden="true"]::text').get(item['price'])
+                item['link'] = self.canonical_product_url(response.urljoin(link))
+                item['timestamp'] = datetime.now().isoformat()
                 yield item
+            else:
+                request = self.product_request(response.urljoin(link), sku)
+                if request:
+                    yield request
+
+    @staticmethod
+    def make_unchanged_price_item(response, cached_page):
+        """Builds a "still listed at the same price" record from the cached product page entry."""
+        item = PriceItem()
+        item['sku'] = cached_page.get('sku')
+        item['upc'] = cached_page.get('upc')
+        item['price'] = cached_page.get('price')
+        item['full_price'] = cached_page.get('full_price')
+        item['link'] = response.url
+        item['timestamp'] = datetime.now().isoformat()
+        return item
+
+    def is_duplicate(self, sku):
+        """Records the SKU as seen and returns whether it had already been seen this crawl."""
+        if sku is None:
+            return False
+        if sku in self.seen_skus:
+            self.inc_stat('bestbuy/duplicate_skus_skipped')
+            return True
+        self.seen_skus.add(sku)
+        return False
+
+    def inc_stat(self, key, count=1):
+        # Spiders built outside a crawler (e.g. in tests) have no stats
+        crawler = getattr(self, 'crawler', None)
+        if crawler:
+            crawler.stats.inc_value(key, count)
+
+    @classmethod
+    def canonical_product_url(cls, url):
+        """Strips tracking params etc. so each product has one url: <path>?skuId=<sku>."""
+        sku = cls.extract_sku(url)
+        if not sku:
+            return url
+        parts = urlsplit(url)
+        return urlunsplit((parts.scheme, parts.netloc, parts.path, f'skuId={sku}', ''))
+
+    @staticmethod
+    def extract_sku(url):
+        """Pulls the SKU id out of a product url, from the skuId param or the /<sku>.p path."""
+        match = re.search(r'skuId=(\d+)', url) or re.search(r'/(\d+)\.p', url)
+        return match.group(1) if match else None
 
-            except json.JSONDecodeError:
-                spider_logger.error("Failed to decode JSON from the specifications script.")
-        
-        
+    @staticmethod
+    def load_spec_freshness(db_url):
+        """Returns {sku: specs_fetched_at} for every SKU that already has a row in the laptops table."""
+        engine = create_db_engine(db_url)
+        session = sessionmaker(bind=engine)()
+        try:
+            rows = (
+                session.query(LaptopTable.sku, LaptopTable.specs_fetched_at)
+                .filter(LaptopTable.sku.isnot(None))
+                .all()
+            )
+            return {sku: specs_fetched_at for sku, specs_fetched_at in rows}
+        finally:
+            session.close()
+            engine.dispose()
+
+
+    @staticmethod
+    def load_volatile_skus(db_url, since, min_price_changes):
+        """Returns the SKUs whose price changed at least min_price_changes times since the given time."""
+        engine = create_db_engine(db_url)
+        session = sessionmaker(bind=engine)()
+        try:
+            rows = (
+                session.query(LaptopTable.sku, PriceHistoryTable.price)
+                .join(PriceHistoryTable, PriceHistoryTable.laptop_id == LaptopTable.id)
+                .filter(LaptopTable.sku.isnot(None), PriceHistoryTable.timestamp >= since)
+                .order_by(LaptopTable.id, PriceHistoryTable.timestamp)
+                .all()
+            )
+        finally:
+            session.close()
+            engine.dispose()
+
+        price_changes = {}
+        last_prices = {}
+        for sku, price in rows:
+            if sku in last_prices and price != last_prices[sku]:
+                price_changes[sku] = price_changes.get(sku, 0) + 1
+            last_prices[sku] = price
+        return {sku for sku, changes in price_changes.items() if changes >= min_price_changes}
+
+    @staticmethod
+    def load_price_history(db_url, since):
+        """Returns {sku: [(timestamp, price, link)]} of the price rows since the given time, oldest first,
+        for every SKU in the laptops table (an empty list if it has no recent rows)."""
+        engine = create_db_engine(db_url)
+        session = sessionmaker(bind=engine)()
+        try:
+            history = {sku: [] for (sku,) in session.query(LaptopTable.sku).filter(LaptopTable.sku.isnot(None))}
+            rows = (
+                session.query(LaptopTable.sku, PriceHistoryTable.timestamp, PriceHistoryTable.price, PriceHistoryTable.link)
+                .join(PriceHistoryTable, PriceHistoryTable.laptop_id == LaptopTable.id)
+                .filter(LaptopTable.sku.isnot(None), PriceHistoryTable.timestamp >= since)
+                .order_by(PriceHistoryTable.timestamp)
+                .all()
+            )
+            for sku, timestamp, price, link in rows:
+                history[sku].append((timestamp, price, link))
+            return history
+        finally:
+            session.close()
+            engine.dispose()
+
+    @classmethod
+    def load_watchlist_links(cls, db_url, upc_watchlist):
+        """Returns {sku: product url} for the watchlist UPCs already in the laptops table."""
+        return cls.load_product_links(db_url, upc_watchlist)
+
+    @staticmethod
+    def load_product_links(db_url, upcs=None):
+        """Returns {sku: product url} for every SKU in the laptops table (or just those of the given UPCs),
+        using the link from each one's latest price history row."""
+        engine = create_db_engine(db_url)
+        session = sessionmaker(bind=engine)()
+        try:
+            query = (
+                session.query(LaptopTable.sku, PriceHistoryTable.link)
+                .outerjoin(PriceHistoryTable, PriceHistoryTable.laptop_id == LaptopTable.id)
+                .filter(LaptopTable.sku.isnot(None))
+            )
+            if upcs is not None:
+                query = query.filter(LaptopTable.upc.in_(upcs))
+            rows = query.order_by(PriceHistoryTable.timestamp).all()
+            links = {}
+            for sku, link in rows:
+                # Rows come oldest first, so the latest link wins
+                links[sku] = link or links.get(sku) or f'https://www.bestbuy.com/site/{sku}.p?skuId={sku}'
+            return links
+        finally:
+            session.close()
+            engine.dispose()
+
+    def parse_product(self, response, unchanged_page=None):
+        # Page hasn't changed since the last crawl (see ConditionalGetMiddleware), reuse the price scraped then
+        if unchanged_page:
+            return [self.make_unchanged_price_item(response, unchanged_page)]
+
+        if self.parse_pool:
+            return self.parse_product_in_pool(response)
+        return self.parse_product_in_process(response)
+
+    def parse_product_in_process(self, response):
+        sku = self.extract_sku(response.url)
+        try:
+            fields = parse_product_page(response.body, sku=sku, encoding=response.encoding, category=self.required_category)
+        except NotInCategory:
+            self.inc_stat('bestbuy/off_category_product_pages')
+            self.finish_unstored_page(response, sku)
+            return
+        except json.JSONDecodeError:
+            spider_logger.error("Failed to decode JSON from the specifications script.")
+            self.record_failure(response.url, sku, 'specifications json could not be decoded')
+            self.finish_frontier_page(response)
+            return
+        except SpecificationsNotFound:
+            spider_logger.error("Specifications JSON not found on the BestBuy html.")
+            self.record_failure(response.url, sku, 'specifications json not found')
+            self.finish_frontier_page(response)
+            return
+
+        # Sold out items are skipped
+        if fields:
+            yield from self.make_product_items(response, fields)
         else:
-            spider_logger.error("Specifications JSON not found on the BestBuy html.")
\ No newline at end of file
+            self.inc_stat('bestbuy/sold_out_product_pages')
+            self.finish_unstored_page(response, sku)
+
+    async def parse_product_in_pool(self, response):
+        sku = self.extract_sku(response.url)
+        try:
+            fields = await self.parse_pool.parse(response.body, sku, response.encoding, self.required_category)
+        except NotInCategory:
+            self.inc_stat('bestbuy/off_category_product_pages')
+            self.finish_unstored_page(response, sku)
+            return
+        except json.JSONDecodeError:
+            spider_logger.error("Failed to decode JSON from the specifications script.")
+            self.record_failure(response.url, sku, 'specifications json could not be decoded')
+            self.finish_frontier_page(response)
+            return
+        except SpecificationsNotFound:
+            spider_logger.error("Specifications JSON not found on the BestBuy html.")
+            self.record_failure(response.url, sku, 'specifications json not found')
+            self.finish_frontier_page(response)
+            return
+
+        if fields:
+            item_class = CleanedLaptopItem if self.parse_pool.clean_in_workers else LaptopItem
+            for item in self.make_product_items(response, fields, item_class):
+                yield item
+        else:
+            self.inc_stat('bestbuy/sold_out_product_pages')
+            self.finish_unstored_page(response, sku)
+
+    def finish_unstored_page(self, response, sku):
+        """Product pages with nothing to store (sold out, or not a laptop) have no item to commit, so they're
+        marked done here. Otherwise a resumed crawl would fetch them again, and a 'deadletter' crawl would keep
+        retrying them."""
+        if self.checkpoint:
+            self.checkpoint.finish_products([sku or response.url])
+        self.resolve_failure(response.url, sku)
+        self.finish_frontier_page(response)
+
+    def make_product_items(self, response, fields, item_class=LaptopItem):
+        """Yields the page's own LaptopItem, then one per sibling variant found on the page.
+        Variants are marked as seen so their own product pages aren't fetched this crawl."""
+        variants = fields.pop('variants', [])
+        sold_out_variants = fields.pop('sold_out_variants', [])
+        yield self.make_laptop_item(response, fields, item_class)
+
+        for variant_sku in sold_out_variants:
+            self.is_duplicate(variant_sku)
+        for variant in variants:
+            if self.is_duplicate(variant['sku']):
+                continue
+            if self.checkpoint:
+                if self.checkpoint.is_committed(variant['sku']):
+                    continue
+                self.checkpoint.add_product(variant['sku'], variant['link'])
+            item = item_class(**variant)
+            item['timestamp'] = datetime.now().isoformat()
+            self.inc_stat('bestbuy/variant_items')
+            yield item
+
+    @staticmethod
+    def make_laptop_item(response, fields, item_class=LaptopItem):
+        item = item_class(**fields)
+        item['link'] = response.url
+        item['timestamp'] = datetime.now().isoformat()
+        return item
+
+    def closed(self, reason):
+        if self.parse_pool:
+            self.parse_pool.close()
+        if self.frontier:
+            self.frontier.close()
+        if self.dead_letters:
+            self.dead_letters.close()
+        # A finished crawl has nothing left to resume
+        if self.checkpoint and reason == 'finished':
+            self.checkpoint.clear()
@@ -0,0 +1,135 @@
+import asyncio
+import gzip
+import pytest
+from unittest.mock import MagicMock
+from scrapy import signals
+from scrapy.core.downloader.middleware import DownloaderMiddlewareManager
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+from deal_scraper import archive
+from deal_scraper import settings as project_settings
+from deal_scraper.archive import ArchiveCacheStorage
+from deal_scraper.spiders.bestbuy_spider import BestBuySpider
+
+LISTING_URL = 'https://www.bestbuy.com/site/laptop-computers/all-laptops/pcmcat138500050001.c?cp=2'
+PRODUCT_URL = 'https://www.bestbuy.com/site/laptop/6588662.p?skuId=6588662'
+# The fallback link for a SKU without a stored product link, which BestBuy redirects to the product page
+FALLBACK_URL = 'https://www.bestbuy.com/site/6588662.p?skuId=6588662'
+
+needs_zstd = pytest.mark.skipif(archive.zstd is None, reason='zstd is not installed')
+
+
+def open_storage(tmp_path, **settings):
+    storage = ArchiveCacheStorage(Settings({'ARCHIVE_DIR': str(tmp_path / 'archive'), **settings}))
+    spider = MagicMock()
+    spider.crawler = get_crawler()
+    spider.crawler.stats.open_spider()
+    storage.open_spider(spider)
+    return storage, spider
+
+
+def record(storage, spider, url, body, status=200):
+    request = Request(url)
+    response = HtmlResponse(url=url, status=status, body=body, headers={'Content-Type': 'text/html; charset=utf-8'}, request=request)
+    storage.store_response(spider, request, response)
+
+
+@needs_zstd
+def test_identical_bodies_are_stored_once(tmp_path):
+    for crawl_id in ('monday', 'tuesday'):
+        storage, spider = open_storage(tmp_path, ARCHIVE_MODE='record', ARCHIVE_CRAWL_ID=crawl_id)
+        record(storage, spider, LISTING_URL, f'<html>listing on {crawl_id}</html>'.encode())
+        record(storage, spider, PRODUCT_URL, b'<html>unchanged product page</html>')
+        # Recording always fetches from the network
+        assert storage.retrieve_response(spider, Request(PRODUCT_URL)) is None
+        storage.close_spider(spider)
+
+    blobs = list((tmp_path / 'archive' / 'blobs').glob('*/*.zst'))
+    assert len(blobs) == 3
+    assert spider.crawler.stats.get_value('archive/duplicate_bodies') == 1
+    assert spider.crawler.stats.get_value('archive/responses') == 2
+
+
+@needs_zstd
+def test_replay_returns_the_archived_crawl(tmp_path):
+    for crawl_id in ('monday', 'tuesday'):
+        storage, spider = open_storage(tmp_path, ARCHIVE_MODE='record', ARCHIVE_CRAWL_ID=crawl_id)
+        record(storage, spider, LISTING_URL, f'<html>listing on {crawl_id}</html>'.encode())
+        storage.close_spider(spider)
+
+    # The latest crawl by default
+    storage, spider = open_storage(tmp_path, ARCHIVE_MODE='replay')
+    request = Request(LISTING_URL)
+    response = storage.retrieve_response(spider, request)
+    assert isinstance(response, HtmlResponse)
+    assert response.text == '<html>listing on tuesday</html>'
+    assert response.request is request
+    assert storage.retrieve_response(spider, Request(PRODUCT_URL)) is None
+    storage.close_spider(spider)
+
+    storage, spider = open_storage(tmp_path, ARCHIVE_MODE='replay', ARCHIVE_CRAWL_ID='monday')
+    assert storage.retrieve_response(spider, Request(LISTING_URL)).text == '<html>listing on monday</html>'
+    storage.close_spider(spider)
+
+
+def crawl_through_middlewares(tmp_path, archive_mode, download_func, url):
+    """Downloads url through the project's downloader middlewares, following redirects, and returns the final response."""
+    crawler = get_crawler(BestBuySpider, {
+        'DOWNLOADER_MIDDLEWARES': project_settings.DOWNLOADER_MIDDLEWARES,
+        'HTTPCACHE_STORAGE': project_settings.HTTPCACHE_STORAGE,
+        'HTTPCACHE_POLICY': project_settings.HTTPCACHE_POLICY,
+        'ARCHIVE_MODE': archive_mode,
+        'ARCHIVE_DIR': str(tmp_path / 'archive'),
+        'ARCHIVE_CRAWL_ID': 'monday',
+    })
+    crawler.spider = BestBuySpider.from_crawler(crawler)
+    crawler.stats.open_spider()
+    middlewares = DownloaderMiddlewareManager.from_crawler(crawler)
+    crawler.signals.send_catch_log(signals.spider_opened, spider=crawler.spider)
+
+    async def crawl(request):
+        result = await middlewares.download_async(download_func, request)
+        return await crawl(result) if isinstance(result, Request) else result
+
+    response = asyncio.run(crawl(Request(url)))
+    crawler.signals.send_catch_log(signals.spider_closed, spider=crawler.spider, reason='finished')
+    return response
+
+
+@needs_zstd
+def test_redirects_are_recorded_and_replayed(tmp_path):
+    async def bestbuy(request):
+        if request.url == FALLBACK_URL:
+            return Response(FALLBACK_URL, status=301, headers={'Location': PRODUCT_URL}, request=request)
+        return HtmlResponse(
+            PRODUCT_URL, body=gzip.compress(b'<html>product page</html>'),
+            headers={'Content-Type': 'text/html', 'Content-Encoding': 'gzip'}, request=request,
+        )
+
+    response = crawl_through_middlewares(tmp_path, 'record', bestbuy, FALLBACK_URL)
+    assert response.url == PRODUCT_URL
+
+    async def offline(request):
+        raise AssertionError(f'replay went to the network for {request.url}')
+
+    response = crawl_through_middlewares(tmp_path, 'replay', offline, FALLBACK_URL)
+    assert 'cached' in response.flags
+    assert response.url == PRODUCT_URL
+    assert response.text == '<html>product page</html>'
+    # Stored decoded
+    assert 'Content-Encoding' not in response.headers
+
+
+@needs_zstd
+def test_replay_needs_an_archived_crawl(tmp_path):
+    with pytest.raises(ValueError):
+        open_storage(tmp_path, ARCHIVE_MODE='replay')
+    with pytest.raises(ValueError):
+        ArchiveCacheStorage(Settings({'ARCHIVE_DIR': str(tmp_path / 'archive'), 'ARCHIVE_MODE': 'replay-all'}))
+
+
+def test_archive_mode_without_zstd_fails_clearly(monkeypatch):
+    monkeypatch.setattr(archive, 'zstd', None)
+    with pytest.raises(ImportError, match='ARCHIVE_MODE needs zstd'):
+        ArchiveCacheStorage(Settings({'ARCHIVE_MODE': 'record'}))
@@ -0,0 +1,102 @@
+import pytest
+from unittest.mock import MagicMock
+from scrapy.exceptions import DropItem
+from scrapy.http import HtmlResponse, Request
+from deal_scraper.checkpoint import CrawlCheckpoint
+from deal_scraper.items import PriceItem
+from deal_scraper.pipelines import SQLAlchemyPipeline
+from deal_scraper.spiders.bestbuy_spider import BestBuySpider
+
+LISTING_URL = 'https://www.bestbuy.com/site/all-laptops/pcmcat138500050001.c?id=pcmcat138500050001'
+
+
+def make_listing_response(skus):
+    tiles = ''.join(
+        f'<li class="sku-item" data-sku-id="{sku}"><a class="image-link" href="/site/laptop/{sku}.p?skuId={sku}"></a></li>'
+        for sku in skus
+    )
+    html = f'<html><body><ol>{tiles}</ol></body></html>'
+    return HtmlResponse(url=LISTING_URL, body=html, encoding='utf-8', request=Request(LISTING_URL, meta={'paginated': True}))
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = CrawlCheckpoint(path)
+    checkpoint.add_listing(LISTING_URL, {})
+    checkpoint.finish_listing(LISTING_URL)
+    checkpoint.add_listing(f'{LISTING_URL}&cp=2', {'fanned_out': True})
+    checkpoint.add_product('1000001', 'https://www.bestbuy.com/site/laptop/1000001.p?skuId=1000001')
+    checkpoint.add_product('1000002', 'https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002')
+    checkpoint.commit(['1000001'])
+
+    resumed = CrawlCheckpoint.load(path)
+    assert resumed.resuming
+    assert resumed.is_listing_done(LISTING_URL)
+    assert resumed.listing_pending == {f'{LISTING_URL}&cp=2': {'fanned_out': True}}
+    assert resumed.product_pending == {'1000002': 'https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002'}
+    assert resumed.is_committed('1000001')
+
+    resumed.clear()
+    assert not CrawlCheckpoint.load(path).resuming
+
+
+def test_spider_skips_committed_skus(tmp_path):
+    spider = BestBuySpider()
+    spider.checkpoint = CrawlCheckpoint(str(tmp_path / 'checkpoint.json'), committed=['1000001'])
+
+    results = list(spider.parse(make_listing_response(['1000001', '1000002'])))
+
+    assert [r.url for r in results] == ['https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002']
+    assert spider.checkpoint.product_pending == {'1000002': 'https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002'}
+    assert spider.checkpoint.is_listing_done(LISTING_URL)
+
+
+def test_spider_resumes_pending_frontier(tmp_path):
+    spider = BestBuySpider()
+    spider.checkpoint = CrawlCheckpoint(
+        str(tmp_path / 'checkpoint.json'),
+        listing_pending={f'{LISTING_URL}&cp=3': {'fanned_out': True}},
+        listing_done=[LISTING_URL],
+        product_pending={'1000002': 'https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002'},
+    )
+
+    requests = list(spider.resume_requests())
+
+    assert [(r.url, r.callback) for r in requests] == [
+        (f'{LISTING_URL}&cp=3', spider.parse),
+        ('https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002', spider.parse_product),
+    ]
+    assert requests[0].meta['fanned_out']
+
+
+def test_commit_batch_updates_checkpoint(tmp_path):
+    spider = BestBuySpider()
+    spider.checkpoint = CrawlCheckpoint(str(tmp_path / 'checkpoint.json'))
+    spider.checkpoint.add_product('6588662', 'https://www.bestbuy.com/site/laptop/6588662.p?skuId=6588662')
+    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=1, upc_watchlist=[], alert_discount_threshold=0)
+    pipeline.session = MagicMock()
+
+    pipeline.process_item(PriceItem(sku='6588662', price=899.99), spider=spider)
+
+    assert CrawlCheckpoint.load(spider.checkpoint.path).is_committed('6588662')
+    assert spider.checkpoint.product_pending == {}
+
+
+def test_sold_out_and_dropped_products_are_not_refetched(tmp_path):
+    spider = BestBuySpider()
+    spider.checkpoint = CrawlCheckpoint(str(tmp_path / 'checkpoint.json'))
+    for sku in ('1000001', '1000002'):
+        spider.checkpoint.add_product(sku, f'https://www.bestbuy.com/site/laptop/{sku}.p?skuId={sku}')
+
+    url = 'https://www.bestbuy.com/site/laptop/1000001.p?skuId=1000001'
+    sold_out = b'<button class="add-to-cart-button" data-sku-id="1000001" data-button-state="SOLD_OUT"></button>'
+    assert list(spider.parse_product(HtmlResponse(url=url, body=sold_out, encoding='utf-8', request=Request(url)))) == []
+
+    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=1, upc_watchlist=[], alert_discount_threshold=0)
+    pipeline.session = MagicMock()
+    with pytest.raises(DropItem):
+        pipeline.process_item(PriceItem(sku='1000002', price=0), spider=spider)
+
+    resumed = CrawlCheckpoint.load(spider.checkpoint.path)
+    assert resumed.product_pending == {}
+    assert resumed.is_committed('1000001') and resumed.is_committed('1000002')
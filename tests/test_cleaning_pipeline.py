@@ -1,7 +1,7 @@
 import pytest
 from deal_scraper.pipelines import CleaningPipeline
 from itemadapter import ItemAdapter
-from deal_scraper.items import LaptopItem
+from deal_scraper.items import LaptopItem, PriceItem
 
 def test_extract_numeric():
     pipeline = CleaningPipeline()
@@ -38,4 +38,14 @@ def test_process_item():
     assert result_item['year_of_release'] == '2020'
     assert result_item['battery_life_hrs'] == 10.0
     assert isinstance(result_item['two_in_one_design'], bool)
-    
\ No newline at end of file
+    
+
+def test_process_price_item():
+    pipeline = CleaningPipeline()
+    item = PriceItem(sku='6588662', price='$329.99', full_price='Comp. Value: $579.99')
+
+    result_item = pipeline.process_item(item, spider=None)
+    assert result_item['price'] == 329.99
+    assert result_item['full_price'] == 579.99
+    assert result_item['dollars_off'] == pytest.approx(250.0)
+    assert 'attributes' not in result_item
@@ -0,0 +1,179 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from scrapy.exceptions import DropItem, IgnoreRequest
+from scrapy.http import HtmlResponse, Response
+from scrapy.spidermiddlewares.httperror import HttpError
+from scrapy.utils.test import get_crawler
+from sqlalchemy import create_engine, select, update
+from sqlalchemy.orm import sessionmaker
+from twisted.python.failure import Failure
+from deal_scraper.deadletter import DeadLetterStore
+from deal_scraper.items import PriceItem
+from deal_scraper.models import Base, DeadLetterTable, LaptopTable
+from deal_scraper.pipelines import SQLAlchemyPipeline
+from deal_scraper.spiders.bestbuy_spider import BestBuySpider
+
+PRODUCT_URL = 'https://www.bestbuy.com/site/laptop/1000001.p?skuId=1000001'
+
+
+def make_store(db_url):
+    return DeadLetterStore(db_url, base_delay=timedelta(minutes=30), max_delay=timedelta(hours=1), max_attempts=3)
+
+
+def get_letter(store, url):
+    with store.Session() as session:
+        return session.scalars(select(DeadLetterTable).where(DeadLetterTable.url == url)).one()
+
+
+def make_due(store):
+    with store.Session() as session, session.begin():
+        session.execute(update(DeadLetterTable).values(next_attempt_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+
+
+def test_failures_back_off_exponentially(tmp_path):
+    store = make_store(f'sqlite:///{tmp_path / "laptops.db"}')
+
+    store.record(PRODUCT_URL, '1000001', 'HTTP 503')
+    letter = get_letter(store, PRODUCT_URL)
+    assert (letter.attempts, letter.reason) == (1, 'HTTP 503')
+    assert letter.next_attempt_at - letter.last_failed_at == timedelta(minutes=30)
+    # Still backing off
+    assert store.due() == []
+
+    store.record(PRODUCT_URL, '1000001', 'specifications json not found')
+    store.record(PRODUCT_URL, '1000001', 'specifications json not found')
+    letter = get_letter(store, PRODUCT_URL)
+    assert (letter.attempts, letter.reason) == (3, 'specifications json not found')
+    # 30 min, 60 min, then capped at max_delay
+    assert letter.next_attempt_at - letter.last_failed_at == timedelta(hours=1)
+    store.close()
+
+
+def test_due_skips_resolved_and_exhausted_pages(tmp_path):
+    store = make_store(f'sqlite:///{tmp_path / "laptops.db"}')
+    other_url = 'https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002'
+    exhausted_url = 'https://www.bestbuy.com/site/laptop/1000003.p?skuId=1000003'
+    store.record(PRODUCT_URL, '1000001', 'HTTP 503')
+    store.record(other_url, '1000002', 'HTTP 503')
+    for _ in range(3):
+        store.record(exhausted_url, '1000003', 'HTTP 404')
+    make_due(store)
+
+    assert store.due() == [(PRODUCT_URL, '1000001'), (other_url, '1000002')]
+
+    # Resolved by sku or by url
+    store.resolve(['1000001', None])
+    assert store.due() == [(other_url, '1000002')]
+    store.resolve([other_url])
+    assert store.due() == []
+
+    # A resolved page that fails again starts over
+    store.record(PRODUCT_URL, '1000001', 'HTTP 503')
+    assert get_letter(store, PRODUCT_URL).attempts == 1
+    store.close()
+
+
+def test_parse_failures_and_download_errors_are_recorded(tmp_path):
+    crawler = get_crawler(BestBuySpider, {'DATABASE_URL': f'sqlite:///{tmp_path / "laptops.db"}'})
+    spider = BestBuySpider.from_crawler(crawler)
+    spider.dead_letters = DeadLetterStore.from_settings(crawler.settings)
+
+    response = HtmlResponse(url=PRODUCT_URL, body=b'<html><body>no specs</body></html>', encoding='utf-8')
+    assert list(spider.parse_product(response)) == []
+    assert get_letter(spider.dead_letters, PRODUCT_URL).reason == 'specifications json not found'
+
+    request = spider.product_request('https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002&ref=abc')
+    assert request.errback == spider.product_failed
+    failure = Failure(HttpError(Response(request.url, status=503, request=request)))
+    failure.request = request
+    spider.product_failed(failure)
+    assert get_letter(spider.dead_letters, request.url).reason == 'HTTP 503'
+    assert crawler.stats.get_value('bestbuy/dead_letters_recorded') == 2
+    spider.closed('finished')
+
+
+
+def test_ignored_product_pages_are_not_recorded():
+    spider = BestBuySpider()
+    spider.dead_letters = MagicMock()
+    request = spider.product_request(PRODUCT_URL)
+
+    # e.g. a page missing from a replayed archive
+    failure = Failure(IgnoreRequest('Ignored request not in cache'))
+    failure.request = request
+    spider.product_failed(failure)
+    spider.dead_letters.record.assert_not_called()
+
+    failure = Failure(TimeoutError('timed out'))
+    failure.request = request
+    spider.product_failed(failure)
+    spider.dead_letters.record.assert_called_once_with(PRODUCT_URL, '1000001', 'TimeoutError: timed out')
+
+def test_dead_letters_that_come_back_sold_out_or_dropped_are_resolved(tmp_path):
+    store = make_store(f'sqlite:///{tmp_path / "laptops.db"}')
+    other_url = 'https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002'
+    store.record(PRODUCT_URL, '1000001', 'HTTP 503')
+    store.record(other_url, '1000002', 'HTTP 503')
+    make_due(store)
+    spider = BestBuySpider()
+    spider.dead_letters = store
+
+    sold_out = b'<button class="add-to-cart-button" data-sku-id="1000001" data-button-state="SOLD_OUT"></button>'
+    assert list(spider.parse_product(HtmlResponse(url=PRODUCT_URL, body=sold_out, encoding='utf-8'))) == []
+
+    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=1, upc_watchlist=[], alert_discount_threshold=0)
+    pipeline.session = MagicMock()
+    with pytest.raises(DropItem):
+        pipeline.process_item(PriceItem(sku='1000002', price=0), spider=spider)
+
+    assert get_letter(store, PRODUCT_URL).resolved_at is not None
+    assert get_letter(store, other_url).resolved_at is not None
+    assert store.due() == []
+    store.close()
+
+
+def test_deadletter_mode_requests_only_due_pages(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "laptops.db"}'
+    store = make_store(db_url)
+    store.record(PRODUCT_URL, '1000001', 'HTTP 503')
+    make_due(store)
+    store.record('https://www.bestbuy.com/site/laptop/1000002.p?skuId=1000002', '1000002', 'HTTP 503')
+    store.close()
+
+    crawler = get_crawler(BestBuySpider, {'DATABASE_URL': db_url})
+    spider = BestBuySpider.from_crawler(crawler, mode='deadletter')
+
+    async def collect():
+        return [request async for request in spider.start()]
+
+    request, = asyncio.run(collect())
+    assert request.url == PRODUCT_URL
+    assert request.callback == spider.parse_product
+    spider.closed('finished')
+
+
+def test_deadletter_mode_skips_the_watchlist(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "laptops.db"}'
+    store = make_store(db_url)
+    store.record(PRODUCT_URL, '1000001', 'HTTP 503')
+    make_due(store)
+    store.close()
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session, session.begin():
+        session.add(LaptopTable(upc='111', sku='1000003'))
+    engine.dispose()
+    watchlist_file = tmp_path / 'upc_watchlist.json'
+    watchlist_file.write_text('["111"]')
+
+    crawler = get_crawler(BestBuySpider, {'DATABASE_URL': db_url, 'WATCHLIST_FILENAME': str(watchlist_file)})
+    spider = BestBuySpider.from_crawler(crawler, mode='deadletter')
+
+    async def collect():
+        return [request async for request in spider.start()]
+
+    request, = asyncio.run(collect())
+    assert request.url == PRODUCT_URL
+    spider.closed('finished')
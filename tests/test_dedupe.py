@@ -0,0 +1,18 @@
+from scrapy.settings import Settings
+from deal_scraper.dedupe import BloomFilter, make_seen_skus
+
+
+def test_bloom_filter_membership():
+    seen = BloomFilter(capacity=1000)
+    skus = [str(6000000 + i) for i in range(1000)]
+    for sku in skus:
+        seen.add(sku)
+
+    assert all(sku in seen for sku in skus)
+    false_positives = sum(str(7000000 + i) in seen for i in range(1000))
+    assert false_positives < 10
+
+
+def test_make_seen_skus():
+    assert isinstance(make_seen_skus(Settings()), set)
+    assert isinstance(make_seen_skus(Settings({'SKU_DEDUPE_BLOOM_CAPACITY': 500})), BloomFilter)
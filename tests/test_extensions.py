@@ -0,0 +1,91 @@
+import gzip
+import pytest
+from unittest.mock import MagicMock
+from scrapy.core.downloader import Slot
+from scrapy.downloadermiddlewares.httpcompression import HttpCompressionMiddleware
+from scrapy.http import HtmlResponse, Request, Response
+from scrapy.utils.test import get_crawler
+from deal_scraper.extensions import AdaptiveConcurrency, TransferStats
+
+SLOT_KEY = 'www.bestbuy.com'
+
+
+def make_extension(slot):
+    crawler = MagicMock()
+    crawler.engine.downloader.slots = {SLOT_KEY: slot}
+    return AdaptiveConcurrency(
+        crawler, window=10, min_concurrency=2, max_concurrency=12, increase=2, decrease=0.5,
+        latency_tolerance=0.25, error_threshold=0.1,
+    )
+
+
+def finish_requests(extension, count, latency=0.2, status=200, failed=False):
+    for _ in range(count):
+        request = Request('https://www.bestbuy.com/site/laptop/1.p?skuId=1', meta={'download_slot': SLOT_KEY, 'download_latency': latency})
+        if not failed:
+            response = HtmlResponse(url=request.url, status=status, body=b'', request=request)
+            extension.response_downloaded(response, request, spider=None)
+        extension.request_left_downloader(request, spider=None)
+
+
+def test_ramps_up_while_latency_is_flat():
+    slot = Slot(concurrency=8, delay=0)
+    extension = make_extension(slot)
+
+    finish_requests(extension, 10)
+    assert slot.concurrency == 10
+    finish_requests(extension, 10, latency=0.22)
+    assert slot.concurrency == 12
+    finish_requests(extension, 10)
+    assert slot.concurrency == 12, "Should stop at ADAPTIVE_CONCURRENCY_MAX"
+    extension.stats.inc_value.assert_any_call('adaptive_concurrency/increased')
+
+
+def test_holds_when_latency_climbs():
+    slot = Slot(concurrency=8, delay=0)
+    extension = make_extension(slot)
+
+    finish_requests(extension, 10, latency=0.2)
+    finish_requests(extension, 10, latency=0.5)
+    assert slot.concurrency == 10
+    extension.stats.inc_value.assert_any_call('adaptive_concurrency/held')
+
+
+def test_backs_off_on_throttling_and_timeouts():
+    slot = Slot(concurrency=8, delay=0)
+    extension = make_extension(slot)
+
+    finish_requests(extension, 8)
+    finish_requests(extension, 2, status=429)
+    assert slot.concurrency == 4
+
+    finish_requests(extension, 8)
+    finish_requests(extension, 2, failed=True)
+    assert slot.concurrency == 2
+    extension.stats.inc_value.assert_any_call('adaptive_concurrency/decreased')
+    extension.stats.inc_value.assert_any_call('adaptive_concurrency/download_errors')
+
+
+def test_transfer_stats_count_wire_and_decoded_bytes():
+    brotli = pytest.importorskip('brotli')
+    crawler = get_crawler()
+    crawler.stats.open_spider()
+    extension = TransferStats.from_crawler(crawler)
+    middleware = HttpCompressionMiddleware.from_crawler(crawler)
+    body = b'<html>' + b'<p>16GB memory, 512GB SSD</p>' * 200 + b'</html>'
+
+    for encoding, wire_body, protocol in ((b'br', brotli.compress(body), 'h2'), (b'gzip', gzip.compress(body), 'HTTP/1.1')):
+        request = Request('https://www.bestbuy.com/site/laptop/1.p?skuId=1')
+        response = Response(request.url, body=wire_body, headers={'Content-Encoding': encoding}, request=request, protocol=protocol)
+        extension.response_downloaded(response, request, spider=None)
+        response = middleware.process_response(request, response)
+        extension.response_received(response, request, spider=None)
+    extension.spider_closed(spider=None)
+
+    stats = crawler.stats.get_stats()
+    wire_bytes = len(brotli.compress(body)) + len(gzip.compress(body))
+    assert stats['transfer/wire_bytes'] == wire_bytes
+    assert stats['transfer/decoded_bytes'] == 2 * len(body)
+    assert stats['transfer/content_encoding/br/wire_bytes'] == len(brotli.compress(body))
+    assert stats['transfer/protocol/h2'] == stats['transfer/protocol/HTTP/1.1'] == 1
+    assert stats['transfer/compression_ratio'] == round(2 * len(body) / wire_bytes, 2)
@@ -0,0 +1,160 @@
+import json
+import pytest
+from pathlib import Path
+from scrapy.http import HtmlResponse
+from deal_scraper import extractors
+from deal_scraper.extractors import decode_attributes, extract_product_page, find_breadcrumb_categories, find_button, find_button_state, find_fragments_end, FragmentsScan, find_specifications_json, NotInCategory, parse_product_page, trim_attributes
+from deal_scraper.items import LaptopItem
+from deal_scraper.pipelines import CleaningPipeline
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+
+
+@pytest.fixture
+def product_page_response():
+    body = (FIXTURES_DIR / 'bestbuy_product_page.html').read_bytes()
+    return HtmlResponse(url='https://www.bestbuy.com/site/laptop/6588662.p?skuId=6588662', body=body, encoding='utf-8')
+
+
+def test_extract_product_page_matches_selectors(product_page_response):
+    response = product_page_response
+    page = extract_product_page(response.body, sku='6588662')
+
+    spec_scripts = [s for s in response.css('script::text').getall() if 'shop-specifications-' in s]
+    assert page['specifications_json'] == spec_scripts[0]
+    assert page['price'] == response.css('div.priceView-hero-price span[aria-hidden="true"]::text').get()
+    assert page['full_price'] == response.css('div[data-testid="regular-price"] span[aria-hidden="true"]::text').get()
+    assert page['button_state'] == 'ADD_TO_CART'
+
+
+def test_button_state_prefers_page_sku():
+    body = b'''
+        <button class="add-to-cart-button" data-sku-id="111" data-button-state="ADD_TO_CART"></button>
+        <button class="add-to-cart-button" data-sku-id="222" data-button-state="SOLD_OUT"></button>
+    '''
+    assert find_button_state(body, sku='222') == 'SOLD_OUT'
+    assert find_button_state(body, sku='333') == 'ADD_TO_CART'
+    assert find_button_state(body) == 'ADD_TO_CART'
+    assert find_button(body, sku='222') == ('SOLD_OUT', body.index(b'>', body.index(b'222')) + 1)
+    assert find_button(body, sku='333') == find_button(body) == ('ADD_TO_CART', body.index(b'>') + 1)
+
+
+def test_marker_outside_script_tag_is_ignored():
+    body = b'<div id="shop-specifications-1">x</div><script>var id="shop-specifications-2";</script>'
+    assert find_specifications_json(body) is None
+
+
+def test_fast_and_stdlib_decoding_agree(product_page_response, monkeypatch):
+    specifications_json = find_specifications_json(product_page_response.body)
+    fast = decode_attributes(specifications_json)
+
+    monkeypatch.setattr(extractors, '_spec_decoder', None)
+    stdlib = decode_attributes(specifications_json)
+
+    assert fast == stdlib
+    assert stdlib['UPC'] == '198154520175'
+
+
+def test_decode_attributes_raises_json_error():
+    with pytest.raises(json.JSONDecodeError):
+        decode_attributes('{"specifications": ')
+
+
+def test_trimmed_attributes_clean_the_same(product_page_response):
+    attributes = decode_attributes(find_specifications_json(product_page_response.body))
+    trimmed = trim_attributes(attributes)
+
+    def clean(attrs):
+        return dict(CleaningPipeline().process_item(LaptopItem(price='$329.99', attributes=dict(attrs)), spider=None))
+
+    assert len(trimmed) < len(attributes)
+    assert clean(trimmed) == clean(attributes)
+
+
+def make_page_with_variations():
+    body = (FIXTURES_DIR / 'bestbuy_product_page.html').read_bytes()
+    variations = (FIXTURES_DIR / 'bestbuy_product_variations.json').read_bytes()
+    script = b'<script type="application/json" id="shop-product-variations-12345-json">' + variations + b'</script>'
+    return body.replace(b'</body>', script + b'</body>', 1)
+
+
+def test_parse_product_page_variants():
+    fields = parse_product_page(make_page_with_variations(), sku='6588662')
+
+    # 6588662 is the page itself, 6588665 doesn't carry its own UPC so it's left for its own page
+    variant, = fields['variants']
+    assert variant['sku'] == '6588663'
+    assert variant['price'] == 379.99
+    assert variant['full_price'] == 629.99
+    assert variant['link'].endswith('/6588663.p?skuId=6588663')
+    assert variant['attributes']['UPC'] == '198154520182'
+    assert variant['attributes']['Total Storage Capacity'] == '512 gigabytes'
+    # Specs that don't differ come from the page, specs that aren't stored are dropped
+    assert variant['attributes']['Color'] == fields['attributes']['Color']
+    assert 'Marketing Blurb' not in variant['attributes']
+    assert fields['attributes']['UPC'] == '198154520175'
+    assert fields['sold_out_variants'] == ['6588664']
+
+    cleaned = CleaningPipeline().process_item(LaptopItem(**variant), spider=None)
+    assert cleaned['upc'] == '198154520182'
+    assert cleaned['total_storage_capacity_gb'] == 512
+
+
+def test_parse_product_page_without_variations(product_page_response):
+    fields = parse_product_page(product_page_response.body, sku='6588662')
+    assert fields['variants'] == []
+    assert fields['sold_out_variants'] == []
+
+
+def test_fragments_end_cuts_the_page_without_changing_the_parse(product_page_response):
+    body = product_page_response.body
+    fragments_end = find_fragments_end(body, sku='6588662')
+    assert fragments_end < len(body) // 2
+    assert parse_product_page(body[:fragments_end], sku='6588662') == parse_product_page(body, sku='6588662')
+    # One byte short and the spec script isn't closed yet
+    assert find_fragments_end(body[:fragments_end - 1], sku='6588662') is None
+
+
+def test_fragments_end_needs_every_fragment():
+    page = (
+        b'<button class="add-to-cart-button" data-sku-id="1" data-button-state="ADD_TO_CART"></button>'
+        b'<div class="priceView-hero-price"><span aria-hidden="true">$899.99</span></div>'
+        b'<script id="shop-specifications-1">{"specifications": {"categories": []}}</script>'
+    )
+    # No regular price block, so the rest of the page has to be read
+    assert find_fragments_end(page, sku='1') is None
+    assert find_fragments_end(page + b'<div data-testid="regular-price"><span aria-hidden="true">$999.99</span></div>', sku='1')
+    # Without a button for the SKU the first button counts, like it does for the whole page
+    full_page = page + b'<div data-testid="regular-price"><span aria-hidden="true">$999.99</span></div>'
+    assert find_fragments_end(full_page, sku='2') == find_fragments_end(full_page, sku='1') == len(full_page)
+
+    sold_out = b'<button class="add-to-cart-button" data-sku-id="1" data-button-state="SOLD_OUT">'
+    assert find_fragments_end(sold_out + b'</button>', sku='1') == len(sold_out)
+
+
+def test_fragments_scan_only_searches_new_bytes(product_page_response):
+    body = product_page_response.body
+    expected = find_fragments_end(body, sku='6588662')
+    scan = FragmentsScan(sku='6588662')
+
+    received = bytearray()
+    for start in range(0, len(body), 16 * 1024):
+        received += body[start:start + 16 * 1024]
+        cut = scan.scan(received)
+        if cut is not None:
+            break
+        # The search that's still going picks up near the end of what has arrived instead of at the start
+        waiting_on = scan.button if scan.button.scan(received)[0] is None else next(element for element in scan.elements if element.end is None)
+        assert waiting_on.search_from > len(received) - 64 * 1024
+    assert cut == expected
+    assert scan.scan(body) == expected
+
+
+def test_breadcrumb_categories(product_page_response):
+    categories = find_breadcrumb_categories(product_page_response.body)
+    assert categories[:3] == ['abcat0500000', 'abcat0502000', 'pcmcat138500050001']
+    assert find_breadcrumb_categories(b'<html><body>no breadcrumb</body></html>') == []
+
+    assert parse_product_page(product_page_response.body, sku='6588662', category='abcat0502000')
+    with pytest.raises(NotInCategory):
+        parse_product_page(product_page_response.body, sku='6588662', category='abcat0515000')
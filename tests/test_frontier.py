@@ -0,0 +1,164 @@
+import asyncio
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import HtmlResponse
+from scrapy.utils.test import get_crawler
+from sqlalchemy import update
+from twisted.python.failure import Failure
+from deal_scraper.frontier import SharedFrontier
+from deal_scraper.models import FrontierTable
+from deal_scraper.spiders.bestbuy_spider import BestBuySpider
+
+
+def make_worker(db_url, worker_id, **kwargs):
+    return SharedFrontier(db_url, crawl_id='nightly', worker_id=worker_id, claim_size=2, **kwargs)
+
+
+def expire_leases(frontier):
+    with frontier.Session() as session, session.begin():
+        session.execute(update(FrontierTable).values(lease_expires_at=datetime.now(timezone.utc) - timedelta(seconds=1)))
+
+
+def test_workers_split_the_frontier(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "frontier.db"}'
+    first, second = make_worker(db_url, 'worker-1'), make_worker(db_url, 'worker-2')
+
+    first.push('https://www.bestbuy.com/site/all-laptops.c?cp=2', 'listing', {'fanned_out': True})
+    first.push('https://www.bestbuy.com/site/laptop/1.p?skuId=1', 'product', sku='1')
+    second.push('https://www.bestbuy.com/site/laptop/1.p?skuId=1', 'product', sku='1')
+    second.push('https://www.bestbuy.com/site/laptop/2.p?skuId=2', 'product', sku='2', priority=100)
+
+    first_batch = first.claim()
+    second_batch = second.claim()
+    assert [entry['url'] for entry in first_batch] == [
+        'https://www.bestbuy.com/site/laptop/2.p?skuId=2',
+        'https://www.bestbuy.com/site/all-laptops.c?cp=2',
+    ]
+    assert first_batch[1]['meta'] == {'fanned_out': True}
+    assert [entry['sku'] for entry in second_batch] == ['1']
+    assert first.claim() == []
+
+    # Each worker's own leases don't keep it open, the other worker's do
+    assert first.has_outstanding_work()
+    second.complete(['1'])
+    assert not first.has_outstanding_work()
+
+    first.complete(['2', 'https://www.bestbuy.com/site/all-laptops.c?cp=2'])
+    assert first.summary() == {('done', 'worker-1'): 2, ('done', 'worker-2'): 1}
+
+
+def test_expired_leases_are_reclaimed_up_to_max_attempts(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "frontier.db"}'
+    dead, alive = make_worker(db_url, 'dead', max_attempts=2), make_worker(db_url, 'alive', max_attempts=2)
+    dead.push('https://www.bestbuy.com/site/laptop/1.p?skuId=1', 'product', sku='1')
+
+    assert len(dead.claim()) == 1
+    assert alive.claim() == []
+
+    expire_leases(dead)
+    reclaimed, = alive.claim()
+    assert reclaimed['attempts'] == 2
+
+    # Out of attempts, the page is given up on
+    expire_leases(alive)
+    assert dead.claim() == []
+    assert not dead.has_outstanding_work()
+
+
+def test_push_many_adds_pages_in_one_go(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "frontier.db"}'
+    worker = make_worker(db_url, 'worker-1', stats=MagicMock())
+    worker.push('https://www.bestbuy.com/site/laptop/1.p?skuId=1', 'product', sku='1')
+
+    worker.push_many([
+        {'url': 'https://www.bestbuy.com/site/laptop/1.p?skuId=1', 'kind': 'product', 'sku': '1'},
+        {'url': 'https://www.bestbuy.com/site/laptop/2.p?skuId=2', 'kind': 'product', 'sku': '2', 'priority': 100},
+        {'url': 'https://www.bestbuy.com/site/laptop/2.p?skuId=2', 'kind': 'product', 'sku': '2', 'priority': 100},
+        {'url': 'https://www.bestbuy.com/site/all-laptops.c?cp=2', 'kind': 'listing', 'meta': {'fanned_out': True}},
+    ])
+    worker.push_many([])
+
+    # Pages already in the frontier (or twice in the batch) are only added once
+    assert [call.args for call in worker.stats.inc_value.call_args_list] == [('frontier/pushed', 1), ('frontier/pushed', 2)]
+    assert worker.summary() == {('pending', None): 3}
+
+
+def test_crawls_are_kept_apart(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "frontier.db"}'
+    tonight = make_worker(db_url, 'worker-1')
+    tomorrow = SharedFrontier(db_url, crawl_id='tomorrow', worker_id='worker-1')
+    tonight.push('https://www.bestbuy.com/site/laptop/1.p?skuId=1', 'product', sku='1')
+    tonight.complete(['1'])
+
+    tomorrow.push('https://www.bestbuy.com/site/laptop/1.p?skuId=1', 'product', sku='1')
+    assert [entry['sku'] for entry in tomorrow.claim()] == ['1']
+
+
+def test_spider_hands_pages_to_the_frontier(tmp_path):
+    crawler = get_crawler(BestBuySpider, {'DATABASE_URL': f'sqlite:///{tmp_path / "frontier.db"}', 'FRONTIER_CRAWL_ID': 'nightly', 'FRONTIER_WORKER_ID': 'worker-1'})
+    crawler.engine = MagicMock()
+    spider = BestBuySpider.from_crawler(crawler)
+
+    async def collect():
+        return [request async for request in spider.start()]
+
+    # Start pages go to the frontier instead of the local scheduler
+    assert asyncio.run(collect()) == []
+    with pytest.raises(DontCloseSpider):
+        spider.spider_idle()
+    listing_request, = [call.args[0] for call in crawler.engine.crawl.call_args_list]
+    assert listing_request.url == BestBuySpider.start_urls[0]
+    assert listing_request.callback == spider.parse
+
+    listing = HtmlResponse(
+        url=listing_request.url, request=listing_request, encoding='utf-8',
+        body='<li class="sku-item" data-sku-id="1"><a class="image-link" href="/site/laptop/1.p?skuId=1"></a></li>'
+             '<li class="sku-item" data-sku-id="2"><a class="image-link" href="/site/laptop/2.p?skuId=2"></a></li>',
+    )
+    push_many = MagicMock(wraps=spider.frontier.push_many)
+    spider.frontier.push_many = push_many
+    assert list(spider.parse(listing)) == []
+    # One insert for every page the listing links to
+    push_many.assert_called_once()
+    assert [page['sku'] for page in push_many.call_args.args[0]] == ['1', '2']
+
+    crawler.engine.crawl.reset_mock()
+    with pytest.raises(DontCloseSpider):
+        spider.spider_idle()
+    product_requests = [call.args[0] for call in crawler.engine.crawl.call_args_list]
+    assert [request.url for request in product_requests] == [
+        'https://www.bestbuy.com/site/laptop/1.p?skuId=1',
+        'https://www.bestbuy.com/site/laptop/2.p?skuId=2',
+    ]
+    assert product_requests[0].callback == spider.parse_product
+
+    # Once the products' batch commits there's nothing left and the spider can close
+    spider.frontier.complete(['1', '2'])
+    spider.spider_idle()
+
+
+def test_failed_frontier_pages_are_completed(tmp_path):
+    db_url = f'sqlite:///{tmp_path / "frontier.db"}'
+    crawler = get_crawler(BestBuySpider, {'DATABASE_URL': db_url})
+    spider = BestBuySpider.from_crawler(crawler)
+    spider.frontier = make_worker(db_url, 'worker-1')
+    spider.frontier.push('https://www.bestbuy.com/site/all-laptops.c?cp=2', 'listing', {'paginated': True})
+    spider.frontier.push('https://www.bestbuy.com/site/laptop/1.p?skuId=1', 'product', sku='1')
+
+    listing_request, product_request = sorted(spider.frontier_requests(), key=lambda request: request.url)
+    # Claiming a product marks it seen without counting it as a duplicate
+    assert '1' in spider.seen_skus
+    assert crawler.stats.get_value('bestbuy/duplicate_skus_skipped') is None
+    assert listing_request.errback == spider.listing_failed
+    assert product_request.errback == spider.product_failed
+
+    for request in (listing_request, product_request):
+        failure = Failure(TimeoutError('timed out'))
+        failure.request = request
+        request.errback(failure)
+
+    # Nothing is left for another worker to wait on, the dead letter store owns the product's retries
+    assert spider.frontier.summary() == {('done', 'worker-1'): 2}
+    assert not make_worker(db_url, 'worker-2').has_outstanding_work()
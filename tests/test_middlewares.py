@@ -0,0 +1,158 @@
+import pytest
+from pathlib import Path
+from unittest.mock import MagicMock
+from scrapy.exceptions import StopDownload
+from scrapy.http import Headers, HtmlResponse, Request
+from deal_scraper.middlewares import ConditionalGetMiddleware, EarlyAbortMiddleware
+from deal_scraper.spiders.bestbuy_spider import BestBuySpider
+from deal_scraper.items import PriceItem
+
+PRODUCT_URL = 'https://www.bestbuy.com/site/laptop/6588662.p?skuId=6588662'
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+
+
+def make_middleware(tmp_path):
+    middleware = ConditionalGetMiddleware(store_path=str(tmp_path / 'conditional_get.json'), stats=MagicMock())
+    middleware.spider_opened(spider=None)
+    return middleware
+
+
+def crawl_page(middleware, spider, body, status=200, headers=None):
+    request = Request(PRODUCT_URL, callback=spider.parse_product)
+    middleware.process_request(request, spider)
+    response = HtmlResponse(url=PRODUCT_URL, status=status, body=body, headers=headers, encoding='utf-8', request=request)
+    return request, middleware.process_response(request, response, spider)
+
+
+def test_unchanged_body_reuses_cached_price(tmp_path):
+    spider = BestBuySpider()
+    middleware = make_middleware(tmp_path)
+    body = '<html><body>product page</body></html>'
+
+    # First crawl stores the fingerprint once an item is scraped from the page
+    request, response = crawl_page(middleware, spider, body, headers={'ETag': '"abc"'})
+    assert 'unchanged_page' not in request.cb_kwargs
+    middleware.item_scraped(PriceItem(sku='6588662', price=329.99, full_price=579.99, link=PRODUCT_URL), response, spider)
+
+    # Second crawl is conditional and the identical body short-circuits parse_product
+    request, response = crawl_page(middleware, spider, body)
+    assert request.headers['If-None-Match'] == b'"abc"'
+    assert 304 in request.meta['handle_httpstatus_list']
+
+    results = list(spider.parse_product(response, **request.cb_kwargs))
+    assert len(results) == 1
+    assert isinstance(results[0], PriceItem)
+    assert results[0]['price'] == 329.99
+    assert results[0]['full_price'] == 579.99
+
+
+def test_not_modified_response_reuses_cached_price(tmp_path):
+    spider = BestBuySpider()
+    middleware = make_middleware(tmp_path)
+    middleware.store[PRODUCT_URL] = {'etag': '"abc"', 'fingerprint': 'old', 'sku': '6588662', 'price': 329.99, 'full_price': 579.99}
+
+    request, response = crawl_page(middleware, spider, body='', status=304)
+    assert request.cb_kwargs['unchanged_page']['price'] == 329.99
+
+
+def test_store_persists_between_crawls(tmp_path):
+    spider = BestBuySpider()
+    middleware = make_middleware(tmp_path)
+    request, response = crawl_page(middleware, spider, '<html>v1</html>', headers={'Last-Modified': 'Wed, 29 Jan 2025 07:09:26 GMT'})
+    middleware.item_scraped(PriceItem(sku='6588662', price=329.99, link=PRODUCT_URL), response, spider)
+    middleware.spider_closed(spider)
+
+    reopened = make_middleware(tmp_path)
+    request, response = crawl_page(reopened, spider, '<html>v2</html>')
+    assert request.headers['If-Modified-Since'] == b'Wed, 29 Jan 2025 07:09:26 GMT'
+    assert 'unchanged_page' not in request.cb_kwargs
+
+
+def stream_page(middleware, spider, wire_body, content_encoding=None, chunk_size=16 * 1024):
+    """Feeds wire_body through the middleware like a download handler would, stopping where it asks to."""
+    request = Request(PRODUCT_URL, callback=spider.parse_product)
+    headers = Headers({'Content-Encoding': content_encoding} if content_encoding else {})
+    middleware.headers_received(headers, len(wire_body), request, spider)
+    received, flags = 0, []
+    while received < len(wire_body):
+        chunk = wire_body[received:received + chunk_size]
+        received += len(chunk)
+        try:
+            middleware.bytes_received(chunk, request, spider)
+        except StopDownload as e:
+            assert not e.fail
+            flags.append('download_stopped')
+            break
+    response = HtmlResponse(url=PRODUCT_URL, body=wire_body[:received], headers=headers, encoding='utf-8', request=request, flags=flags)
+    return middleware.process_response(request, response, spider)
+
+
+def test_early_abort_stops_once_the_spec_script_arrives():
+    spider = BestBuySpider()
+    middleware = EarlyAbortMiddleware(stats=MagicMock())
+    brotli = pytest.importorskip('brotli')
+    body = (FIXTURES_DIR / 'bestbuy_product_page.html').read_bytes()
+    wire_body = brotli.compress(body)
+
+    response = stream_page(middleware, spider, wire_body, content_encoding='br')
+    assert 'early_abort' in response.flags
+    assert 'Content-Encoding' not in response.headers
+    assert len(response.body) < len(body) // 2
+
+    full_response = HtmlResponse(url=PRODUCT_URL, body=body, encoding='utf-8')
+    item, = spider.parse_product(response)
+    full_item, = spider.parse_product(full_response)
+    item.pop('timestamp')
+    full_item.pop('timestamp')
+    assert item == full_item
+    middleware.stats.inc_value.assert_any_call('early_abort/stopped')
+
+
+def test_early_abort_falls_back_to_the_full_page():
+    spider = BestBuySpider()
+    middleware = EarlyAbortMiddleware(stats=MagicMock())
+    # No regular price block, so every byte is needed
+    body = (
+        b'<button class="add-to-cart-button" data-sku-id="6588662" data-button-state="ADD_TO_CART"></button>'
+        b'<div class="priceView-hero-price"><span aria-hidden="true">$899.99</span></div>'
+        b'<script id="shop-specifications-6588662">{"specifications": {"categories": []}}</script>'
+    ) + b'<p>rest of the page</p>' * 100
+
+    response = stream_page(middleware, spider, body, chunk_size=64)
+    assert 'early_abort' not in response.flags
+    assert response.body == body
+    middleware.stats.inc_value.assert_called_with('early_abort/full_downloads')
+
+
+def test_early_abort_stops_decoding_uncuttable_pages():
+    spider = BestBuySpider()
+    middleware = EarlyAbortMiddleware(stats=MagicMock())
+    # The first regular price block has no price, so the page can't be cut
+    body = (
+        b'<button class="add-to-cart-button" data-sku-id="6588662" data-button-state="ADD_TO_CART"></button>'
+        b'<div class="priceView-hero-price"><span aria-hidden="true">$899.99</span></div>'
+        b'<div data-testid="regular-price"></div>'
+        b'<script id="shop-specifications-6588662">{"specifications": {"categories": []}}</script>'
+    )
+    request = Request(PRODUCT_URL, callback=spider.parse_product)
+    middleware.headers_received(Headers({}), -1, request, spider)
+    middleware.bytes_received(body, request, spider)
+    assert request not in middleware.streams
+    middleware.stats.inc_value.assert_called_with('early_abort/full_downloads')
+
+    middleware.bytes_received(b'<p>rest of the page</p>', request, spider)
+    response = HtmlResponse(url=PRODUCT_URL, body=body + b'<p>rest of the page</p>', encoding='utf-8', request=request)
+    assert middleware.process_response(request, response, spider) is response
+
+
+def test_early_abort_stops_buffering_pages_without_a_spec_script():
+    spider = BestBuySpider()
+    middleware = EarlyAbortMiddleware(stats=MagicMock(), max_scan_size=1024)
+    request = Request(PRODUCT_URL, callback=spider.parse_product)
+    middleware.headers_received(Headers({}), -1, request, spider)
+
+    middleware.bytes_received(b'<p>filler</p>' * 50, request, spider)
+    assert request in middleware.streams
+    middleware.bytes_received(b'<p>filler</p>' * 50, request, spider)
+    assert request not in middleware.streams
+    middleware.stats.inc_value.assert_called_with('early_abort/full_downloads')
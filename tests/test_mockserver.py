@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+import pytest
+from pathlib import Path
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from scrapy.http import HtmlResponse, Request
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from deal_scraper.mockserver import PRICE_ENDPOINT_PATH, MockBestBuyServer, make_catalog
+from deal_scraper.models import Base, LaptopTable, PriceHistoryTable
+from deal_scraper.pipelines import CleaningPipeline
+from deal_scraper.spiders.bestbuy_spider import BestBuySpider
+
+PROJECT_DIR = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def server():
+    server = MockBestBuyServer(('127.0.0.1', 0), catalog_size=30, page_size=12, page_size_kb=20, latency_ms=0, sold_out_ratio=0.2)
+    server.start_in_thread()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(url):
+    with urlopen(url) as f:
+        return HtmlResponse(url=url, body=f.read(), encoding='utf-8', request=Request(url))
+
+
+def test_catalog_is_reproducible():
+    assert make_catalog(50, seed=1) == make_catalog(50, seed=1)
+    assert make_catalog(50, seed=1) != make_catalog(50, seed=2)
+    assert sum(product.sold_out for product in make_catalog(1000, sold_out_ratio=0.25)) == pytest.approx(250, abs=50)
+
+
+def test_spider_crawls_the_mock_catalog(server):
+    spider = BestBuySpider(start_url=server.start_url)
+    assert spider.start_urls == [server.start_url]
+    assert spider.allowed_domains == ['127.0.0.1']
+
+    requests = list(spider.parse(fetch(server.start_url)))
+    listing_urls = [r.url for r in requests if r.callback == spider.parse]
+    product_urls = [r.url for r in requests if r.callback == spider.parse_product]
+    assert listing_urls == [f'{server.start_url}?cp=2', f'{server.start_url}?cp=3']
+    in_stock = [product for product in server.catalog[:12] if not product.sold_out]
+    assert product_urls == [f'{server.base_url}{product.path}?skuId={product.sku}' for product in in_stock]
+
+    product = in_stock[0]
+    item, = spider.parse_product(fetch(product_urls[0]))
+    item = CleaningPipeline().process_item(item, spider)
+    assert (item['sku'], item['upc'], item['price'], item['full_price']) == (product.sku, product.upc, product.price, product.regular_price)
+    assert item['system_memory_ram_gb'] == float(product.specs['System Memory (RAM)'].split()[0])
+
+
+def test_throttled_and_failed_requests():
+    server = MockBestBuyServer(('127.0.0.1', 0), catalog_size=5, latency_ms=0, throttle_rate=1.0)
+    server.start_in_thread()
+    try:
+        with pytest.raises(HTTPError) as e:
+            urlopen(server.start_url)
+        assert e.value.code == 429
+        assert e.value.headers['Retry-After'] == '1'
+        server.throttle_rate, server.error_rate = 0, 1.0
+        with pytest.raises(HTTPError) as e:
+            urlopen(server.start_url)
+        assert e.value.code == 500
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_price_endpoint_crawl_on_another_host(server, tmp_path):
+    # The stored product links are bestbuy.com ones, the endpoint is the mock server's
+    db_url = f'sqlite:///{tmp_path / "laptops.db"}'
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session, session.begin():
+        session.add_all([LaptopTable(upc=f'upc-{product.sku}', sku=product.sku) for product in server.catalog])
+    watchlist_file = tmp_path / 'upc_watchlist.json'
+    watchlist_file.write_text('[]')
+
+    result = subprocess.run(
+        [
+            sys.executable, '-m', 'scrapy', 'crawl', 'bestbuy_spider', '-a', 'mode=price_endpoint',
+            '-s', f'DATABASE_URL={db_url}',
+            '-s', f'WATCHLIST_FILENAME={watchlist_file}',
+            '-s', f'PRICE_ENDPOINT_URL={server.base_url}{PRICE_ENDPOINT_PATH}?skus={{skus}}',
+        ],
+        cwd=PROJECT_DIR, env=dict(os.environ, PYTHONPATH=str(PROJECT_DIR)), capture_output=True, text=True, timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+
+    with sessionmaker(bind=engine)() as session:
+        stored = session.scalar(select(func.count()).select_from(PriceHistoryTable))
+    engine.dispose()
+    assert stored == sum(not product.sold_out for product in server.catalog)
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from pathlib import Path
+from scrapy.http import HtmlResponse
+from deal_scraper.extractors import parse_product_page
+from deal_scraper.items import CleanedLaptopItem, LaptopItem
+from deal_scraper.parse_pool import ParsePool, parse_in_worker
+from deal_scraper.pipelines import CleaningPipeline
+from deal_scraper.spiders.bestbuy_spider import BestBuySpider
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+
+
+@pytest.fixture
+def product_page_body():
+    return (FIXTURES_DIR / 'bestbuy_product_page.html').read_bytes()
+
+
+def clean_in_process(fields):
+    return dict(CleaningPipeline().process_item(LaptopItem(**fields), spider=None))
+
+
+def test_worker_cleaning_matches_in_process(product_page_body):
+    fields = parse_product_page(product_page_body, sku='6588662')
+    fields.pop('variants')
+    fields.pop('sold_out_variants')
+    in_process = clean_in_process(fields)
+    from_worker = parse_in_worker(product_page_body, '6588662', 'utf-8', clean=True)
+
+    # The fixture page has no sibling variants
+    assert from_worker.pop('variants') == []
+    assert from_worker.pop('sold_out_variants') == []
+    assert from_worker == in_process
+    # A worker-cleaned item passes through CleaningPipeline unchanged
+    assert clean_in_process(from_worker) == in_process
+
+
+def test_pool_parse_matches_in_process(product_page_body):
+    async def parse_in_pool():
+        pool = ParsePool(workers=1, queue_depth=2, clean_in_workers=False)
+        try:
+            return await pool.parse(product_page_body, '6588662', 'utf-8')
+        finally:
+            pool.close()
+
+    assert asyncio.run(parse_in_pool()) == parse_product_page(product_page_body, sku='6588662')
+
+
+def test_worker_cleaned_items_are_not_cleaned_again(product_page_body, monkeypatch):
+    async def parse_in_pool(spider, response):
+        spider.parse_pool = ParsePool(workers=1, queue_depth=2, clean_in_workers=True)
+        try:
+            return [item async for item in spider.parse_product_in_pool(response)]
+        finally:
+            spider.parse_pool.close()
+
+    url = 'https://www.bestbuy.com/site/laptop/6588662.p?skuId=6588662'
+    response = HtmlResponse(url=url, body=product_page_body, encoding='utf-8')
+    [item] = asyncio.run(parse_in_pool(BestBuySpider(), response))
+    assert isinstance(item, CleanedLaptopItem)
+    fields = parse_product_page(product_page_body, sku='6588662')
+    fields.pop('variants')
+    fields.pop('sold_out_variants')
+    expected = clean_in_process(fields)
+
+    # Patched after the pool is gone, so this only counts cleaning on the reactor side
+    clean_steps = []
+    monkeypatch.setattr(CleaningPipeline, '_extract_specs', lambda self, adapter: clean_steps.append(adapter))
+    cleaned = dict(CleaningPipeline().process_item(item, spider=None))
+    assert clean_steps == []
+    assert cleaned.pop('link') == url
+    assert cleaned.pop('timestamp')
+    assert cleaned == expected
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta, timezone
+from deal_scraper.recrawl import due_products, recrawl_interval
+
+HOUR = timedelta(hours=1)
+WEEK = timedelta(days=7)
+NOW = datetime(2024, 6, 1, 12, tzinfo=timezone.utc)
+
+
+def history(prices, every):
+    """Price rows ending at NOW - every, one per interval."""
+    start = NOW - every * len(prices)
+    return [(start + every * i, price) for i, price in enumerate(prices)]
+
+
+def test_recrawl_interval_follows_price_change_rate():
+    # Changes every 6 hours -> checked every 3
+    assert recrawl_interval(history([500, 450, 500, 450, 500], every=6 * HOUR), HOUR, WEEK) == 3 * HOUR
+    # Changes every couple of minutes -> clamped to hourly
+    assert recrawl_interval(history([500, 450, 500], every=timedelta(minutes=2)), HOUR, WEEK) == HOUR
+    # Never changes -> weekly
+    assert recrawl_interval(history([500] * 10, every=timedelta(days=1)), HOUR, WEEK) == WEEK
+    assert recrawl_interval(history([500], every=timedelta(days=1)), HOUR, WEEK) == WEEK
+
+
+def test_recrawl_interval_accepts_naive_sqlite_timestamps():
+    observations = [(timestamp.replace(tzinfo=None), price) for timestamp, price in history([500, 450, 500], every=10 * HOUR)]
+    assert recrawl_interval(observations, HOUR, WEEK) == 5 * HOUR
+
+
+def test_due_products():
+    def rows(prices, every):
+        return [(timestamp, price, f'https://www.bestbuy.com/site/{price}.p') for timestamp, price in history(prices, every)]
+
+    due = due_products(
+        {
+            # Last seen 6h ago, due every 3h
+            'volatile': rows([500, 450, 500, 450, 500], every=6 * HOUR),
+            # Last seen a day ago, due weekly
+            'static': rows([500] * 5, every=timedelta(days=1)),
+            # Last seen 8 days ago, due weekly
+            'stale': rows([500] * 2, every=timedelta(days=8)),
+            'no_history': [],
+        },
+        NOW, HOUR, WEEK,
+    )
+    assert [(sku, link) for sku, link, _ in due] == [
+        ('no_history', None),
+        ('stale', 'https://www.bestbuy.com/site/500.p'),
+        ('volatile', 'https://www.bestbuy.com/site/500.p'),
+    ]
@@ -0,0 +1,109 @@
+import asyncio
+import gzip
+from pathlib import Path
+from scrapy.http import HtmlResponse, XmlResponse
+from scrapy.utils.test import get_crawler
+from deal_scraper.checkpoint import CrawlCheckpoint
+from deal_scraper.sitemaps import iter_sitemap
+from deal_scraper.spiders.bestbuy_spider import BestBuySpider
+
+SITEMAP_INDEX = b'''<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://sitemaps.bestbuy.com/sitemap_pdp_1.xml.gz</loc></sitemap>
+  <sitemap><loc>https://sitemaps.bestbuy.com/sitemap_pdp_2.xml.gz</loc></sitemap>
+  <sitemap><loc>https://sitemaps.bestbuy.com/sitemap_category_1.xml.gz</loc></sitemap>
+</sitemapindex>'''
+
+
+def make_urlset(urls):
+    entries = ''.join(f'<url><loc>{url}</loc><lastmod>2024-05-01</lastmod></url>' for url in urls)
+    xml = f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{entries}</urlset>'
+    return gzip.compress(xml.encode('utf-8'))
+
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures'
+
+PRODUCT_URLS = [
+    'https://www.bestbuy.com/site/lenovo-ideapad-1-15-fhd-laptop-ryzen-5/6588662.p?skuId=6588662',
+    'https://www.bestbuy.com/site/samsung-65-class-qled-tv/6500001.p?skuId=6500001',
+    'https://www.bestbuy.com/site/macbook-air-13-inch-apple-m3-chip/6500002.p?skuId=6500002',
+    'https://www.bestbuy.com/site/lenovo-ideapad-1-15-fhd-laptop-ryzen-5/6588662.p?skuId=6588662',
+    'https://www.bestbuy.com/site/gift-cards/best-buy-gift-card/pcmcat1234.c?id=pcmcat1234',
+]
+
+
+def test_iter_sitemap_index():
+    assert list(iter_sitemap(SITEMAP_INDEX)) == [
+        ('sitemap', 'https://sitemaps.bestbuy.com/sitemap_pdp_1.xml.gz'),
+        ('sitemap', 'https://sitemaps.bestbuy.com/sitemap_pdp_2.xml.gz'),
+        ('sitemap', 'https://sitemaps.bestbuy.com/sitemap_category_1.xml.gz'),
+    ]
+
+
+def test_iter_sitemap_streams_large_gzipped_urlset():
+    urls = [f'https://www.bestbuy.com/site/laptop-{sku}/{sku}.p?skuId={sku}' for sku in range(6000000, 6050000)]
+    body = make_urlset(urls)
+
+    count = 0
+    for (kind, url), expected in zip(iter_sitemap(body), urls):
+        assert kind == 'url' and url == expected
+        count += 1
+    assert count == len(urls)
+
+
+def make_sitemap_spider():
+    crawler = get_crawler(BestBuySpider, {'SITEMAP_URLS': 'https://sitemaps.bestbuy.com/sitemaps_pdp.xml'})
+    spider = BestBuySpider.from_crawler(crawler, mode='sitemap')
+
+    async def collect():
+        return [request async for request in spider.start()]
+
+    return spider, asyncio.run(collect())
+
+
+def test_sitemap_mode_discovers_products():
+    spider, start_requests = make_sitemap_spider()
+    index_request, = start_requests
+    assert index_request.callback == spider.parse_sitemap
+
+    index = XmlResponse(url=index_request.url, body=SITEMAP_INDEX, request=index_request)
+    child_requests = list(spider.parse_sitemap(index))
+    assert [r.url for r in child_requests] == [
+        'https://sitemaps.bestbuy.com/sitemap_pdp_1.xml.gz',
+        'https://sitemaps.bestbuy.com/sitemap_pdp_2.xml.gz',
+    ]
+    assert all(r.callback == spider.parse_sitemap for r in child_requests)
+
+    urlset = XmlResponse(url=child_requests[0].url, body=make_urlset(PRODUCT_URLS), request=child_requests[0])
+    product_requests = list(spider.parse_sitemap(urlset))
+    # Whatever their slug says, every product page is fetched and parse_product checks its category
+    assert [r.url for r in product_requests] == [
+        'https://www.bestbuy.com/site/lenovo-ideapad-1-15-fhd-laptop-ryzen-5/6588662.p?skuId=6588662',
+        'https://www.bestbuy.com/site/samsung-65-class-qled-tv/6500001.p?skuId=6500001',
+        'https://www.bestbuy.com/site/macbook-air-13-inch-apple-m3-chip/6500002.p?skuId=6500002',
+    ]
+    assert all(r.callback == spider.parse_product for r in product_requests)
+
+
+def test_sitemap_mode_only_stores_laptops():
+    spider, _ = make_sitemap_spider()
+    url = 'https://www.bestbuy.com/site/lenovo-ideapad-1-15-fhd-laptop-ryzen-5/6588662.p?skuId=6588662'
+    laptop_page = (FIXTURES_DIR / 'bestbuy_product_page.html').read_bytes()
+    item, = spider.parse_product(HtmlResponse(url=url, body=laptop_page, encoding='utf-8'))
+    assert item['sku'] == '6588662'
+
+    # The same page filed under Laptop Accessories
+    backpack_page = laptop_page.replace(b'abcat0502000', b'abcat0515000')
+    assert list(spider.parse_product(HtmlResponse(url=url, body=backpack_page, encoding='utf-8'))) == []
+    assert spider.crawler.stats.get_value('bestbuy/off_category_product_pages') == 1
+
+
+def test_sitemap_mode_resumes_pending_sitemaps(tmp_path):
+    spider, _ = make_sitemap_spider()
+    spider.checkpoint = CrawlCheckpoint(str(tmp_path / 'checkpoint.json'))
+    request = spider.listing_request('https://sitemaps.bestbuy.com/sitemap_pdp_1.xml.gz', meta={'sitemap': True})
+    spider.checkpoint.finish_listing('https://sitemaps.bestbuy.com/sitemaps_pdp.xml')
+
+    resumed, = spider.resume_requests()
+    assert resumed.url == request.url
+    assert resumed.callback == spider.parse_sitemap
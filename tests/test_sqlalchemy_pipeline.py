@@ -1,12 +1,15 @@
 import pytest
 from unittest.mock import MagicMock, patch
-from deal_scraper.pipelines import SQLAlchemyPipeline
-from deal_scraper.items import LaptopItem
+from deal_scraper.pipelines import SQLAlchemyPipeline, CommitRecord
+from scrapy.exceptions import DropItem
+from deal_scraper.items import LaptopItem, PriceItem
+from deal_scraper.models import LaptopTable, PriceHistoryTable
+from datetime import datetime
 
 def test_sqlalchemy_pipeline_process_item():
     # Arrane
     mock_session = MagicMock()
-    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=10, upc_watchlist=[])
+    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=10, upc_watchlist=[], alert_discount_threshold=0)
     pipeline.session = mock_session
 
     item = LaptopItem(upc='123456789', price=999.99, full_price=1299.99)
@@ -30,10 +33,114 @@ def test_send_email_alert():
             'smtp_port': 587
         },
         batch_size=10, 
-        upc_watchlist=[]
+        upc_watchlist=[],
+        alert_discount_threshold=0
     )
     
     with patch('smtplib.SMTP') as mock_smtp:
         pipeline.send_email_alert('email@d.com', 'subject', 'body')
 
     mock_smtp.assert_called_with('smtp.gmail.com', 587)
+
+
+def test_price_item_uses_stored_laptop():
+    mock_session = MagicMock()
+    mock_session.query.return_value.filter_by.return_value.first.return_value = MagicMock(upc='123456789')
+    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=10, upc_watchlist=[], alert_discount_threshold=0)
+    pipeline.session = mock_session
+
+    item = PriceItem(sku='6588662', price=899.99, full_price=999.99)
+    pipeline.process_item(item, spider=None)
+
+    mock_session.query.return_value.filter_by.assert_called_with(sku='6588662')
+    mock_session.add.assert_called_once()
+    assert item['upc'] == '123456789'
+    assert pipeline.pending_commits == [CommitRecord(sku='6588662', upc='123456789')]
+
+
+def test_price_item_for_unknown_sku_is_dropped():
+    mock_session = MagicMock()
+    mock_session.query.return_value.filter_by.return_value.first.return_value = None
+    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=10, upc_watchlist=[], alert_discount_threshold=0)
+    pipeline.session = mock_session
+
+    with pytest.raises(DropItem):
+        pipeline.process_item(PriceItem(sku='6588662', price=899.99), spider=None)
+
+
+def test_only_price_changes_are_stored(tmp_path):
+    pipeline = SQLAlchemyPipeline(db_url=f'sqlite:///{tmp_path / "laptops.db"}', mismatch_log='fake.txt', email_config={}, batch_size=10, upc_watchlist=[], alert_discount_threshold=0)
+    spider = MagicMock(only_price_changes=True, checkpoint=None)
+    pipeline.open_spider(spider)
+    laptop = LaptopTable(upc='123456789', sku='6588662')
+    laptop.price_history = [PriceHistoryTable(price=899.99, full_price=999.99, timestamp=datetime(2024, 1, 1))]
+    pipeline.session.add(laptop)
+    pipeline.session.commit()
+
+    with pytest.raises(DropItem):
+        pipeline.process_item(PriceItem(sku='6588662', price=899.99, full_price=999.99), spider)
+
+    pipeline.process_item(PriceItem(sku='6588662', price=849.99, full_price=999.99), spider)
+    pipeline.close_spider(spider)
+
+    session = pipeline.Session()
+    prices = [row.price for row in session.query(PriceHistoryTable).order_by(PriceHistoryTable.id)]
+    session.close()
+    assert prices == [899.99, 849.99]
+
+
+def test_partial_batch_commits_when_spider_goes_idle():
+    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=10, upc_watchlist=[], alert_discount_threshold=0)
+    pipeline.session = MagicMock()
+    spider = MagicMock()
+    pipeline.pending_commits = [CommitRecord(sku='6588662', upc='123456789')]
+
+    pipeline.spider_idle(spider)
+
+    pipeline.session.commit.assert_called_once()
+    spider.frontier.complete.assert_called_once_with(['6588662'])
+    spider.dead_letters.resolve.assert_called_once_with(['6588662', None])
+    assert pipeline.pending_commits == []
+
+
+def test_failed_batch_keys_are_not_reported_by_the_next_batch():
+    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=10, upc_watchlist=[], alert_discount_threshold=0)
+    pipeline.session = MagicMock()
+    pipeline.session.commit.side_effect = [Exception('database is locked'), None]
+    spider = MagicMock()
+
+    pipeline.pending_commits = [CommitRecord(sku='1000001', link='https://www.bestbuy.com/site/1000001.p?skuId=1000001')]
+    pipeline.commit_batch(spider)
+    pipeline.session.rollback.assert_called_once()
+    spider.checkpoint.commit.assert_not_called()
+    spider.frontier.complete.assert_not_called()
+    spider.dead_letters.resolve.assert_not_called()
+    assert pipeline.pending_commits == []
+
+    pipeline.pending_commits = [CommitRecord(sku='1000002')]
+    pipeline.commit_batch(spider)
+    assert list(spider.checkpoint.commit.call_args.args[0]) == ['1000002']
+    spider.frontier.complete.assert_called_once_with(['1000002'])
+    spider.dead_letters.resolve.assert_called_once_with(['1000002', None])
+
+
+def test_dropped_items_complete_their_frontier_pages():
+    pipeline = SQLAlchemyPipeline(db_url='fake', mismatch_log='fake.txt', email_config={}, batch_size=2, upc_watchlist=[], alert_discount_threshold=0)
+    pipeline.session = MagicMock()
+    pipeline.session.query.return_value.filter_by.return_value.first.return_value = None
+    spider = MagicMock()
+
+    # Zero price, and a price update for a laptop that isn't stored
+    with pytest.raises(DropItem):
+        pipeline.process_item(PriceItem(sku='1000001', price=0), spider)
+    spider.frontier.complete.assert_not_called()
+    with pytest.raises(DropItem):
+        pipeline.process_item(PriceItem(sku='1000002', price=899.99, full_price=999.99), spider)
+    spider.frontier.complete.assert_called_once_with(['1000001', '1000002'])
+    assert pipeline.dropped_keys == []
+
+    # A partial batch of drops is completed when the spider goes idle, even with nothing to commit
+    with pytest.raises(DropItem):
+        pipeline.process_item(PriceItem(link='https://www.bestbuy.com/site/1000003.p?skuId=1000003', price=0), spider)
+    pipeline.spider_idle(spider)
+    spider.frontier.complete.assert_called_with(['https://www.bestbuy.com/site/1000003.p?skuId=1000003'])